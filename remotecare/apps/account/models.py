@@ -38,9 +38,8 @@ from core.models import DateField, YesNoChoiceField,\
     EncryptedHMACLookupCharField, EncryptedHMACLookupEmailField,\
     EncryptedCharField, AuditBaseModel
 from django.utils.translation import ugettext as _
-from apps.rcmessages.models import RCMessage
 from apps.lists.models import Hospital
-from apps.questionnaire.models import QuestionnaireRequest
+from apps.utils.counters import get_counters
 from apps.healthperson.models import HealthPerson
 from django.utils.functional import cached_property
 
@@ -154,6 +153,34 @@ class EncryptionKey(models.Model):
 
         return cls.get_with_user_id(user_id)
 
+    @classmethod
+    def update_cached_healthperson_key_ids(cls):
+        from apps.healthperson.models import HealthPerson
+        cache.set('healthperson_key_ids',
+                  dict(HealthPerson.objects.values_list(
+                      'id', 'user__personal_encryption_key')))
+
+    @classmethod
+    def get_id_with_healthperson_id(cls, healthperson_id):
+        """
+        Args:
+            - healthperson_id: the id of the healthperson
+
+        Returns:
+            The id of the personal EncryptionKey of the user of the
+            healthperson, retrieved from the cache
+        """
+        if 'healthperson_key_ids' not in cache:
+            cls.update_cached_healthperson_key_ids()
+
+        cached_key_ids = cache.get('healthperson_key_ids')
+        # The user of a new healthperson can be added after caching
+        if cached_key_ids.get(healthperson_id) is None:
+            cls.update_cached_healthperson_key_ids()
+            cached_key_ids = cache.get('healthperson_key_ids')
+
+        return cached_key_ids[healthperson_id]
+
 
 class User(AbstractBaseUser, PermissionsMixin, AuditBaseModel):
     '''
@@ -316,18 +343,19 @@ class User(AbstractBaseUser, PermissionsMixin, AuditBaseModel):
     @property
     def new_questionnaire_request(self):
         """
-        Returns true if the patient has no questionnaire requests
+        Returns true if the patient has questionnaire requests, see
+        :mod:`apps.utils.counters`
         """
-        return not QuestionnaireRequest.objects.filter(
-            patient=self.healthperson).count() == 0
+        return get_counters(
+            self.healthperson_id).questionnaire_requests != 0
 
     @property
     def new_message_count(self):
         """
-        Returns the amount of unread messages
+        Returns the amount of unread messages the patient can see,
+        see :mod:`apps.utils.counters`
         """
-        count = RCMessage.objects.filter(
-            read_on__isnull=True, patient=self.healthperson).count()
+        count = get_counters(self.healthperson_id).unread_messages
 
         if count == 0:
             return 'no'
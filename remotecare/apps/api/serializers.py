@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+from collections import OrderedDict
+from itertools import chain
+from django.db.models.fields.related import OneToOneField
 from rest_framework import serializers
 from apps.account.models import User
 from apps.questionnaire.models import QuestionnaireRequest, RequestStep
@@ -18,4 +21,148 @@ class UserSerializer(serializers.ModelSerializer):
 class QuestionnaireSerializer(serializers.ModelSerializer):
     class Meta:
         model = QuestionnaireRequest
-        fields = ('id', 'urgent', 'created_on', 'finished_on', 'handled_on', 'deadline')
\ No newline at end of file
+        fields = ('id', 'urgent', 'created_on', 'finished_on', 'handled_on', 'deadline')
+
+
+class QuestionnaireSerializationPlan(object):
+    """
+    The serialization of the answers of a questionnaire model, created
+    once per model (see :func:`get_serialization_plan`). Contains the
+    fields with their verbose names, the choice labels per field and
+    the many to many relations, so serializing questionnaires is a loop
+    over values() rows with one query per many to many relation.
+    """
+    def __init__(self, model_class):
+        self.model_class = model_class
+        # (attname, verbose_name, choice labels, is one to one,
+        #  index in m2m_fields or None)
+        self.fields = []
+        # (related model, related query name)
+        self.m2m_fields = []
+
+        opts = model_class._meta
+        fields = {}
+        for field in chain(opts.concrete_fields, opts.private_fields,
+                           opts.many_to_many):
+            if getattr(field, 'editable', False):
+                fields[field.name] = field
+        del fields['id']
+        del fields['request_step']
+
+        # Keep the order of model_to_dict, the last field wins for
+        # fields with the same verbose name.
+        for field in fields.values():
+            labels = None
+            m2m_index = None
+            if field.many_to_many:
+                m2m_index = len(self.m2m_fields)
+                self.m2m_fields.append(
+                    (field.related_model, field.related_query_name()))
+            elif (not isinstance(field, OneToOneField) and
+                    len(field.choices) > 0):
+                labels = {}
+                for (value, label) in field.choices:
+                    labels.setdefault(value, label)
+            self.fields.append((
+                field.attname, field.verbose_name, labels,
+                isinstance(field, OneToOneField), m2m_index))
+
+    def get_m2m_names(self, pks):
+        """
+        Args:
+            - pks: the primary keys of the questionnaires
+
+        Returns:
+            A list with a dict per many to many relation containing the
+            list of names per questionnaire primary key
+        """
+        m2m_names = []
+        for (related_model, query_name) in self.m2m_fields:
+            names = {}
+            for (pk, name) in related_model._default_manager.filter(**{
+                    query_name + '__in': pks}).values_list(
+                    query_name, 'name'):
+                names.setdefault(pk, []).append(name)
+            m2m_names.append(names)
+        return m2m_names
+
+    def serialize(self, request_steps):
+        """
+        Serialize the answers of the questionnaires of the request steps
+
+        Args:
+            - request_steps: the request steps with this model
+
+        Returns:
+            A dict with the answers per request step id, the keys of the
+            answers are the verbose names of the fields.
+        """
+        attnames = [field[0] for field in self.fields if field[4] is None]
+        rows = list(self.model_class.objects.filter(
+            request_step__in=request_steps).values(
+            'pk', 'request_step_id', *attnames))
+        m2m_names = self.get_m2m_names([row['pk'] for row in rows])
+
+        data = {}
+        for row in rows:
+            new_data = {}
+            for (attname, verbose_name, labels, one_to_one, m2m_index) in\
+                    self.fields:
+                if m2m_index is not None:
+                    value = m2m_names[m2m_index].get(row['pk'], [])
+                else:
+                    value = row[attname]
+                    if value is not None:
+                        if one_to_one:
+                            continue
+                        if labels is not None:
+                            value = labels.get(value, value)
+                new_data[verbose_name] = value
+            data[row['request_step_id']] = new_data
+        return data
+
+
+# The serialization plans per questionnaire model class
+SERIALIZATION_PLANS = {}
+
+
+def get_serialization_plan(model_class):
+    """
+    Args:
+        - model_class: the questionnaire model class
+
+    Returns:
+        The (cached) QuestionnaireSerializationPlan for the model class
+    """
+    if model_class not in SERIALIZATION_PLANS:
+        SERIALIZATION_PLANS[model_class] = QuestionnaireSerializationPlan(
+            model_class)
+    return SERIALIZATION_PLANS[model_class]
+
+
+def serialize_request_steps(request_steps):
+    """
+    Serialize the answers of the request steps with one values() query
+    per questionnaire model and one query per many to many relation.
+
+    Args:
+        - request_steps: the request steps to serialize
+
+    Returns:
+        A list with the name, step_nr and answers (data) per request step
+    """
+    request_steps_per_model = OrderedDict()
+    for request_step in request_steps:
+        request_steps_per_model.setdefault(
+            request_step.model_class, []).append(request_step)
+
+    data = {}
+    for model_class, model_request_steps in\
+            request_steps_per_model.items():
+        data.update(get_serialization_plan(model_class).serialize(
+            model_request_steps))
+
+    return [{'name': request_step.model_class.display_name,
+             'step_nr': request_step.step_nr,
+             'data': data.get(request_step.id, {})}
+            for request_step in request_steps]
@@ -2,7 +2,8 @@
 import datetime
 from django.contrib.auth.models import Group
 from apps.account.models import User, EncryptionKey
-from apps.api.serializers import QuestionnaireSerializer
+from apps.api.serializers import QuestionnaireSerializer,\
+    serialize_request_steps
 from apps.questionnaire.models import QuestionnaireRequest, get_model_class
 
 from rest_framework import status
@@ -20,9 +21,6 @@ from django.conf import settings
 from apps.api.models import TempPatientData, PatientCoupling, HealthProfessionalCoupling
 from apps.healthperson.healthprofessional.models import HealthProfessional
 from apps.lists.models import Hospital
-from django.forms.models import model_to_dict
-from core.models import ChoiceOtherField, ManyToManyField
-from django.db.models.fields.related import OneToOneField
 
 class MissingParameters(Exception):
     pass
@@ -370,42 +368,6 @@ class QuestionnaireDetails(APIView):
     """
     List all questionnaires for a given external_patient_id
     """
-    def process_request_step(self, request_step):
-        questionnaire = request_step.questionnaire
-        new_data = {}
-        if questionnaire is not None:
-            data = model_to_dict(questionnaire)
-            del data['id']
-            del data['request_step']
-
-            new_data = {}
-            for attname in data:
-                field = questionnaire._meta.get_field_by_name(attname)[0]
-                value = data[attname]
-
-                process = True
-                if value is not None:
-                    if isinstance(field, OneToOneField):
-                        process = False
-                    elif isinstance(field, ChoiceOtherField):
-                        test_value = [x[1] for x in field.choices if x[0] == value]
-                        if len(test_value) > 0:
-                            value = test_value[0]
-                    elif isinstance(field, ManyToManyField):
-                        manager = getattr(questionnaire, field.attname)
-                        value = [x[0] for x in manager.all().values_list('name')]
-                    elif hasattr(field, 'choices') and len(field.choices) > 0:
-                        value = [x[1] for x in field.choices if x[0] == value][0]
-
-                if process:
-                    new_data.update({field.verbose_name: value})
-
-        data = {'name': request_step.model_class.display_name,
-                'step_nr': request_step.step_nr,
-                'data': new_data}
-
-        return data
-
     def get(self, request, username, external_patient_id, questionnaire_id,  format=None):
 
         try:
@@ -424,9 +386,7 @@ class QuestionnaireDetails(APIView):
         serializer = QuestionnaireSerializer(questionnaire_request, many=False)
 
         data = serializer.data
-        qr_data = []
-        for request_step in questionnaire_request.requeststep_set.all().order_by('step_nr'):
-            qr_data.append(self.process_request_step(request_step))
-        data.update({'steps': qr_data})
+        data.update({'steps': serialize_request_steps(
+            questionnaire_request.request_steps)})
 
         return Response(data)
@@ -64,7 +64,7 @@ class AuthenticationTest(BaseUnitTest):
         self.assertEqual(self.SMS_STORE[0]['recipients'],
                          user.mobile_number)
 
-        sms_code = settings.SMS_STORE[0]['message']
+        sms_code = self.SMS_STORE[0]['message']
         hmac_sms_code = create_hmac(settings.SMS_KEY, str(sms_code))
 
         change_request = PasswordChangeRequest.objects.get(user=user)
@@ -126,7 +126,8 @@ class HealthProfessionalIndexView(BaseIndexTemplateView,
         #    extra_filter_base)
 
         controles = QuestionnaireRequest.objects.filter(
-            controle_filter).order_by('-finished_on')
+            controle_filter).select_related(
+            'patient__user').order_by('-finished_on')
 
         self.urgent_patient_controles = []
         self.controles = []
@@ -164,7 +165,7 @@ class HealthProfessionalIndexView(BaseIndexTemplateView,
 
         try:
             message = get_all_messages_for_healthprofessional(
-                self.healthprofessional)[0]
+                self.healthprofessional).list_fields()[0]
         except IndexError:
             message = None
 
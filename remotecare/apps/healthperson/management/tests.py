@@ -6,6 +6,7 @@ these functions are all tested here.
 
 :subtitle:`Class definitions:`
 """
+import json
 from datetime import date
 from django.core.urlresolvers import reverse
 from core.unittest.baseunittest import BaseUnitTest
@@ -13,6 +14,7 @@ from apps.healthperson.healthprofessional.models import HealthProfessional
 from apps.healthperson.patient.models import Patient
 from apps.healthperson.secretariat.models import Secretary
 from apps.lists.models import Hospital
+from apps.service.runner import Stage, StageOutput, run_stages
 
 
 class ManagementTest(BaseUnitTest):
@@ -350,6 +352,52 @@ class ManagementTest(BaseUnitTest):
         self.assertEqual(secretary.user.is_active, False)
         self.assertNotEqual(secretary.user.deleted_on, None)
 
+    def check_job_runs(self):
+        """
+        Checks the history and the JSON trends of the daily runs
+        """
+        def fail(patients):
+            raise ValueError('failed')
+
+        stages = [
+            Stage('scan_patients', Patient.objects.all,
+                  lambda patients: StageOutput()),
+            Stage('fail_patients', Patient.objects.all, fail)]
+        run_stages(stages)
+        run_stages(stages, names=['scan_patients'], dry_run=True)
+
+        res = self.get('/')
+        session_key = self.get_session_key(
+            res.context_data['manager'].health_person_id)
+        res = self.get(reverse('manager_job_runs', args=[session_key]))
+        job_runs = res.context['job_runs']
+        self.assertEqual(len(job_runs), 2)
+        self.assertTrue(job_runs[0].dry_run)
+        self.assertFalse(job_runs[0].failed)
+        self.assertTrue(job_runs[1].failed)
+        stage_runs = job_runs[1].stages.all()
+        self.assertEqual([stage_run.name for stage_run in stage_runs],
+                         ['scan_patients', 'fail_patients'])
+        self.assertEqual(stage_runs[0].scanned, Patient.objects.count())
+        self.assertEqual(stage_runs[0].acted, Patient.objects.count())
+        self.assertEqual(stage_runs[1].scanned, 0)
+        self.assertEqual(stage_runs[1].failures, 1)
+        self.assertIn('failed', stage_runs[1].errors)
+
+        res = self.get(
+            reverse('manager_job_runs_json', args=[session_key]) +
+            '?days=7')
+        self.assertEqual(res['Content-Type'], 'application/json')
+        trends = json.loads(res.content)
+        self.assertEqual(trends['days'], 7)
+        runs = trends['stages']['scan_patients']['runs']
+        self.assertEqual([run['dry_run'] for run in runs], [False, True])
+        self.assertEqual(
+            trends['stages']['scan_patients']['max_seconds'],
+            max([run['seconds'] for run in runs]))
+        self.assertEqual(
+            trends['stages']['fail_patients']['runs'][0]['failures'], 1)
+
     def test_management(self):
         """
         Manager checks runner, performs all check definitions.
@@ -399,6 +447,9 @@ class ManagementTest(BaseUnitTest):
         # Check own personalia view/edit pages
         self.check_personalia()
 
+        # Check the history of the daily runs
+        self.check_job_runs()
+
         # Check adding a new patient
         self.add_new_patient()
 
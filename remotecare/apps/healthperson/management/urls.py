@@ -1,7 +1,7 @@
 from django.conf.urls import url
 
 from apps.healthperson.management.views import ManagerPersonaliaView,\
-    ManagerPersonaliaEdit
+    ManagerPersonaliaEdit, JobRunsView, JobRunsJSONView
 
 urlpatterns = (
     url('^(?P<manager_session_id>\S+)/view/personalia/$',
@@ -10,4 +10,10 @@ urlpatterns = (
     url('^(?P<manager_session_id>\S+)/edit/personalia/$',
         ManagerPersonaliaEdit.as_view(),
         name='manager_edit_personalia'),
+    url('^(?P<manager_session_id>\S+)/jobruns/$',
+        JobRunsView.as_view(),
+        name='manager_job_runs'),
+    url('^(?P<manager_session_id>\S+)/jobruns/json/$',
+        JobRunsJSONView.as_view(),
+        name='manager_job_runs_json'),
 )
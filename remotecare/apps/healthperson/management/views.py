@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 """
-This module contains all views used by a manager.
+This module contains all views used by a manager, including the
+history of the daily service runs (see :mod:`apps.service.runner`).
 
 :subtitle:`Class definitions:`
 """
+import json
+from datetime import timedelta
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.urlresolvers import reverse
 from apps.healthperson.management.forms import ProfileEditForm
@@ -14,9 +17,12 @@ from apps.healthperson.healthprofessional.models import HealthProfessional,\
     SPECIALISM_CHOICES
 from apps.healthperson.secretariat.models import Secretary
 from apps.account.models import User
+from apps.utils.models import JobRun, StageRun
 
 from core.encryption.hash import create_hmac
 from django.conf import settings
+from django.http import HttpResponse
+from django.utils import timezone
 
 from apps.base.views import BaseIndexTemplateView
 from django.views.generic.base import TemplateView, View
@@ -144,3 +150,59 @@ class ManagerPersonaliaEdit(ManagerBaseView, FormView):
         # save user
         user.save()
         return super(ManagerPersonaliaEdit, self).form_valid(form)
+
+
+class JobRunsView(ManagerBaseView, TemplateView):
+    """
+    Shows the last runs of the daily service stages with the duration
+    and counts per stage
+    """
+    template_name = 'management/job_runs.html'
+    # The number of runs to show
+    max_runs = 30
+
+    def get_context_data(self, **kwargs):
+        context = super(JobRunsView, self).get_context_data(**kwargs)
+        context.update({
+            'submenu': 'job_runs',
+            'job_runs': JobRun.objects.prefetch_related(
+                'stages')[:self.max_runs]})
+        return context
+
+
+class JobRunsJSONView(ManagerBaseView, View):
+    """
+    Returns the trends of the daily service stages as JSON, per stage
+    the runs of the last days (30 or the days GET parameter) and the
+    average and maximum duration, so a stage which gets slower shows up.
+    """
+    def get(self, *args, **kwargs):
+        try:
+            days = max(1, int(self.request.GET.get('days', 30)))
+        except ValueError:
+            days = 30
+        stage_runs = StageRun.objects.filter(
+            started_on__gte=timezone.now() - timedelta(days=days)
+        ).select_related('job_run').order_by('started_on', 'id')
+
+        stages = {}
+        for stage_run in stage_runs:
+            stage = stages.setdefault(stage_run.name, {'runs': []})
+            stage['runs'].append({
+                'started_on': stage_run.started_on.isoformat(),
+                'dry_run': stage_run.job_run.dry_run,
+                'full_scan': stage_run.job_run.full_scan,
+                'seconds': stage_run.seconds,
+                'scanned': stage_run.scanned,
+                'acted': stage_run.acted,
+                'messages': stage_run.messages,
+                'failures': stage_run.failures})
+        for stage in stages.values():
+            seconds = [run['seconds'] for run in stage['runs']]
+            stage.update({
+                'average_seconds': sum(seconds) / len(seconds),
+                'max_seconds': max(seconds)})
+
+        response = json.dumps(
+            {'days': days, 'stages': stages}, sort_keys=True, indent=4)
+        return HttpResponse(response, content_type='application/json')
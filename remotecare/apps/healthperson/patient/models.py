@@ -19,6 +19,8 @@ from apps.healthperson.healthprofessional.models import HealthProfessional
 from apps.healthperson.models import HealthPerson
 from core.models import ChoiceOtherField, AuditBaseModel
 from django.utils.functional import cached_property
+from polymorphic.managers import PolymorphicManager
+from polymorphic.query import PolymorphicQuerySet
 
 DIAGNOSIS_CHOICES = (
     ('rheumatoid_arthritis', ('Reumatoide artritis')),
@@ -78,10 +80,44 @@ def add_weken(number):
     return rt
 
 
+class PatientQuerySet(PolymorphicQuerySet):
+    '''
+    Queryset with the control schedule annotations for patients
+    '''
+    def with_control_schedule(self):
+        """
+        Annotates the date of the last finished (non urgent) control and
+        the last blood sample date with subqueries, so
+        last_questionnaire_date, next_questionnaire_date,
+        last_blood_taken_date and include_blood_taken_questions don't
+        need a query per patient.
+
+        Returns:
+            The annotated queryset
+        """
+        from apps.questionnaire.models import QuestionnaireRequest
+        from apps.questionnaire.default.models import FinishQuestionnaire
+
+        last_questionnaire = QuestionnaireRequest.objects.filter(
+            patient=models.OuterRef('pk'), finished_on__isnull=False,
+            urgent=False).order_by('-id').values('finished_on')[:1]
+        last_finish_questionnaire = FinishQuestionnaire.objects.filter(
+            request_step__questionnairerequest__patient=models.OuterRef(
+                'pk')).order_by('-id').values('blood_sample_date')[:1]
+
+        return self.annotate(
+            patient_last_questionnaire_date=models.Subquery(
+                last_questionnaire, output_field=models.DateField()),
+            patient_last_blood_taken_date=models.Subquery(
+                last_finish_questionnaire, output_field=models.DateField()))
+
+
 class Patient(HealthPerson, AuditBaseModel):
     '''
     Stores patient specific information.
     '''
+    objects = PolymorphicManager.from_queryset(PatientQuerySet)()
+
     rc_registration_number = models.CharField(
         max_length=128,
         unique=True)
@@ -342,6 +378,9 @@ class Patient(HealthPerson, AuditBaseModel):
         Returns:
             The last date when blood was taken or None
         """
+        if hasattr(self, 'patient_last_blood_taken_date'):
+            return self.patient_last_blood_taken_date
+
         from apps.questionnaire.default.models import FinishQuestionnaire
         # return the last date or None
         try:
@@ -7,8 +7,13 @@ that is not part of other apps
 """
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
+from django.core.management import call_command
+from StringIO import StringIO
 from core.unittest.baseunittest import BaseUnitTest
 from apps.rcmessages.models import RCMessage
+from apps.questionnaire.models import QuestionnaireRequest, RequestStep
+from apps.questionnaire.qol.models import QOLQuestionnaire
+from apps.utils.models import SearchToken
 from apps.healthperson.patient.models import Patient, add_weken
 
 
@@ -117,11 +122,86 @@ class PatientTest(BaseUnitTest):
         self.assertEqual(res.context_data['objects'][0].internal_message,
                          'ABCDEF message voor Frank')
 
+        # An inherited questionnaire, its parent row should not be
+        # indexed (and found) as QOLChronCUQuestionnaire
+        questionnaire_request = QuestionnaireRequest(
+            patient=patient, urgent=False,
+            practitioner=patient.current_practitioner,
+            finished_on=datetime.now())
+        questionnaire_request.changed_by_user = patient.user
+        questionnaire_request.save()
+        request_step = RequestStep.objects.create(
+            questionnairerequest=questionnaire_request, step_nr=0,
+            model='QOLQuestionnaire')
+        qol_questionnaire = QOLQuestionnaire(
+            request_step=request_step, hasproblems='yes',
+            other_problems='Slapeloosheid door de medicatie')
+        qol_questionnaire.changed_by_user = patient.user
+        qol_questionnaire.save()
+
+        # The questionnaires of the fixtures are not in the search index
+        out = StringIO()
+        call_command('update_questionnaire_search_index', stdout=out)
+        self.assertIn('Stored the search tokens of', out.getvalue())
+
         # try to find a questionnaire
         res = self.post('/search/', {'searchterm': 'bijster'},
                         check_status_code=False)
 
         self.assertEqual(len(res.context_data['objects']), 1)
+        questionnaire = res.context_data['objects'][0]
+        self.assertEqual(questionnaire.model_display_name,
+                         'Ziekteactiviteit')
+
+        # the inherited questionnaire is found once, as QOLQuestionnaire
+        res = self.post('/search/', {'searchterm': 'slapeloosheid'},
+                        check_status_code=False)
+        self.assertEqual(
+            [(found.__class__.__name__, found.pk)
+             for found in res.context_data['objects']],
+            [('QOLQuestionnaire', qol_questionnaire.pk)])
+        self.assertFalse(SearchToken.objects.filter(
+            model='QOLChronCUQuestionnaire',
+            object_id=qol_questionnaire.pk).exists())
+
+        # choice answers are found by their label, not by their value
+        field = questionnaire._meta.get_field('stool_freq')
+        label = dict(field.flatchoices)[questionnaire.stool_freq]
+        res = self.post('/search/', {'searchterm': label},
+                        check_status_code=False)
+        self.assertIn(questionnaire, res.context_data['objects'])
+        res = self.post('/search/', {'searchterm': questionnaire.stool_freq},
+                        check_status_code=False)
+        self.assertNotIn(questionnaire, res.context_data['objects'])
+
+        # The messages are found with the search index, the words of
+        # the search term are matched as a phrase of whole words
+        message.internal_message = u'<p>Uw uitslag is <b>goed</b>.</p>' +\
+            u'<p>Geen re&euml;le zorgen</p>'
+        message.save()
+        for searchterm, found in [('uitslag is goed', True),
+                                  ('GOED', True),
+                                  ('goed geen', True),
+                                  (u'reële zorgen', True),
+                                  ('is uitslag', False),
+                                  ('uitsl', False),
+                                  ('ABCDEF', False)]:
+            res = self.post('/search/', {'searchterm': searchterm},
+                            check_status_code=False)
+            self.assertEqual(message in res.context_data['objects'], found)
+
+        # Rebuild the search index of all messages
+        SearchToken.objects.all().delete()
+        out = StringIO()
+        call_command('update_message_search_index', stdout=out)
+        self.assertIn('Stored the search tokens of %s messages' %
+                      RCMessage.objects.count(), out.getvalue())
+        res = self.post('/search/', {'searchterm': 'goed'},
+                        check_status_code=False)
+        self.assertIn(message, res.context_data['objects'])
+        # no plaintext words are stored
+        self.assertFalse(SearchToken.objects.filter(
+            token__in=['goed', 'uitslag']).exists())
 
     def check_questionnaire_helper(self, url, count, test_value):
         """
@@ -143,6 +223,10 @@ class PatientTest(BaseUnitTest):
         """
         Check the filled-in questionnaire detail pages
         """
+        # The test data contains controls finished before the
+        # graphic scores were stored, add them like on deployment.
+        call_command('update_questionnaire_scores', stdout=StringIO())
+
         # Check 'Ziekteactiviteit'
         self.check_questionnaire_helper(
             base_url + 'questionnaire/disease_activity/',
@@ -242,6 +326,31 @@ class PatientTest(BaseUnitTest):
         del patient.patient_include_blood_taken_questions
         self.assertEqual(patient.include_blood_taken_questions, False)
 
+    def check_control_schedule(self):
+        """
+        Check that the control schedule annotations give the same
+        dates as the patient properties, with one query for all
+        patients.
+        """
+        def get_schedule(patient):
+            return (patient.last_questionnaire_date,
+                    patient.next_questionnaire_date,
+                    patient.last_blood_taken_date,
+                    patient.include_blood_taken_questions)
+
+        expected = dict((patient.pk, get_schedule(patient))
+                        for patient in Patient.objects.all())
+        self.assertTrue(
+            any([schedule[0] for schedule in expected.values()]))
+        self.assertTrue(
+            any([schedule[2] for schedule in expected.values()]))
+
+        with self.assertNumQueries(1):
+            schedules = dict(
+                (patient.pk, get_schedule(patient))
+                for patient in Patient.objects.with_control_schedule())
+        self.assertEqual(schedules, expected)
+
     def test_patient_functions(self):
         """
         Run all checks for a patient
@@ -258,3 +367,4 @@ class PatientTest(BaseUnitTest):
         self.check_account(base_url)
         self.check_search()
         self.check_model()
+        self.check_control_schedule()
@@ -28,13 +28,13 @@ from django.db.models import Q
 from apps.healthperson.utils import is_allowed_patient_admins,\
     is_allowed_patient, is_allowed_healthprofessional, login_url
 from apps.questionnaire.models import QuestionnaireRequest,\
-    QUESTIONNAIRE_EXCLUDE_LIST, get_model_class
+    QUESTIONNAIRE_EXCLUDE_LIST, get_model_class,\
+    AVAILABLE_QUESTIONNAIRES, search_questionnaires
 from apps.rcmessages.models import RCMessage
 
-from django.utils.html import strip_tags
-
 from apps.report.models import Report
 from apps.appointment.models import Appointment
+from apps.utils.counters import get_counters
 
 from django.contrib.sites.requests import RequestSite
 from core.encryption.random import randomkey
@@ -114,7 +114,7 @@ class PatientIndexView(BaseIndexTemplateView):
         # Get RCMessages
         rc_messages = get_all_messages_for_patient(patient)
 
-        message_unread_count = rc_messages.filter(read_on__isnull=True).count()
+        message_unread_count = get_counters(patient.id).unread_messages
 
         if patient.diagnose == 'intestinal_transplantation':
             self.template_name = 'patient/intestinal_transplantation.html'
@@ -141,10 +141,7 @@ class PatientIndexView(BaseIndexTemplateView):
         # message_unread_count = len(rc_messages)
 
         # add 2 read messages if count < 2
-        rc_messages = rc_messages.select_related(
-            'secretary__user',
-            'healthprofessional__user',
-            'patient__user').filter(
+        rc_messages = rc_messages.list_fields().with_senders().filter(
             patient=patient).order_by('-read_on', '-added_on')[:2]
 
         return [rc_messages, message_unread_count]
@@ -343,24 +340,22 @@ class PatientMessagesView(PatientBaseView, TemplateView):
         return self.get(*args, **kwargs)
 
     def get_context_data(self, **kwargs):
+        from apps.rcmessages.views import get_message_page,\
+            search_messages
         context = super(PatientMessagesView, self).get_context_data(**kwargs)
         messages = RCMessage.objects.filter(
             patient=self.patient).order_by('-added_on')
 
-        messages = messages.select_related(
-            'secretary__user',
-            'healthprofessional__user',
-            'patient__user')
+        messages = messages.with_senders()
 
         selected_message = None
 
-        if messages:
-            if self.request.GET and 'message' in self.request.GET:
-                try:
-                    message_id = int(str(self.request.GET['message']))
-                    selected_message = messages.get(id=message_id)
-                except RCMessage.DoesNotExist:
-                    selected_message = None
+        if self.request.GET and 'message' in self.request.GET:
+            try:
+                message_id = int(str(self.request.GET['message']))
+                selected_message = messages.get(id=message_id)
+            except (ValueError, RCMessage.DoesNotExist):
+                selected_message = None
 
         has_searched = False
 
@@ -380,20 +375,24 @@ class PatientMessagesView(PatientBaseView, TemplateView):
                 searchterm = self.request.session['last_searchterm']
 
             if len(searchterm) > 0:
-                for message in messages:
-                    if ((searchterm.lower() in
-                         message.internal_message.lower() or
-                         searchterm.lower() in message.subject.lower())):
-                        results.append(message)
+                results = search_messages(
+                    messages, self.patient.id, searchterm)
 
             messages = results
 
         if has_searched and len(messages) == 1:
             selected_message = messages[0]
 
+        cursor = next_cursor = None
+        if not has_searched:
+            # only the subjects of a page of messages
+            cursor = self.request.GET.get('before')
+            messages, next_cursor = get_message_page(messages, cursor)
+
         context.update({'submenu': 'message',
                         'has_searched': has_searched,
                         'rc_messages': messages,
+                        'cursor': cursor, 'next_cursor': next_cursor,
                         'selected_message': selected_message})
         return context
 
@@ -810,48 +809,47 @@ class SearchView(TemplateView):
         self.patient = self.request.user.healthperson
         return super(SearchView, self).dispatch(*args, **kwargs)
 
+    # The searched questionnaire categories, in the order of the results
+    search_categories = (
+        'Ziekteactiviteit', 'Kwaliteit van leven', 'Kwaliteit van zorg')
+
     # Helper function for getting all answers of
     # specific questionnaire categories
-    def get_inner_context(self, request, patient, model_display_name):
+    def get_inner_context(self, request, patient, searchterm):
         """
-        Gets the questionnaires to be included into the results.
+        Gets the questionnaires to be included into the results, with
+        the search index of the answers, see
+        :func:`apps.questionnaire.models.search_questionnaires`.
 
         Args:
             - request: the current request
             - patient: the patient who is searching
-            - model_display_name: the model_display_name of the questionnaire\
-              to search for.
+            - searchterm: the search term
 
         Returns:
-            a list of questionnaires
+            a list of the found questionnaires per category\
+            (search_categories), the newest control first
         """
-        questionnaire_requests = QuestionnaireRequest.objects.filter(
-            patient=patient, finished_on__isnull=False).order_by(
-            '-finished_on')
-
-        # Get the 'model_display_name' questionnaires..
-        disease_activity_questionnares = []
-        for questionnaire_request in questionnaire_requests:
-            questionnaire_all_steps =\
-                questionnaire_request.requeststep_set.all().order_by('step_nr')
-
-            for questionnaire_step in questionnaire_all_steps:
-                questionnaire_model_class = questionnaire_step.model_class
-                if ((questionnaire_model_class.display_name ==
-                     model_display_name)):
-                    questionnaire = questionnaire_model_class.objects.get(
-                        request_step=questionnaire_step)
-                    questionnaire.model_display_name = model_display_name
-                    disease_activity_questionnares.append(questionnaire)
-
-        return disease_activity_questionnares
+        model_names = [model for model, name in AVAILABLE_QUESTIONNAIRES
+                       if get_model_class(model).display_name in
+                       self.search_categories]
+        questionnaires = search_questionnaires(
+            patient.id, model_names, searchterm)
+        for questionnaire in questionnaires:
+            questionnaire.model_display_name = questionnaire.display_name
+        # the sort is stable, so the newest control stays first
+        questionnaires.sort(key=lambda questionnaire:
+                            self.search_categories.index(
+                                questionnaire.display_name))
+        return questionnaires
 
     def post(self, request, *args, **kwargs):
         """
         Execute the search for questionnaires and messages based on
         'searchterm'
         """
-        from apps.rcmessages.views import get_all_messages_for_patient
+        from apps.rcmessages.views import get_all_messages_for_patient,\
+            search_messages
         objects = []
 
         if 'searchterm' in request.POST:
@@ -860,44 +858,14 @@ class SearchView(TemplateView):
             if searchterm not in (None, ''):
                 rc_messages = get_all_messages_for_patient(self.patient)
 
-                searchterm = searchterm.lower()
-
                 # Search through messages
-                for rc_message in rc_messages:
-                    internal_message = strip_tags(
-                        rc_message.internal_message).lower()
-                    if searchterm in internal_message:
-                        objects.append(rc_message)
+                objects += search_messages(
+                    rc_messages, self.patient.id, searchterm,
+                    ['internal_message'])
 
                 # Search through filled in questionnaires
-                disease_activity = self.get_inner_context(
-                    request, self.patient, 'Ziekteactiviteit')
-                quality_of_life = self.get_inner_context(
-                    request, self.patient, 'Kwaliteit van leven')
-                quality_of_care = self.get_inner_context(
-                    request, self.patient, 'Kwaliteit van zorg')
-
-                # Concat
-                questionnaires =\
-                    disease_activity + quality_of_life + quality_of_care
-
-                # Search through questionnaires
-                for questionnaire in questionnaires:
-                    for field in questionnaire._meta.fields:
-                        # Check if search item is in the choices
-                        value = getattr(questionnaire, field.name)
-                        if value not in (None, '') and field.name != 'id':
-                            if field.choices != []:
-                                field_choice =\
-                                    str([val for key, val in
-                                        field.choices if key == value][0])
-                                field_choice = field_choice.lower()
-                                if searchterm in field_choice:
-                                    objects.append(questionnaire)
-                                    break
-                            elif searchterm in str(value).lower():
-                                objects.append(questionnaire)
-                                break
+                objects += self.get_inner_context(
+                    request, self.patient, searchterm)
             else:
                 self.no_search_term = True
 
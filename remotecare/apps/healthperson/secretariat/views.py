@@ -75,7 +75,8 @@ class SecretaryIndexView(BaseIndexTemplateView, SecretaryBaseView):
     def get_context_data(self, **kwargs):
         context = super(SecretaryIndexView, self).get_context_data(**kwargs)
 
-        messages = get_all_messages_for_secretary(self.secretary)
+        messages = get_all_messages_for_secretary(
+            self.secretary).list_fields()[:1]
         if len(messages) > 0:
             message = messages[0]
         else:
@@ -89,14 +90,16 @@ class SecretaryIndexView(BaseIndexTemplateView, SecretaryBaseView):
             urgent=True,
             finished_on__isnull=False,
             appointment_added_on__isnull=True,
-            appointment_needed=True).order_by('finished_on')
+            appointment_needed=True).select_related(
+            'patient__user').order_by('finished_on')
 
         controles = QuestionnaireRequest.objects.filter(
             urgent=False,
             finished_on__isnull=False,
             handled_on__isnull=False,
             appointment_added_on__isnull=True,
-            appointment_needed=True).order_by('finished_on')
+            appointment_needed=True).select_related(
+            'patient__user').order_by('finished_on')
 
         # combine lists.
         context.update(
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+This module exports the answers of finished questionnaires for
+research. The questionnaires are retrieved in primary key chunks with
+values_list, choice values are replaced by their labels with lookup
+tables and many to many values are retrieved with one query per
+relation per chunk, so the memory use doesn't depend on the number
+of questionnaires.
+
+Patients are anonymised with a pseudonym (HMAC of the patient id with
+settings.RESEARCH_EXPORT_KEY) which is the same for all questionnaires
+of a patient.
+
+Usage:
+
+.. code-block:: python
+
+    for row in iter_questionnaire_rows(RADAIQuestionnaire):
+        # the first row contains the column names
+        writer.writerow(row)
+
+:subtitle:`Function definitions:`
+"""
+from django.conf import settings
+from django.utils.encoding import force_text
+from core.encryption.hash import create_hmac
+
+# The columns added before the questionnaire fields
+EXPORT_BASE_COLUMNS = (
+    ('patient', 'CharField',
+     'request_step__questionnairerequest__patient_id'),
+    ('patient_diagnose', 'CharField',
+     'request_step__questionnairerequest__patient_diagnose'),
+    ('urgent', 'BooleanField',
+     'request_step__questionnairerequest__urgent'),
+    ('finished_on', 'DateField',
+     'request_step__questionnairerequest__finished_on'),
+)
+
+
+def get_export_fields(model_class):
+    """
+    Args:
+        - model_class: the questionnaire model class
+
+    Returns:
+        [list of the exported concrete fields, list of the exported\
+         many to many fields]
+    """
+    fields = [field for field in model_class._meta.concrete_fields
+              if not field.primary_key and field.name != 'request_step']
+    m2m_fields = list(model_class._meta.many_to_many)
+    return [fields, m2m_fields]
+
+
+def get_export_schema(model_class):
+    """
+    Args:
+        - model_class: the questionnaire model class
+
+    Returns:
+        A list of (column name, column type) tuples, the column type is
+        the Django internal type of the field before replacing the choice
+        values with their labels, 'ManyToManyField' columns contain the
+        names separated by '; '.
+    """
+    fields, m2m_fields = get_export_fields(model_class)
+    schema = [(name, field_type)
+              for (name, field_type, lookup) in EXPORT_BASE_COLUMNS]
+    schema += [(field.name, field.get_internal_type()) for field in fields]
+    schema += [(field.name, 'ManyToManyField') for field in m2m_fields]
+    return schema
+
+
+def get_label_lookup(field):
+    """
+    Args:
+        - field: the model field
+
+    Returns:
+        A function which replaces a value by its label if the field has
+        choices, other values (like the free text of ChoiceOtherFields)
+        are returned unchanged.
+    """
+    if not field.choices:
+        return None
+    choices = dict(field.flatchoices)
+
+    def get_label(value):
+        if value in choices:
+            return force_text(choices[value], strings_only=True)
+        return value
+    return get_label
+
+
+def get_m2m_values(field, pks):
+    """
+    Retrieve the names of the related objects for a list of
+    questionnaires with one query.
+
+    Args:
+        - field: the many to many field
+        - pks: the primary keys of the questionnaires
+
+    Returns:
+        A dict with a list of names per questionnaire primary key
+    """
+    through = field.remote_field.through
+    source_name = through._meta.get_field(field.m2m_field_name()).attname
+    target_name = field.m2m_reverse_field_name() + '__name'
+
+    values = {}
+    for (pk, name) in through.objects.filter(**{
+            source_name + '__in': pks}).values_list(
+            source_name, target_name).order_by(source_name, 'pk'):
+        values.setdefault(pk, []).append(force_text(name))
+    return values
+
+
+def iter_questionnaire_rows(model_class, chunk_size=1000):
+    """
+    Generator which yields the column names followed by a row for every
+    finished questionnaire of model_class, see :func:`get_export_schema`
+    for the columns.
+
+    Args:
+        - model_class: the questionnaire model class
+        - chunk_size: the number of questionnaires to retrieve per query
+
+    Returns:
+        A generator with lists of values
+    """
+    fields, m2m_fields = get_export_fields(model_class)
+    lookups = [lookup for (name, field_type, lookup) in EXPORT_BASE_COLUMNS]
+    lookups += [field.attname for field in fields]
+    label_lookups = [None] * len(EXPORT_BASE_COLUMNS)
+    label_lookups += [get_label_lookup(field) for field in fields]
+
+    yield [name for (name, field_type) in get_export_schema(model_class)]
+
+    queryset = model_class.objects.filter(
+        request_step__model=model_class.__name__,
+        request_step__questionnairerequest__finished_on__isnull=False
+    ).order_by('pk')
+
+    pseudonyms = {}
+    last_pk = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last_pk).values_list(
+            'pk', *lookups)[:chunk_size])
+        if not rows:
+            break
+        last_pk = rows[-1][0]
+
+        pks = [row[0] for row in rows]
+        m2m_values = [get_m2m_values(field, pks) for field in m2m_fields]
+
+        for row in rows:
+            pk = row[0]
+            values = list(row[1:])
+            for index, get_label in enumerate(label_lookups):
+                if get_label is not None:
+                    values[index] = get_label(values[index])
+
+            # anonymise the patient
+            patient_id = values[0]
+            if patient_id not in pseudonyms:
+                pseudonyms[patient_id] = create_hmac(
+                    settings.RESEARCH_EXPORT_KEY, str(patient_id))
+            values[0] = pseudonyms[patient_id]
+
+            for m2m_value in m2m_values:
+                values.append('; '.join(m2m_value.get(pk, [])))
+            yield values
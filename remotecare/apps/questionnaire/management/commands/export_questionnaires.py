@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Management command for exporting the anonymised answers of all
+finished questionnaires of a questionnaire model for research,
+see :mod:`apps.questionnaire.export`.
+
+Writes a CSV file and a JSON file with the column types next to it
+(output + '.schema.json'). Progress is written to stderr.
+
+:subtitle:`Class definitions:`
+"""
+import csv
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from apps.questionnaire.models import PACKAGE_LOCATION, get_model_class
+from apps.questionnaire.export import iter_questionnaire_rows,\
+    get_export_schema
+
+
+class Command(BaseCommand):
+    """
+    Export the anonymised answers of a questionnaire model
+    """
+    help = 'Export the anonymised answers of finished questionnaires'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model',
+            help='The questionnaire model name, e.g. RADAIQuestionnaire')
+        parser.add_argument('output', help='The CSV file to write')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of questionnaires to retrieve per query')
+
+    def encode(self, value):
+        """
+        Args:
+            - value: the value to write
+
+        Returns:
+            The value as utf-8 encoded string, the csv module of
+            python 2 doesn't support unicode.
+        """
+        if value is None:
+            return ''
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return str(value)
+
+    def handle(self, *args, **options):
+        if options['model'] not in PACKAGE_LOCATION:
+            raise CommandError('Unknown questionnaire model: %s' % (
+                options['model']))
+        model_class = get_model_class(options['model'])
+        chunk_size = options['chunk_size']
+
+        with open(options['output'] + '.schema.json', 'w') as schema_file:
+            json.dump(
+                [{'name': name, 'type': field_type} for (name, field_type)
+                 in get_export_schema(model_class)],
+                schema_file, indent=4)
+
+        start = time.time()
+        count = -1
+        with open(options['output'], 'wb') as output_file:
+            writer = csv.writer(output_file)
+            for row in iter_questionnaire_rows(model_class, chunk_size):
+                writer.writerow([self.encode(value) for value in row])
+                count += 1
+                if count and count % chunk_size == 0:
+                    self.report(count, start)
+        self.report(count, start)
+
+    def report(self, count, start):
+        """
+        Write the number of exported questionnaires and
+        the number of questionnaires per second to stderr.
+        """
+        seconds = max(time.time() - start, 0.001)
+        self.stderr.write('%s questionnaires exported (%d/s)' % (
+            count, count / seconds))
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Management command for storing the control summary fields
+(see :attr:`QuestionnaireRequest.summary_stored`) of finished
+questionnaire requests which were finished before these fields
+existed. With --check the stored summaries are compared with the
+filled in questionnaires instead.
+
+:subtitle:`Class definitions:`
+"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.questionnaire.models import QuestionnaireRequest, SUMMARY_FIELDS,\
+    get_prefetched_chunks
+
+
+class Command(BaseCommand):
+    """
+    Store or check the control summary of finished questionnaire requests
+    """
+    help = 'Store or check the control summary of finished controls'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report controls with a missing or outdated summary')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of controls to process per chunk')
+
+    def handle(self, *args, **options):
+        finished = QuestionnaireRequest.objects.filter(
+            finished_on__isnull=False)
+
+        if options['check']:
+            missing = finished.filter(summary_stored=False).count()
+            differences = 0
+            for questionnaire_requests in get_prefetched_chunks(
+                    finished.filter(summary_stored=True),
+                    options['chunk_size']):
+                for questionnaire_request in questionnaire_requests:
+                    for name, stored_value, value in\
+                            questionnaire_request.get_summary_differences():
+                        differences += 1
+                        self.stdout.write(
+                            'Control %s: %s is %r, expected %r' % (
+                                questionnaire_request.pk, name,
+                                stored_value, value))
+
+            if missing or differences:
+                raise CommandError(
+                    '%s controls without summary, %s differences' % (
+                        missing, differences))
+            self.stdout.write('All control summaries are up to date')
+            return
+
+        updated = 0
+        for questionnaire_requests in get_prefetched_chunks(
+                finished.filter(summary_stored=False),
+                options['chunk_size']):
+            for questionnaire_request in questionnaire_requests:
+                questionnaire_request.update_summary()
+                values = dict(
+                    (name, getattr(questionnaire_request, name))
+                    for name in SUMMARY_FIELDS)
+                # Don't audit, the values are a copy of the
+                # (audited) questionnaire answers
+                QuestionnaireRequest.objects.filter(
+                    pk=questionnaire_request.pk).update(
+                    summary_stored=True, **values)
+                updated += 1
+
+        self.stdout.write('Stored the summary of %s controls' % updated)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Management command for storing the graphic scores
+(see :class:`QuestionnaireScore`) of questionnaires which
+were filled in before the scores were stored on finishing.
+
+The scores are calculated per chunk of questionnaires
+with :func:`apps.questionnaire.scores.get_graphic_scores`.
+
+:subtitle:`Class definitions:`
+"""
+from django.core.management.base import BaseCommand
+from apps.questionnaire.models import QuestionnaireScore, get_model_class,\
+    get_graphic_score_models, get_graphic_value
+from apps.questionnaire.scores import get_graphic_scores
+
+
+class Command(BaseCommand):
+    """
+    Store the missing graphic scores of finished questionnaire requests
+    """
+    help = 'Store the missing graphic scores of finished controls'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Number of questionnaires to process per chunk')
+
+    def handle(self, *args, **options):
+        created = 0
+        for model in get_graphic_score_models():
+            model_class = get_model_class(model)
+            # the axis values are the same for every questionnaire
+            questionnaire = model_class()
+            score_min = get_graphic_value(questionnaire, 'graphic_score_min')
+            score_max = get_graphic_value(questionnaire, 'graphic_score_max')
+
+            missing = model_class.objects.filter(
+                request_step__model=model,
+                request_step__questionnairerequest__finished_on__isnull=False,
+                request_step__questionnairescore__isnull=True).order_by('pk')
+
+            last_pk = 0
+            while True:
+                rows = get_graphic_scores(
+                    missing.filter(pk__gt=last_pk)[:options['chunk_size']],
+                    'pk', 'request_step_id',
+                    'request_step__questionnairerequest__patient_id',
+                    'request_step__questionnairerequest__finished_on')
+                if not rows:
+                    break
+                last_pk = rows[-1][0]
+
+                scores = []
+                for (pk, request_step_id, patient_id, finished_on,
+                     score) in rows:
+                    # No score, e.g. BMI without length
+                    if score in (None, 'None'):
+                        continue
+                    scores.append(QuestionnaireScore(
+                        patient_id=patient_id,
+                        request_step_id=request_step_id,
+                        model=model,
+                        category=model_class.display_name,
+                        finished_on=finished_on,
+                        score=float(score),
+                        score_min=score_min,
+                        score_max=score_max))
+                QuestionnaireScore.objects.bulk_create(scores)
+                created += len(scores)
+
+        self.stdout.write('Stored %s questionnaire scores' % created)
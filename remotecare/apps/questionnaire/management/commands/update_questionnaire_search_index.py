@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Management command for (re)building the search tokens of the answers
+of finished questionnaires (see :mod:`apps.utils.search`), for example
+for the questionnaires which were filled in before the search index
+existed.
+
+The questionnaires are indexed per chunk, every chunk in its own
+transaction.
+
+:subtitle:`Class definitions:`
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.questionnaire.models import AVAILABLE_QUESTIONNAIRES,\
+    get_model_class
+from apps.utils.search import update_search_tokens
+
+
+class Command(BaseCommand):
+    """
+    Store the search tokens of all finished questionnaires
+    """
+    help = 'Store the search tokens of all finished questionnaires'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of questionnaires to process per chunk')
+
+    def handle(self, *args, **options):
+        indexed = 0
+        for model in sorted(set(
+                [model for (model, name) in AVAILABLE_QUESTIONNAIRES])):
+            # the model filter excludes the parent rows of inherited
+            # questionnaires (for example QOLQuestionnaire)
+            finished = get_model_class(model).objects.filter(
+                request_step__model=model,
+                request_step__questionnairerequest__finished_on__isnull=False
+            ).select_related('request_step__questionnairerequest').order_by(
+                'pk')
+
+            last_pk = 0
+            while True:
+                chunk = list(finished.filter(
+                    pk__gt=last_pk)[:options['chunk_size']])
+                if not chunk:
+                    break
+                last_pk = chunk[-1].pk
+
+                with transaction.atomic():
+                    update_search_tokens(model, [
+                        (questionnaire.pk,
+                         questionnaire.request_step.questionnairerequest.
+                         patient_id,
+                         u'\n'.join(questionnaire.get_search_texts()))
+                        for questionnaire in chunk])
+                indexed += len(chunk)
+
+        self.stdout.write(
+            'Stored the search tokens of %s questionnaires' % indexed)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-19 14:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('questionnaire', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='questionnairerequest',
+            name='summary_appointment',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='questionnairerequest',
+            name='summary_appointment_period',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='questionnairerequest',
+            name='summary_appointment_preference',
+            field=models.CharField(blank=True, max_length=512, null=True),
+        ),
+        migrations.AddField(
+            model_name='questionnairerequest',
+            name='summary_blood_sample',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='questionnairerequest',
+            name='summary_blood_sample_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='questionnairerequest',
+            name='summary_stored',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-19 14:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patient', '0001_initial'),
+        ('questionnaire', '0002_control_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionnaireScore',
+            fields=[
+                ('id',
+                 models.AutoField(auto_created=True,
+                                  primary_key=True,
+                                  serialize=False,
+                                  verbose_name='ID')),
+                (
+                    'model',
+                    models.CharField(
+                        choices=[
+                            (b'StartQuestionnaire',
+                             '001 Hoe gaat het met u?'),
+                            (b'IBDQuestionnaire',
+                             '002 Ziekteactiviteit - Ziekte van Chron en Colitis Ulcerosa'),
+                            (b'RADAIQuestionnaire',
+                             '003 Ziekteactiviteit - Rheumatoide artritis - RADAI vragenlijst'),
+                            (b'QOLChronCUQuestionnaire',
+                             '004 Kwaliteit van het leven - Ziekte van Chron en Colitis Ulcerosa (deel lastmeter)'),
+                            (b'QOLQuestionnaire',
+                             '005 Kwaliteit van het leven - Dunnedarmtransplantatie (lastmeter)'),
+                            (b'RheumatismSF36',
+                             '006 Kwaliteit van het leven - SF36 Reumatoide artritis'),
+                            (b'QOHCQuestionnaire',
+                             '007 Kwaliteit van zorg vragenlijst'),
+                            (b'FinishQuestionnaire',
+                             '008 Afspraak, bloedprikken en afsluiting'),
+                            (b'StartUrgentQuestionnaire',
+                             '009 Direct een afspraak'),
+                            (b'UrgentProblemQuestionnaire',
+                             '010 Omschrijving problemen')],
+                        max_length=256)),
+                ('category', models.CharField(max_length=128)),
+                ('finished_on', models.DateField()),
+                ('score', models.FloatField()),
+                ('score_min', models.IntegerField()),
+                ('score_max', models.IntegerField()),
+                ('patient',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     to='patient.Patient')),
+                ('request_step',
+                 models.OneToOneField(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     to='questionnaire.RequestStep')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='questionnairescore',
+            index_together=set([('patient', 'category', 'finished_on')]),
+        ),
+    ]
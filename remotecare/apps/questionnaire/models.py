@@ -66,14 +66,19 @@ Models can be defined as the following the example:
 :subtitle:`Class and function definitions:`
 """
 import importlib
-from datetime import timedelta
-from django.db import models
+from datetime import date, timedelta
+from django.db import models, transaction
+from django.utils.encoding import force_text
 from django.utils.translation import ugettext as _
-from core.models import DateField, AuditBaseModel
+from core.models import DateField, AuditBaseModel, save_audit_entries
 
 from apps.healthperson.patient.models import Patient, DIAGNOSIS_CHOICES
 from apps.healthperson.healthprofessional.models import HealthProfessional
 from apps.healthperson.secretariat.models import Secretary
+from apps.utils.counters import update_counters
+from apps.utils.models import SearchToken
+from apps.utils.search import get_search_tokens, search_objects,\
+    text_matches
 
 from calendar import timegm
 
@@ -180,6 +185,16 @@ AVAILABLE_URGENT_QUESTIONNAIRE_LIST = (
                                     'QOLQuestionnaire',)),
 )
 
+# Fields of the QuestionnaireRequest which store the answers
+# needed for the overviews, see QuestionnaireRequest.update_summary
+SUMMARY_FIELDS = (
+    'summary_appointment',
+    'summary_appointment_period',
+    'summary_appointment_preference',
+    'summary_blood_sample',
+    'summary_blood_sample_date',
+)
+
 
 def get_model_class(model_class_name):
     """
@@ -258,6 +273,40 @@ class QuestionnaireRequest(AuditBaseModel):
     appointment_added_on = models.DateField(null=True, blank=True)
     appointment_added_by = models.ForeignKey(Secretary, null=True, blank=True)
 
+    # summary of the answers of the start urgent or finish questionnaire,
+    # stored when the questionnaire request is finished so overviews
+    # don't need to retrieve the questionnaires
+    summary_stored = models.BooleanField(default=False)
+    summary_appointment = models.CharField(
+        null=True, blank=True, max_length=32)
+    summary_appointment_period = models.CharField(
+        null=True, blank=True, max_length=32)
+    summary_appointment_preference = models.CharField(
+        null=True, blank=True, max_length=512)
+    summary_blood_sample = models.CharField(
+        null=True, blank=True, max_length=128)
+    summary_blood_sample_date = models.DateField(null=True, blank=True)
+
+    def save(self, **kwargs):
+        """
+        Saves the questionnaire request and updates the counters of the
+        patient when the request is added or handled, the messages
+        related to the request are visible once it is handled.
+        """
+        adding = self.pk is None
+        super(QuestionnaireRequest, self).save(**kwargs)
+        if adding or self.handled_on is not None:
+            update_counters([self.patient_id])
+
+    def delete(self, **kwargs):
+        """
+        Removes the questionnaire request and updates the counters of
+        the patient
+        """
+        result = super(QuestionnaireRequest, self).delete(**kwargs)
+        update_counters([self.patient_id])
+        return result
+
     @property
     def filled_in(self):
         """
@@ -266,6 +315,206 @@ class QuestionnaireRequest(AuditBaseModel):
         """
         return self.finished_on is not None
 
+    @property
+    def request_steps(self):
+        """
+        Returns:
+            The request steps of this questionnaire request
+            ordered by step_nr
+        """
+        # lazy, can be filled by prefetch_questionnaires
+        if not hasattr(self, '_request_steps'):
+            self._request_steps = list(
+                self.requeststep_set.all().order_by('step_nr'))
+        return self._request_steps
+
+    def get_summary_data(self):
+        """
+        Retrieve the summary values from the filled in questionnaires,
+        the start urgent questionnaire (first step) for urgent requests
+        and the finish questionnaire (last step) for other requests.
+
+        Returns:
+            dict with the value for every field in SUMMARY_FIELDS
+        """
+        summary_data = dict.fromkeys(SUMMARY_FIELDS)
+        request_steps = self.request_steps
+        if not request_steps:
+            return summary_data
+
+        if self.urgent:
+            # starturgentquestionnaire = the first questionnaire step
+            starturgentquestionnaire = request_steps[0].questionnaire
+            if starturgentquestionnaire is not None:
+                summary_data['summary_appointment_period'] =\
+                    starturgentquestionnaire.appointment_period
+        else:
+            # finishquestionnaire = the last questionnaire step
+            finishquestionnaire = request_steps[-1].questionnaire
+            if finishquestionnaire is not None:
+                summary_data.update({
+                    'summary_appointment': finishquestionnaire.appointment,
+                    'summary_appointment_period':
+                        finishquestionnaire.appointment_period,
+                    'summary_appointment_preference':
+                        finishquestionnaire.appointment_preference,
+                    'summary_blood_sample': finishquestionnaire.blood_sample,
+                    'summary_blood_sample_date':
+                        finishquestionnaire.blood_sample_date,
+                })
+        return summary_data
+
+    def update_summary(self):
+        """
+        Set the summary fields from the filled in questionnaires,
+        the questionnaire request still needs to be saved.
+        """
+        for name, value in self.get_summary_data().items():
+            setattr(self, name, value)
+        self.summary_stored = True
+
+    def get_summary_differences(self):
+        """
+        Compare the stored summary fields with the filled in
+        questionnaires.
+
+        Returns:
+            A list of (field name, stored value, questionnaire value)
+            tuples, empty if the stored summary is up to date.
+        """
+        differences = []
+        for name, value in sorted(self.get_summary_data().items()):
+            stored_value = getattr(self, name)
+            if stored_value != value:
+                differences.append((name, stored_value, value))
+        return differences
+
+    def get_summary_value(self, name):
+        """
+        Args:
+            - name: the summary field name
+
+        Returns:
+            The stored summary value or, if the summary is not stored
+            yet, the value from the filled in questionnaires.
+        """
+        if self.summary_stored:
+            return getattr(self, name)
+        # lazy
+        if not hasattr(self, '_summary_data'):
+            self._summary_data = self.get_summary_data()
+        return self._summary_data[name]
+
+    def get_questionnaire_scores(self):
+        """
+        Create the graphic scores of the filled in questionnaires
+        of this finished questionnaire request.
+
+        Returns:
+            A list of unsaved :class:`QuestionnaireScore` instances
+        """
+        scores = []
+        graphic_score_models = get_graphic_score_models()
+        for request_step in self.request_steps:
+            questionnaire = request_step.questionnaire
+            if ((request_step.model not in graphic_score_models or
+                 questionnaire is None)):
+                continue
+            score = get_graphic_value(questionnaire, 'graphic_score_display')
+            # No score, e.g. BMI without length
+            if score in (None, 'None'):
+                continue
+            scores.append(QuestionnaireScore(
+                patient_id=self.patient_id,
+                request_step=request_step,
+                model=request_step.model,
+                category=questionnaire.display_name,
+                finished_on=self.finished_on,
+                score=float(score),
+                score_min=get_graphic_value(
+                    questionnaire, 'graphic_score_min'),
+                score_max=get_graphic_value(
+                    questionnaire, 'graphic_score_max')))
+        return scores
+
+    def finish(self, questionnaire_data, changed_by_user, request_steps=None):
+        """
+        Saves the filled in questionnaires for all request steps and
+        marks the questionnaire request as finished in one transaction.
+
+        Every questionnaire is inserted with one query, the many to many
+        relations with one query per relation and all graphic scores,
+        search tokens of the answers (see :mod:`apps.utils.search`) and
+        audit entries are saved at once.
+
+        Args:
+            - questionnaire_data: dict with the cleaned data per\
+              questionnaire model name, many to many values can be\
+              model instances or primary keys.
+            - changed_by_user: the user used for auditing
+            - request_steps: the request steps of this questionnaire\
+              request, retrieved from the database if not given.
+        """
+        if request_steps is None:
+            request_steps = self.requeststep_set.all().order_by('step_nr')
+
+        log_entries = []
+        search_tokens = []
+        with transaction.atomic():
+            for request_step in request_steps:
+                model_class = request_step.model_class
+                cleaned_data = questionnaire_data.get(request_step.model, {})
+                m2m_fields = model_class._meta.many_to_many
+                m2m_names = [field.name for field in m2m_fields]
+
+                kwargs = {'request_step': request_step}
+                for name, value in cleaned_data.items():
+                    if name not in m2m_names:
+                        kwargs[name] = value
+
+                questionnaire = model_class(**kwargs)
+                # added line for auditing
+                questionnaire.changed_by_user = changed_by_user
+                log_entries.append(questionnaire.save_without_audit_entry())
+                request_step.questionnairerequest = self
+                request_step._questionnaire = questionnaire
+                search_tokens += get_search_tokens(request_step.model, [
+                    (questionnaire.pk, self.patient_id,
+                     u'\n'.join(questionnaire.get_search_texts()))])
+
+                # insert the many to many relations per relation at once
+                for field in m2m_fields:
+                    values = cleaned_data.get(field.name, None)
+                    if not values:
+                        continue
+                    through = field.remote_field.through
+                    source_name = through._meta.get_field(
+                        field.m2m_field_name()).attname
+                    target_name = through._meta.get_field(
+                        field.m2m_reverse_field_name()).attname
+                    target_pks = []
+                    for value in values:
+                        target_pk = getattr(value, 'pk', value)
+                        if target_pk not in target_pks:
+                            target_pks.append(target_pk)
+                    through.objects.bulk_create(
+                        [through(**{source_name: questionnaire.pk,
+                                    target_name: target_pk})
+                         for target_pk in target_pks])
+
+            self._request_steps = list(request_steps)
+            self.update_summary()
+            self.finished_on = date.today()
+            self.changed_by_user = changed_by_user
+            log_entries.append(self.save_without_audit_entry())
+
+            QuestionnaireScore.objects.bulk_create(
+                self.get_questionnaire_scores())
+            SearchToken.objects.bulk_create(search_tokens)
+
+            save_audit_entries(
+                [log_entry for log_entry in log_entries if log_entry])
+
     @property
     def handled(self):
         """
@@ -290,26 +539,15 @@ class QuestionnaireRequest(AuditBaseModel):
         Returns:
             True if the appointment is on short term else False
         """
-        from apps.questionnaire.default.models import FinishQuestionnaire,\
-            StartUrgentQuestionnaire
-
         if not self.filled_in:
             return False
 
-        request_steps = self.requeststep_set.all().order_by('step_nr')
+        appointment_period = self.get_summary_value(
+            'summary_appointment_period')
         if not self.urgent:
-            finishquestionnaire = FinishQuestionnaire.objects.get(
-                request_step=request_steps[
-                    request_steps.count() -
-                    1])
-            appointment_period = finishquestionnaire.appointment_period
             if appointment_period != 'within_4_weeks':
                 return True
         else:
-            # find starturgentquestionnaire = the first questionnaire step
-            starturgentquestionnaire = StartUrgentQuestionnaire.objects.get(
-                request_step=request_steps[0])
-            appointment_period = starturgentquestionnaire.appointment_period
             if appointment_period != 'this_week':
                 return True
         return False
@@ -320,17 +558,10 @@ class QuestionnaireRequest(AuditBaseModel):
         Returns:
             True if blood taken question is answered postive or False
         """
-        from apps.questionnaire.default.models import FinishQuestionnaire
-
         if not self.urgent:
-            request_steps = self.requeststep_set.all().order_by('step_nr')
-            # find finishquestionnaire = the last questionnaire step
-            finishquestionnaire = FinishQuestionnaire.objects.get(
-                request_step=request_steps[
-                    request_steps.count() -
-                    1])
-            if finishquestionnaire.blood_sample:
-                if finishquestionnaire.blood_sample not in ('', None, 'None'):
+            blood_sample = self.get_summary_value('summary_blood_sample')
+            if blood_sample:
+                if blood_sample not in ('', None, 'None'):
                     return _('Ja')
         return _('Nee')
 
@@ -340,16 +571,8 @@ class QuestionnaireRequest(AuditBaseModel):
         Returns:
             The last blood taken date or None
         """
-        from apps.questionnaire.default.models import FinishQuestionnaire
-
         if not self.urgent:
-            request_steps = self.requeststep_set.all().order_by('step_nr')
-            # find finishquestionnaire = the last questionnaire step
-            finishquestionnaire = FinishQuestionnaire.objects.get(
-                request_step=request_steps[
-                    request_steps.count() -
-                    1])
-            return finishquestionnaire.blood_sample_date
+            return self.get_summary_value('summary_blood_sample_date')
         return None
 
     @property
@@ -358,20 +581,12 @@ class QuestionnaireRequest(AuditBaseModel):
         Returns:
             True if the patient needs to have an appointment else False
         """
-        from apps.questionnaire.default.models import FinishQuestionnaire
-
         if not self.filled_in:
             return False
 
         # returns true if the patient has requested an appointment
         if not self.urgent:
-            request_steps = self.requeststep_set.all().order_by('step_nr')
-            # find finishquestionnaire = the last questionnaire step
-            finishquestionnaire = FinishQuestionnaire.objects.get(
-                request_step=request_steps[
-                    request_steps.count() -
-                    1])
-            if finishquestionnaire.appointment == 'no':
+            if self.get_summary_value('summary_appointment') == 'no':
                 return False
 
         # Urgent is always true
@@ -383,41 +598,23 @@ class QuestionnaireRequest(AuditBaseModel):
         Returns:
             The appointment period date or None
         """
-        from apps.questionnaire.default.models import FinishQuestionnaire,\
-            StartUrgentQuestionnaire
-
-        request_steps = self.requeststep_set.all().order_by('step_nr')
         appointment_period_date = self.finished_on
 
         if not self.filled_in:
             return appointment_period_date
 
-        if self.urgent:
-            # find starturgentquestionnaire = the first questionnaire step
-            starturgentquestionnaire = StartUrgentQuestionnaire.objects.get(
-                request_step=request_steps[0])
-            appointment_period = starturgentquestionnaire.appointment_period
+        appointment_period = self.get_summary_value(
+            'summary_appointment_period')
 
-            delta_days = 0
+        delta_days = 0
+        if self.urgent:
             if appointment_period == 'tommorow':
                 delta_days = 1
             elif appointment_period == 'within_3_days':
                 delta_days = 3
             elif appointment_period == 'this_week':
                 delta_days = 7
-
-            appointment_period_date = appointment_period_date + \
-                timedelta(days=delta_days)
         else:
-            # find finishquestionnaire = the last questionnaire step
-
-            finishquestionnaire = FinishQuestionnaire.objects.get(
-                request_step=request_steps[
-                    request_steps.count() -
-                    1])
-            appointment_period = finishquestionnaire.appointment_period
-
-            delta_days = 0
             if appointment_period == 'within_4_weeks':
                 delta_days = 28
             elif appointment_period == 'within_2_weeks':
@@ -425,10 +622,7 @@ class QuestionnaireRequest(AuditBaseModel):
             elif appointment_period == 'this_week':
                 delta_days = 7
 
-            appointment_period_date = appointment_period_date + \
-                timedelta(days=delta_days)
-
-        return appointment_period_date
+        return appointment_period_date + timedelta(days=delta_days)
 
     @property
     def appointment_period(self):
@@ -439,35 +633,30 @@ class QuestionnaireRequest(AuditBaseModel):
         from apps.questionnaire.default.models import FinishQuestionnaire,\
             StartUrgentQuestionnaire
 
-        request_steps = self.requeststep_set.all().order_by('step_nr')
-        appointment_period = None
-
         if not self.filled_in:
-            return appointment_period
+            return None
 
         if self.urgent:
-            # find starturgentquestionnaire = the first questionnaire step
-            starturgentquestionnaire = StartUrgentQuestionnaire.objects.get(
-                request_step=request_steps[0])
-            appointment_period =\
-                starturgentquestionnaire.get_appointment_period_display()
+            model_class = StartUrgentQuestionnaire
         else:
-            # find finishquestionnaire = the last questionnaire step
-
-            finishquestionnaire = FinishQuestionnaire.objects.get(
-                request_step=request_steps[
-                    request_steps.count() -
-                    1])
+            model_class = FinishQuestionnaire
 
-            appointment_period =\
-                finishquestionnaire.get_appointment_period_display()
+        # same as get_appointment_period_display on the questionnaire
+        appointment_period = self.get_summary_value(
+            'summary_appointment_period')
+        choices = dict(
+            model_class._meta.get_field('appointment_period').flatchoices)
+        appointment_period = force_text(
+            choices.get(appointment_period, appointment_period),
+            strings_only=True)
 
-            if finishquestionnaire.appointment_preference:
-                if ((finishquestionnaire.appointment_preference not in
-                     ('', None, 'None'))):
+        if not self.urgent:
+            appointment_preference = self.get_summary_value(
+                'summary_appointment_preference')
+            if appointment_preference:
+                if appointment_preference not in ('', None, 'None'):
                     appointment_period = appointment_period + \
-                        _(' bij voorkeur op: ') +\
-                        finishquestionnaire.appointment_preference
+                        _(' bij voorkeur op: ') + appointment_preference
 
         return appointment_period
 
@@ -518,6 +707,201 @@ class RequestStep(models.Model):
         return questionnaire
 
 
+def prefetch_questionnaires(objects):
+    """
+    Retrieve the questionnaires for a list of request steps or
+    questionnaire requests in one query per questionnaire model class
+    instead of one query per request step. The results are stored on
+    the request steps so :attr:`RequestStep.questionnaire` does not hit
+    the database anymore.
+
+    For questionnaire requests the request steps are retrieved in one
+    query as well and stored for :attr:`QuestionnaireRequest.request_steps`.
+
+    Args:
+        - objects: list of :class:`RequestStep` or
+          :class:`QuestionnaireRequest` instances
+
+    Returns:
+        The list of request steps for which the questionnaires
+        are retrieved
+    """
+    request_steps = []
+    questionnaire_requests = {}
+    for obj in objects:
+        if isinstance(obj, QuestionnaireRequest):
+            if hasattr(obj, '_request_steps'):
+                request_steps += obj._request_steps
+            else:
+                obj._request_steps = []
+                questionnaire_requests[obj.pk] = obj
+        else:
+            request_steps.append(obj)
+
+    if questionnaire_requests:
+        for request_step in RequestStep.objects.filter(
+                questionnairerequest__in=questionnaire_requests.keys()
+                ).order_by('questionnairerequest', 'step_nr'):
+            questionnaire_request = questionnaire_requests[
+                request_step.questionnairerequest_id]
+            request_step.questionnairerequest = questionnaire_request
+            questionnaire_request._request_steps.append(request_step)
+            request_steps.append(request_step)
+
+    steps_per_model = {}
+    for request_step in request_steps:
+        if not hasattr(request_step, '_questionnaire'):
+            steps_per_model.setdefault(
+                request_step.model, {})[request_step.pk] = request_step
+
+    for model, steps in steps_per_model.items():
+        for request_step in steps.values():
+            request_step._questionnaire = None
+        for questionnaire in get_model_class(model).objects.filter(
+                request_step__in=steps.keys()):
+            request_step = steps[questionnaire.request_step_id]
+            questionnaire.request_step = request_step
+            request_step._questionnaire = questionnaire
+
+    return request_steps
+
+
+def search_questionnaires(patient_id, model_names, searchterm):
+    """
+    Search the finished questionnaires of a patient with the search
+    index (see :mod:`apps.utils.search`), the index is searched with
+    one query and only the questionnaires which contain all words of
+    the search term are retrieved.
+
+    Args:
+        - patient_id: the primary key of the patient
+        - model_names: the names of the questionnaire models to search
+        - searchterm: the search term
+
+    Returns:
+        A list with the questionnaires of which an answer contains\
+        the words of the search term as a phrase, the newest control\
+        first
+    """
+    questionnaires = []
+    object_ids = search_objects(model_names, patient_id, searchterm)
+    for (model, questionnaire_ids) in object_ids.items():
+        questionnaires += [
+            questionnaire for questionnaire in
+            get_model_class(model).objects.filter(
+                pk__in=questionnaire_ids,
+                request_step__questionnairerequest__finished_on__isnull=False
+            ).select_related('request_step__questionnairerequest')
+            if any([text_matches(text, searchterm)
+                    for text in questionnaire.get_search_texts()])]
+    questionnaires.sort(key=lambda questionnaire: (
+        -questionnaire.finished_on.toordinal(),
+        questionnaire.request_step.questionnairerequest_id,
+        questionnaire.request_step.step_nr))
+    return questionnaires
+
+
+def get_prefetched_chunks(queryset, chunk_size=500):
+    """
+    Split a queryset of questionnaire requests in lists, ordered by
+    primary key, with the request steps and questionnaires retrieved
+    with :func:`prefetch_questionnaires`.
+
+    Args:
+        - queryset: the questionnaire requests
+        - chunk_size: the maximum number of questionnaire requests per list
+
+    Returns:
+        A generator with lists of questionnaire requests
+    """
+    last_pk = 0
+    while True:
+        questionnaire_requests = list(queryset.filter(
+            pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not questionnaire_requests:
+            break
+        prefetch_questionnaires(questionnaire_requests)
+        yield questionnaire_requests
+        last_pk = questionnaire_requests[-1].pk
+
+
+# Materialised graphic scores
+class QuestionnaireScore(models.Model):
+    """
+    The graphic score of a filled in questionnaire, stored when the
+    questionnaire request is finished so the overview graphs don't
+    need to retrieve (and decrypt) every filled in questionnaire.
+
+    The score and axis values are the graphic_score_* values of the
+    questionnaire model (see :func:`get_graphic_score_models`), the
+    category is the display_name of the questionnaire model.
+    """
+    patient = models.ForeignKey(Patient)
+    request_step = models.OneToOneField(RequestStep)
+    model = models.CharField(
+        choices=AVAILABLE_QUESTIONNAIRES,
+        max_length=256)
+    category = models.CharField(max_length=128)
+    finished_on = models.DateField()
+    score = models.FloatField()
+    score_min = models.IntegerField()
+    score_max = models.IntegerField()
+
+    class Meta:
+        index_together = (('patient', 'category', 'finished_on'),)
+
+    @property
+    def model_class(self):
+        """
+        Returns:
+            The questionnaire model class of this score
+        """
+        return get_model_class(self.model)
+
+    @property
+    def graphic_score_display(self):
+        """
+        Returns:
+            The score to display in the graphic
+        """
+        return str(self.score)
+
+    @property
+    def get_finished_on_timestamp(self):
+        """
+        Returns:
+            The finished timestamp of the questionnaire request
+        """
+        return timegm(self.finished_on.timetuple()) * 1000
+
+
+def get_graphic_value(questionnaire, name):
+    """
+    Get a graphic_score_* value of a questionnaire, these are
+    either properties or methods.
+
+    Args:
+        - questionnaire: the filled in questionnaire
+        - name: the attribute name
+
+    Returns:
+        The value of the attribute
+    """
+    value = getattr(questionnaire, name)
+    if callable(value):
+        value = value()
+    return value
+
+
+def get_graphic_score_models():
+    """
+    Returns:
+        The names of the questionnaire models which have a graphic score
+    """
+    return [model for model, name in AVAILABLE_QUESTIONNAIRES
+            if hasattr(get_model_class(model), 'graphic_score_display')]
+
+
 # Wizard questionnaire database storage
 class WizardDatabaseStorage(models.Model):
     """
@@ -570,6 +954,25 @@ class QuestionnaireBase(AuditBaseModel):
             return None
         return timegm(request.finished_on.timetuple()) * 1000
 
+    def get_search_texts(self):
+        """
+        Returns:
+            A list with the searchable text of every answer: the label
+            of a choice answer, the other answers as text. Relations
+            and empty answers are left out.
+        """
+        texts = []
+        for field in self._meta.fields:
+            if field.name == 'id' or field.is_relation:
+                continue
+            value = getattr(self, field.attname)
+            if value in (None, ''):
+                continue
+            if field.choices:
+                value = dict(field.flatchoices).get(value, value)
+            texts.append(force_text(value))
+        return texts
+
     @property
     def encryption_key(self):
         # This makes getting the key faster
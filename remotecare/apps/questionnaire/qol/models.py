@@ -8,7 +8,6 @@ questionnaire models
 from django.db import models
 from django.utils.translation import ugettext as _
 from apps.questionnaire.models import QuestionnaireBase
-from apps.questionnaire.default.models import StartQuestionnaire
 from core.models import ManyToManyField
 
 QOL_TEN_SCORE = (
@@ -171,15 +170,15 @@ class QOLChronCUQuestionnaire(QuestionnaireBase):
         # is problem_severity score of the StartQuestionnaire...
 
         questionnaire_request = self.request_step.questionnairerequest
-        problem_severity = None
-
-        try:
-            startquestionnaire = StartQuestionnaire.objects.get(
-                request_step__questionnairerequest=questionnaire_request)
-            problem_severity =\
-                startquestionnaire.get_problem_severity_display()
-        except StartQuestionnaire.DoesNotExist:
-            problem_severity = 0
+        problem_severity = 0
+
+        # use the (possibly prefetched) request steps
+        for request_step in questionnaire_request.request_steps:
+            if request_step.model == 'StartQuestionnaire':
+                startquestionnaire = request_step.questionnaire
+                if startquestionnaire is not None:
+                    problem_severity =\
+                        startquestionnaire.get_problem_severity_display()
         return problem_severity
 
     @property
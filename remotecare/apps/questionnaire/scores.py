@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+This module calculates the graphic scores (the graphic_score_display
+property of the questionnaire models) for many questionnaires at once.
+
+Instead of creating a model instance for every questionnaire only the
+columns needed for the score are retrieved with values_list and the
+choice values are translated with lookup tables which are created once
+per call. The results are the same as the graphic_score_display
+property of the questionnaire instances.
+
+Usage:
+
+.. code-block:: python
+
+    queryset = RADAIQuestionnaire.objects.filter(...)
+    for (request_step_id, score) in get_graphic_scores(
+            queryset, 'request_step_id'):
+        ...
+
+:subtitle:`Function definitions:`
+"""
+from decimal import Decimal
+from django.utils.encoding import force_text
+
+
+def get_choice_display_lookup(model_class, field_name):
+    """
+    Args:
+        - model_class: the model class of the field
+        - field_name: the name of the field with choices
+
+    Returns:
+        A function returning the same value as get_FOO_display
+        for a value of the field.
+    """
+    choices = dict(model_class._meta.get_field(field_name).flatchoices)
+
+    def get_display(value):
+        return force_text(choices.get(value, value), strings_only=True)
+    return get_display
+
+
+def radai_scores(model_class):
+    """
+    RADAI: the count of painful joints (left/right pain scores)
+    """
+    fields = [field.name for field in model_class._meta.fields
+              if 'right_' in field.name or 'left_' in field.name]
+
+    def calculate(rows):
+        scores = []
+        for values in rows:
+            count = 0
+            for value in values:
+                if value not in ('none', '', None):
+                    count = count + 1
+            scores.append(count)
+        return scores
+    return fields, calculate
+
+
+def sf36_scores(model_class):
+    """
+    SF36: the general health score, the best answer gives the
+    graphic_score_max
+    """
+    choices = model_class._meta.get_field('health_general').choices
+    graphic_score_max = model_class().graphic_score_max
+    lookup = {}
+    for index, item in enumerate(choices):
+        lookup[item[0]] = graphic_score_max - index
+
+    def calculate(rows):
+        return [lookup.get(health_general, 0) for (health_general,) in rows]
+    return ['health_general'], calculate
+
+
+def bmi_scores(model_class):
+    """
+    IBD: the BMI as string
+    """
+    def bmi(patient_length, patient_weight):
+        # not divide by 0
+        if patient_length == 0:
+            return None
+
+        if isinstance(patient_length, unicode):
+            patient_length = Decimal(patient_length)
+        if isinstance(patient_weight, unicode):
+            patient_weight = Decimal(patient_weight)
+
+        length = patient_length / 100
+        return round(patient_weight / (length * length), 1)
+
+    def calculate(rows):
+        return [str(bmi(*values)).replace(',', '.') for values in rows]
+    return ['patient_length', 'patient_weight'], calculate
+
+
+def qohc_scores(model_class):
+    """
+    QOHC: the satisfaction score or 0
+    """
+    def calculate(rows):
+        return [0 if score is None else score for (score,) in rows]
+    return ['hc_satisfaction_score'], calculate
+
+
+def qol_scores(model_class):
+    """
+    QOL: the problem severity of the start questionnaire of the same
+    questionnaire request or 0, retrieved with one extra query.
+    """
+    from apps.questionnaire.default.models import StartQuestionnaire
+
+    get_display = get_choice_display_lookup(
+        StartQuestionnaire, 'problem_severity')
+
+    def calculate(rows):
+        questionnaire_request_ids = set([row[0] for row in rows])
+        problem_severities = dict(StartQuestionnaire.objects.filter(
+            request_step__questionnairerequest__in=questionnaire_request_ids
+        ).values_list(
+            'request_step__questionnairerequest_id', 'problem_severity'))
+
+        return [get_display(problem_severities[questionnaire_request_id])
+                if questionnaire_request_id in problem_severities else 0
+                for (questionnaire_request_id,) in rows]
+    return ['request_step__questionnairerequest_id'], calculate
+
+
+# The score function per questionnaire model name. Every function
+# gets the model class and returns the fields needed for the score and
+# a function which calculates the scores for a list of rows with
+# the values of these fields.
+SCORE_FUNCTIONS = {
+    'RADAIQuestionnaire': radai_scores,
+    'RheumatismSF36': sf36_scores,
+    'IBDQuestionnaire': bmi_scores,
+    'QOHCQuestionnaire': qohc_scores,
+    'QOLChronCUQuestionnaire': qol_scores,
+    'QOLQuestionnaire': qol_scores,
+}
+
+
+def get_graphic_scores(queryset, *fields):
+    """
+    Calculate the graphic scores for all questionnaires in the queryset
+    with one query (two for the QOL questionnaires).
+
+    Args:
+        - queryset: a queryset of one of the questionnaire models in\
+          SCORE_FUNCTIONS
+        - fields: the field names to return with every score,\
+          the primary key if not given
+
+    Returns:
+        A list of tuples with the values of fields followed by the score
+    """
+    model_class = queryset.model
+    score_fields, calculate = SCORE_FUNCTIONS[model_class.__name__](
+        model_class)
+    fields = list(fields or ['pk'])
+
+    nr_of_fields = len(fields)
+    rows = list(queryset.values_list(*(fields + score_fields)))
+    scores = calculate([row[nr_of_fields:] for row in rows])
+    return [tuple(row[:nr_of_fields]) + (score,)
+            for (row, score) in zip(rows, scores)]
@@ -25,6 +25,8 @@ class DatabaseStorage(storage.BaseStorage):
     encoder = DjangoJSONEncoder(separators=(',', ':'))
     # key for storing unclean_data for a form
     unclean_data_key = 'unclean_data'
+    # key for storing the validated cleaned_data for a form
+    validated_data_key = 'validated_data'
 
     def __init__(self, *args, **kwargs):
         """Init by loading the data or initializing the
@@ -49,6 +51,7 @@ class DatabaseStorage(storage.BaseStorage):
             self.step_files_key: {},
             self.extra_data_key: {},
             self.unclean_data_key: {},
+            self.validated_data_key: {},
         }
 
     def get_unclean_data(self, step):
@@ -98,6 +101,43 @@ class DatabaseStorage(storage.BaseStorage):
 
         self.data[self.unclean_data_key][step] = unclean_form_data
 
+    def get_validated_data(self, step):
+        """
+        Get the validated data for a step
+
+        Args:
+            - step: the step key
+
+        Returns:
+            A (fingerprint, serialized cleaned_data) tuple or None
+        """
+        # Data stored before the validated_data key was introduced
+        # does not have the key yet.
+        validated_data = self.data.get(self.validated_data_key, {})
+        values = validated_data.get(step, None)
+        if values is not None:
+            values = (values['fingerprint'], values['cleaned_data'])
+        return values
+
+    def set_validated_data(self, step, fingerprint, cleaned_data=None):
+        """
+        Set the validated data for a step, together with the fingerprint
+        of the step data it was validated from.
+
+        Args:
+            - step: The step key to set the validated data for
+            - fingerprint: the fingerprint of the step data or None\
+              to remove the validated data for the step
+            - cleaned_data: the serialized cleaned_data of the form
+        """
+        validated_data = self.data.setdefault(self.validated_data_key, {})
+        if fingerprint is None:
+            if step in validated_data:
+                del validated_data[step]
+        else:
+            validated_data[step] = {'fingerprint': fingerprint,
+                                    'cleaned_data': cleaned_data}
+
     def load_data(self):
         """
         Load the data from the database
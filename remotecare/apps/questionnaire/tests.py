@@ -6,12 +6,34 @@ are tested seperately.
 
 :subtitle:`Class definitions:`
 """
+import csv
 import json
-from apps.questionnaire.models import QuestionnaireRequest, get_model_class
+import os
+import shutil
+import tempfile
+from apps.questionnaire.models import QuestionnaireRequest, get_model_class,\
+    WizardDatabaseStorage, RequestStep, QuestionnaireScore,\
+    prefetch_questionnaires, get_graphic_score_models, PACKAGE_LOCATION,\
+    AVAILABLE_CONTROL_QUESTIONNAIRE_LIST, search_questionnaires
+from apps.questionnaire.qol.models import QOLChronCUQuestionnaire,\
+    QOLQuestionnaire
+from apps.questionnaire.scores import get_graphic_scores
+from apps.questionnaire.export import iter_questionnaire_rows,\
+    get_export_fields, get_export_schema
+from apps.api.serializers import serialize_request_steps
 from core.serializers import AllFieldsSerializer
 from core.unittest.baseunittest import BaseUnitTest
 from apps.questionnaire.forms import get_forms_for
+from apps.questionnaire.views import\
+    insert_new_questionnaire_request_for_patient,\
+    insert_new_questionnaire_requests_for_patients, get_last_QOHC_dates
+from apps.healthperson.patient.models import Patient
+from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.core.urlresolvers import reverse
+from django.db.models.fields.related import OneToOneField
+from django.forms.models import model_to_dict
+from StringIO import StringIO
 
 
 class MockWizard:
@@ -365,6 +387,410 @@ class QuestionnaireTest(BaseUnitTest):
         # delete the questionnaire
         res = self.post(start_url, {})
 
+    def check_final_revalidation(self):
+        """
+        Fill in a control up to the last form, change the stored
+        data of an already validated step and check that the changed
+        step is validated again when the last form is posted.
+        """
+        self.login('frank@example.com')
+
+        if not self.data:
+            self.data = self.load_data('test_data/test_data.json')
+
+        QuestionnaireRequest.objects.all().delete()
+
+        res = self.get('/')
+        patient = res.context_data['patient']
+        session_key = self.get_session_key(patient.health_person_id)
+        start_url = '/patient/' + session_key +\
+            '/questionnaire/start_controle/'
+
+        res = self.get(start_url, 302)
+        url = res.url
+        res = self.get(url)
+
+        # Post all forms except the last one
+        steps = res.context_data['wizard']['steps']
+        while steps.current != steps.last:
+            res = self.questionnaire_post_form(res, url)
+            steps = res.context_data['wizard']['steps']
+
+        questionnaire_request = QuestionnaireRequest.objects.latest('pk')
+        storage = WizardDatabaseStorage.objects.get(
+            questionnaire_request=questionnaire_request)
+        data = json.loads(storage.data)
+
+        # Every posted step is stored with its validated data
+        for key in data['step_data']:
+            self.assertIn(key, data['validated_data'])
+
+        # Tamper with the stored data of the first step, the
+        # validated data for this step is left unchanged.
+        data['step_data']['0']['0-current_status'] = ['not_a_choice']
+        storage.data = json.dumps(data)
+        storage.save()
+
+        # Post the last form, the first step needs to be shown
+        # again with errors instead of finishing the control.
+        form = res.context_data['form']
+        obj = self.objects[form.Meta.model].object
+        post_data = self.get_post_data(
+            form.__class__(instance=obj), form.prefix + '-')
+        post_data.update(
+            {res.context_data['wizard']['management_form'].prefix +
+             '-current_step': steps.current})
+        res = self.post(url, post_data, check_status_code=False)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            res.context_data['wizard']['steps'].current, '0')
+        self.assertIn('current_status', res.context_data['form'].errors)
+
+        questionnaire_request = QuestionnaireRequest.objects.get(
+            pk=questionnaire_request.pk)
+        self.assertIsNone(questionnaire_request.finished_on)
+
+    def check_finish_queries(self):
+        """
+        Pin the number of queries needed to save a finished control
+        for every diagnose: one insert per questionnaire, one insert per
+        filled in many to many relation, one update of the questionnaire
+        request, one insert for all graphic scores, one insert for all
+        search tokens, one insert for all audit entries and the
+        savepoint queries of the transaction.
+        """
+        if not self.data:
+            self.data = self.load_data('test_data/test_data.json')
+
+        expected_queries = {
+            # Start, RADAI, SF36, QOHC, Finish
+            'rheumatoid_arthritis': 11,
+            # Start, IBD(1 relation), QOLChronCU(4 relations), QOHC, Finish
+            'colitis_ulcerosa': 16,
+            'chron': 16,
+            # Start, QOL(3 queries for the inherited model, 5 relations),
+            # QOHC, Finish
+            'intestinal_transplantation': 17,
+        }
+
+        patient = Patient.objects.get(pk=4)
+        for diagnose, num_queries in expected_queries.items():
+            patient.diagnose = diagnose
+            patient.excluded_questionnaires = None
+            # Remove earlier controls, so QOHC is part of the control
+            QuestionnaireRequest.objects.filter(patient=patient).delete()
+            questionnaire_request =\
+                insert_new_questionnaire_request_for_patient(patient)
+            request_steps = list(
+                questionnaire_request.requeststep_set.all().order_by(
+                    'step_nr'))
+
+            questionnaire_data = {}
+            for request_step in request_steps:
+                deserialized = self.objects[request_step.model_class]
+                cleaned_data = self.get_questionnaire_fields_from_object(
+                    deserialized.object)
+                for name in cleaned_data:
+                    field = deserialized.object._meta.get_field(name)
+                    cleaned_data[name] = field.to_python(cleaned_data[name])
+                # many to many values from the raw test data
+                fields = self.data[
+                    request_step.model_class._meta.label_lower]
+                for field in request_step.model_class._meta.many_to_many:
+                    if field.name in fields:
+                        cleaned_data[field.name] = fields[field.name]
+                questionnaire_data[request_step.model] = cleaned_data
+
+            with self.assertNumQueries(num_queries):
+                questionnaire_request.finish(
+                    questionnaire_data, patient.user,
+                    request_steps=request_steps)
+
+            # Check if everything is stored
+            for request_step in request_steps:
+                questionnaire = request_step.model_class.objects.get(
+                    request_step=request_step)
+                m2m_data = questionnaire_data[request_step.model]
+                for field in questionnaire._meta.many_to_many:
+                    # compare the stored relations directly, the related
+                    # objects are not available in the test database
+                    through = field.remote_field.through
+                    stored_pks = through.objects.filter(**{
+                        field.m2m_field_name(): questionnaire.pk}
+                    ).values_list(field.m2m_reverse_field_name(), flat=True)
+                    self.assertEqual(
+                        sorted([str(pk) for pk in stored_pks]),
+                        sorted([str(pk) for pk in
+                                m2m_data.get(field.name, [])]))
+                # the answers are in the search index
+                texts = questionnaire.get_search_texts()
+                if texts:
+                    self.assertIn(questionnaire, search_questionnaires(
+                        patient.id, [request_step.model], texts[0]))
+            self.assertIsNotNone(
+                QuestionnaireRequest.objects.get(
+                    pk=questionnaire_request.pk).finished_on)
+            self.check_questionnaire_scores(questionnaire_request)
+            self.check_graphic_scores(questionnaire_request)
+            self.check_api_serialization(questionnaire_request)
+
+    def check_insert_new_questionnaire_requests(self):
+        """
+        Check that the controls of many patients are added with one
+        insert per control and a fixed number of other queries: the
+        last QOHC dates, the request steps, the audit entries, the
+        counters of the patients and the savepoint queries of the
+        transactions.
+        """
+        patients = list(Patient.objects.select_related('user'))
+        self.assertTrue(len(patients) > 1)
+        # Patient 4 filled in a QOHC questionnaire in check_finish_queries
+        last_QOHC_dates = get_last_QOHC_dates(patients)
+        self.assertEqual(last_QOHC_dates.keys(), [4])
+
+        with self.assertNumQueries(len(patients) + 11):
+            questionnaire_requests =\
+                insert_new_questionnaire_requests_for_patients(patients)
+
+        questionnaire_lists = dict(AVAILABLE_CONTROL_QUESTIONNAIRE_LIST)
+        for patient, questionnaire_request in zip(
+                patients, questionnaire_requests):
+            expected = [
+                model for model in questionnaire_lists[patient.diagnose]
+                if model not in (patient.excluded_questionnaires or [])]
+            if patient.id in last_QOHC_dates:
+                expected.remove('QOHCQuestionnaire')
+            self.assertEqual(
+                list(questionnaire_request.requeststep_set.order_by(
+                    'step_nr').values_list('model', flat=True)),
+                expected)
+            self.assertEqual(questionnaire_request.deadline_nr, 1)
+            self.assertEqual(
+                questionnaire_request.patient_diagnose, patient.diagnose)
+
+    def check_api_serialization(self, questionnaire_request):
+        """
+        Check that the serialization plans give the same answers as
+        model_to_dict with the choice labels and many to many names,
+        with one query per questionnaire and many to many relation.
+        """
+        request_steps = list(questionnaire_request.request_steps)
+        expected = []
+        for request_step in request_steps:
+            questionnaire = request_step.questionnaire
+            data = model_to_dict(questionnaire)
+            del data['id']
+            del data['request_step']
+            new_data = {}
+            for name, value in data.items():
+                field = questionnaire._meta.get_field(name)
+                if value is not None:
+                    if isinstance(field, OneToOneField):
+                        continue
+                    elif field.many_to_many:
+                        value = list(getattr(
+                            questionnaire, name).values_list(
+                            'name', flat=True))
+                    elif field.choices:
+                        value = [label for (choice, label) in field.choices
+                                 if choice == value][0]
+                new_data[field.verbose_name] = value
+            expected.append({'name': request_step.model_class.display_name,
+                             'step_nr': request_step.step_nr,
+                             'data': new_data})
+
+        num_queries = sum(
+            [1 + len(request_step.model_class._meta.many_to_many)
+             for request_step in request_steps])
+        with self.assertNumQueries(num_queries):
+            self.assertEqual(serialize_request_steps(request_steps), expected)
+
+    def check_questionnaire_scores(self, questionnaire_request):
+        """
+        Check that the stored graphic scores of a finished control match
+        the graphic scores of the questionnaires, also after removing
+        and restoring them with the update_questionnaire_scores command.
+        """
+        expected = {}
+        for request_step in questionnaire_request.requeststep_set.all():
+            questionnaire = request_step.questionnaire
+            if hasattr(questionnaire, 'graphic_score_display'):
+                expected[request_step.pk] = (
+                    questionnaire.display_name,
+                    float(questionnaire.graphic_score_display))
+        self.assertTrue(len(expected) > 0)
+
+        scores = QuestionnaireScore.objects.filter(
+            request_step__questionnairerequest=questionnaire_request)
+        for i in range(2):
+            self.assertEqual(
+                dict((score.request_step_id, (score.category, score.score))
+                     for score in scores.all()),
+                expected)
+            scores.delete()
+            call_command('update_questionnaire_scores', stdout=StringIO())
+
+    def check_graphic_scores(self, questionnaire_request):
+        """
+        Check that the graphic scores calculated per queryset are the
+        same as the graphic_score_display of the questionnaires.
+        """
+        checked = 0
+        for model in get_graphic_score_models():
+            model_class = get_model_class(model)
+            queryset = model_class.objects.filter(
+                request_step__questionnairerequest=questionnaire_request)
+            expected = dict(
+                (questionnaire.pk, questionnaire.graphic_score_display)
+                for questionnaire in queryset)
+            if not expected:
+                continue
+
+            num_queries = 1
+            if model_class in (QOLChronCUQuestionnaire, QOLQuestionnaire):
+                num_queries = 2
+            with self.assertNumQueries(num_queries):
+                scores = dict(get_graphic_scores(queryset))
+            self.assertEqual(scores, expected)
+            checked += 1
+        self.assertTrue(checked > 0)
+
+    def check_prefetch_questionnaires(self):
+        """
+        Check that the questionnaires of a list of controls are
+        retrieved with one query for the request steps and one
+        query per questionnaire model class.
+        """
+        questionnaire_requests = list(QuestionnaireRequest.objects.filter(
+            finished_on__isnull=False))
+        self.assertTrue(len(questionnaire_requests) > 0)
+        models = set(RequestStep.objects.filter(
+            questionnairerequest__in=questionnaire_requests).values_list(
+            'model', flat=True))
+
+        with self.assertNumQueries(1 + len(models)):
+            prefetch_questionnaires(questionnaire_requests)
+
+        found = {}
+        with self.assertNumQueries(0):
+            for questionnaire_request in questionnaire_requests:
+                for request_step in questionnaire_request.request_steps:
+                    questionnaire = request_step.questionnaire
+                    if questionnaire is not None:
+                        self.assertEqual(questionnaire.finished_on,
+                                         questionnaire_request.finished_on)
+                    found[request_step.pk] = questionnaire
+
+        for request_step in RequestStep.objects.filter(
+                questionnairerequest__in=questionnaire_requests):
+            self.assertEqual(found[request_step.pk],
+                             request_step.questionnaire)
+
+        # Already retrieved request steps are not queried again
+        request_steps = questionnaire_requests[0].request_steps
+        with self.assertNumQueries(0):
+            prefetch_questionnaires(request_steps)
+
+    def check_control_summary(self):
+        """
+        Check that the control summary is stored on finishing and
+        by the update_control_summaries command, and that the
+        summary properties don't need queries once it is stored.
+        """
+        properties = ('appointment_on_short_term', 'blood_taken',
+                      'blood_taken_date', 'patient_needs_appointment',
+                      'appointment_period_date', 'appointment_period')
+
+        finished = QuestionnaireRequest.objects.filter(
+            finished_on__isnull=False)
+        for questionnaire_request in finished.filter(summary_stored=True):
+            self.assertEqual(
+                questionnaire_request.get_summary_differences(), [])
+
+        # Backfill controls finished without summary
+        finished.filter(urgent=False).update(summary_stored=False)
+        expected = {}
+        for questionnaire_request in finished:
+            expected[questionnaire_request.pk] = [
+                getattr(questionnaire_request, name) for name in properties]
+        self.assertRaises(
+            CommandError, call_command, 'update_control_summaries',
+            check=True, stdout=StringIO())
+        call_command('update_control_summaries', stdout=StringIO())
+        call_command(
+            'update_control_summaries', check=True, stdout=StringIO())
+
+        questionnaire_requests = list(finished.all())
+        with self.assertNumQueries(0):
+            for questionnaire_request in questionnaire_requests:
+                self.assertTrue(questionnaire_request.summary_stored)
+                self.assertEqual(
+                    [getattr(questionnaire_request, name)
+                     for name in properties],
+                    expected[questionnaire_request.pk])
+
+        # Outdated summaries are reported
+        QuestionnaireRequest.objects.filter(
+            pk=questionnaire_requests[0].pk).update(
+            summary_appointment_period='outdated')
+        self.assertRaises(
+            CommandError, call_command, 'update_control_summaries',
+            check=True, stdout=StringIO())
+
+    def check_research_export(self):
+        """
+        Check the research export of the finished questionnaires,
+        the rows are retrieved with one query per chunk and one
+        query per many to many relation per chunk.
+        """
+        exported = 0
+        for model in PACKAGE_LOCATION:
+            model_class = get_model_class(model)
+            questionnaires = list(model_class.objects.filter(
+                request_step__model=model,
+                request_step__questionnairerequest__finished_on__isnull=False
+            ).order_by('pk'))
+            if not questionnaires:
+                continue
+
+            fields, m2m_fields = get_export_fields(model_class)
+            with self.assertNumQueries(2 + len(m2m_fields)):
+                rows = list(iter_questionnaire_rows(model_class))
+            self.assertEqual(
+                rows[0],
+                [name for (name, field_type)
+                 in get_export_schema(model_class)])
+            self.assertEqual(len(rows) - 1, len(questionnaires))
+
+            for questionnaire, row in zip(questionnaires, rows[1:]):
+                values = dict(zip(rows[0], row))
+                self.assertNotEqual(
+                    values['patient'], questionnaire.patient.pk)
+                for field in fields:
+                    display = getattr(
+                        questionnaire, 'get_%s_display' % field.name, None)
+                    if display is not None and field.choices:
+                        self.assertEqual(values[field.name], display())
+            exported += 1
+        self.assertTrue(exported > 0)
+
+        # The command writes the csv and schema files
+        model_class = get_model_class('StartQuestionnaire')
+        rows = list(iter_questionnaire_rows(model_class))
+        output = os.path.join(tempfile.mkdtemp(), 'export.csv')
+        call_command('export_questionnaires', 'StartQuestionnaire', output,
+                     chunk_size=1, stderr=StringIO())
+        with open(output, 'rb') as output_file:
+            csv_rows = list(csv.reader(output_file))
+        self.assertEqual(csv_rows[0], rows[0])
+        self.assertEqual(len(csv_rows), len(rows))
+        with open(output + '.schema.json') as schema_file:
+            self.assertEqual(
+                [column['name'] for column in json.load(schema_file)],
+                rows[0])
+        shutil.rmtree(os.path.dirname(output))
+
     def test_controles(self):
         """
         Questionnaire tests runner
@@ -373,3 +799,9 @@ class QuestionnaireTest(BaseUnitTest):
         # self.check_other_forms()
         self.check_controle_navigation(urgent=False)
         self.check_controle_navigation(urgent=True)
+        self.check_final_revalidation()
+        self.check_finish_queries()
+        self.check_prefetch_questionnaires()
+        self.check_control_summary()
+        self.check_research_export()
+        self.check_insert_new_questionnaire_requests()
@@ -12,23 +12,117 @@ from datetime import date
 from dateutil.relativedelta import relativedelta
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
+from django.db import transaction
+from django.db.models import Max
 from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.shortcuts import render_to_response, get_object_or_404
 
 from apps.healthperson.patient.models import Patient
 from apps.questionnaire.models import QuestionnaireRequest,\
     AVAILABLE_URGENT_QUESTIONNAIRE_LIST, RequestStep,\
-    AVAILABLE_CONTROL_QUESTIONNAIRE_LIST
+    AVAILABLE_CONTROL_QUESTIONNAIRE_LIST, QuestionnaireScore
 from apps.questionnaire.qohc.models import QOHCQuestionnaire
 from django.views.generic.base import TemplateView, View
 from django.utils.decorators import method_decorator
+from core.models import save_audit_entries
+from apps.utils.counters import update_counters
 
 
 # ## ADD QUESTIONNAIRE REQUEST ####
+def get_last_QOHC_dates(patients):
+    """
+    Retrieve the finished date of the last QOHC questionnaire of
+    the patients with one query.
+
+    Args:
+        - patients: the patients (or patient ids)
+
+    Returns:
+        A dict with the finished date per patient id, patients
+        without a QOHC questionnaire are not included.
+    """
+    return dict(QOHCQuestionnaire.objects.filter(
+        request_step__questionnairerequest__patient__in=patients).order_by(
+        ).values_list('request_step__questionnairerequest__patient').annotate(
+        Max('request_step__questionnairerequest__finished_on')))
+
+
+def insert_new_questionnaire_requests_for_patients(patients):
+    """
+    Adds a new questionnaire request for every patient including the
+    requeststeps. The dates of the last QOHC questionnaires are
+    retrieved with one query and the requeststeps, audit entries and
+    counters of the patients are saved in bulk in one transaction.
+
+    .. note:: Use select_related('user') on the patients, the user is
+              used for the audit entries.
+
+    Args:
+        - patients: the patients to add the questionnaire_request for
+
+    Returns:
+        A list with the created questionnaire_requests
+    """
+    questionnaire_lists = dict(AVAILABLE_CONTROL_QUESTIONNAIRE_LIST)
+    last_QOHC_dates = get_last_QOHC_dates(patients)
+
+    questionnaire_requests = []
+    request_steps = []
+    log_entries = []
+    with transaction.atomic():
+        for patient in patients:
+            questionnaire_request = QuestionnaireRequest(patient=patient)
+            questionnaire_request.deadline =\
+                date.today() + relativedelta(weeks=+1)
+            questionnaire_request.deadline_nr = 1
+            questionnaire_request.patient_diagnose = patient.diagnose
+            questionnaire_request.practitioner_id =\
+                patient.current_practitioner_id
+            # Added for auditing
+            questionnaire_request.changed_by_user = patient.user
+            log_entry = questionnaire_request.save_without_audit_entry()
+            if log_entry:
+                log_entries.append(log_entry)
+            questionnaire_requests.append(questionnaire_request)
+
+            # QOHC needs to be filled in once a year,
+            # check if a year has passed since the last one.
+            do_add_QOHC = True
+            last_QOHC_date = last_QOHC_dates.get(patient.id)
+            if last_QOHC_date:
+                if ((last_QOHC_date + relativedelta(years=+1)) >
+                        date.today()):
+                    do_add_QOHC = False
+
+            # add steps of request
+            # if not in exclude_questionnaires list..
+            step = 1
+            for questionnaire in questionnaire_lists[patient.diagnose]:
+                do_add = True
+                if questionnaire == 'QOHCQuestionnaire':
+                    do_add = do_add_QOHC
+                elif patient.excluded_questionnaires:
+                    if questionnaire in patient.excluded_questionnaires:
+                        do_add = False
+                if do_add:
+                    request_steps.append(RequestStep(
+                        questionnairerequest=questionnaire_request,
+                        step_nr=step,
+                        model=questionnaire))
+                    step = step + 1
+
+        RequestStep.objects.bulk_create(request_steps)
+        save_audit_entries(log_entries)
+        update_counters([patient.id for patient in patients])
+
+    return questionnaire_requests
+
+
 def insert_new_questionnaire_request_for_patient(patient):
     """
     Adds a new questionnaire request for a patient including
-    the requeststeps
+    the requeststeps, see
+    :func:`insert_new_questionnaire_requests_for_patients`
 
     Args:
         - patient: the patient to add the questionnaire_request for
@@ -36,59 +130,7 @@ def insert_new_questionnaire_request_for_patient(patient):
     Returns:
         The created questionnaire_request
     """
-    questionnaire_list = None
-    for l in AVAILABLE_CONTROL_QUESTIONNAIRE_LIST:
-        if l[0] == patient.diagnose:
-            questionnaire_list = l[1]
-
-    # questionnaire_list
-    questionnaire_request = QuestionnaireRequest(patient=patient)
-    questionnaire_request.deadline = date.today() + relativedelta(weeks=+1)
-    questionnaire_request.deadline_nr = 1
-    questionnaire_request.patient_diagnose = patient.diagnose
-    questionnaire_request.practitioner = patient.current_practitioner
-    # Added for auditing
-    questionnaire_request.changed_by_user = patient.user
-    questionnaire_request.save()
-
-    # add steps of request.
-    # Check if we need to add the QOHC questionnaire (=only asked once a year)
-    do_add_QOHC = True
-
-    try:
-        QOHC_questionnaire = QOHCQuestionnaire.objects.filter(
-            request_step__questionnairerequest__patient=patient).latest(
-            'request_step__questionnairerequest__finished_on')
-    except QOHCQuestionnaire.DoesNotExist:
-        QOHC_questionnaire = None
-
-    # QOHC needs to be filled in once a year,
-    # check if a year has passed since the last one.
-    if QOHC_questionnaire:
-        if (((QOHC_questionnaire.finished_on + relativedelta(years=+1)) >
-             date.today())):
-            do_add_QOHC = False
-
-    # add steps of request
-    # if not in exclude_questionnaires list..
-    step = 1
-    for questionnaire in questionnaire_list:
-        do_add = True
-        if questionnaire == 'QOHCQuestionnaire':
-            do_add = do_add_QOHC
-        elif patient.excluded_questionnaires:
-            if questionnaire in patient.excluded_questionnaires:
-                    do_add = False
-        if do_add:
-            questionnaire_request_step = RequestStep()
-            questionnaire_request_step.questionnairerequest =\
-                questionnaire_request
-            questionnaire_request_step.step_nr = step
-            questionnaire_request_step.model = questionnaire
-            step = step + 1
-            questionnaire_request_step.save()
-
-    return questionnaire_request
+    return insert_new_questionnaire_requests_for_patients([patient])[0]
 
 
 class PatientView(View):
@@ -153,7 +195,7 @@ class BaseOverviewTemplateView(PatientTemplateView):
               should be coupled to the questionnaires.
 
         Returns:
-            [The selected questionnaire, list of questionnaires]
+            [The selected questionnaire, list of questionnaire scores]
         """
         # get the selected one based on the questionnaire_step
         qr_selected = selected_questionnaire_request
@@ -161,11 +203,11 @@ class BaseOverviewTemplateView(PatientTemplateView):
             selected_model_class.objects.get(
                 request_step__questionnairerequest=qr_selected)
 
-        # Get all
-        disease_activity_questionnares =\
-            selected_model_class.objects.filter(
-                request_step__questionnairerequest__patient=self.patient,
-                request_step__questionnairerequest__finished_on__isnull=False)
+        # Get the scores of all for the graphic
+        disease_activity_questionnares = QuestionnaireScore.objects.filter(
+            patient=self.patient,
+            category=selected_model_class.display_name,
+            model=selected_model_class.__name__).order_by('finished_on')
 
         return [select_disease_activity_questionnare,
                 disease_activity_questionnares]
@@ -287,6 +329,7 @@ class QuestionnaireStartControle(PatientView):
         if len(unfinished_questionnaire_requests) > 1:
             # remove all
             unfinished_questionnaire_requests.delete()
+            update_counters([self.patient.id])
             add_new_questionnaire = True
         elif len(unfinished_questionnaire_requests) == 1:
             # Check if unfinished questionnare is still
@@ -363,6 +406,7 @@ class QuestionnaireStartUrgent(PatientView):
         if len(unfinished_urgent_questionnaire_requests) > 1:
             # remove all
             unfinished_urgent_questionnaire_requests.delete()
+            update_counters([self.patient.id])
             add_new_questionnaire = True
         elif len(unfinished_urgent_questionnaire_requests) == 1:
             # Check if unfinished questionnare is still
@@ -23,11 +23,19 @@ and saving data:
        the storage instance and used to initalize & save instances of the
        models which are coupled to the forms.
 
+Every time a form validates, its cleaned data is stored in the storage
+instance together with a fingerprint of the step data (and the patient
+settings the forms depend on) it was validated from. On the final post
+only the steps of which the fingerprint no longer matches are validated
+again, all other steps reuse the stored cleaned data.
+
 :subtitle:`Class definitions:`
 """
-
+import json
+import hashlib
 from datetime import date
 from django import forms
+from django.db import models
 from django.utils import six
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseRedirect, Http404
@@ -35,6 +43,7 @@ from formtools.wizard.views import WizardView
 from django.shortcuts import get_object_or_404
 from django.utils.datastructures import MultiValueDict
 from collections import OrderedDict as SortedDict
+from django.core.serializers.json import DjangoJSONEncoder
 from core.forms import FormDateField, ChoiceOtherField
 
 from apps.healthperson.patient.models import Patient
@@ -50,6 +59,19 @@ class NoFileStorageConfigured(Exception):
     pass
 
 
+class ValidatedStep(object):
+    """
+    Replaces a form in the list passed to
+    :meth:`QuestionnaireWizard.done` for steps of which the stored
+    step data has been validated before. Only provides the attributes
+    used by the done method, so the form does not need to be
+    initialized and validated again.
+    """
+    def __init__(self, form_class, cleaned_data):
+        self.Meta = form_class.Meta
+        self.cleaned_data = cleaned_data
+
+
 class QuestionnaireWizard(WizardView):
     """
     Questionnaire Wizard view class Used for all questionnaires
@@ -305,15 +327,30 @@ class QuestionnaireWizard(WizardView):
                 self.storage.set_step_data(self.steps.current, None)
                 self.storage.set_step_files(self.steps.current, None)
                 self.storage.set_unclean_data(self.steps.current, post_dict)
+                self.storage.set_validated_data(self.steps.current, None)
 
         if save_and_exit:
             # redirect to the homepage
             if not self.questionnaire_request.saved_finish_later:
                 self.questionnaire_request.saved_finish_later = True
-                self.questionnaire_request.save()
+                self.questionnaire_request_changed = True
+            self.save_questionnaire_request()
             return HttpResponseRedirect(reverse('index'))
 
-        return super(QuestionnaireWizard, self).post(request, *args, **kwargs)
+        response = super(QuestionnaireWizard, self).post(
+            request, *args, **kwargs)
+        self.save_questionnaire_request()
+        return response
+
+    def save_questionnaire_request(self):
+        """
+        Saves the changes made to the questionnaire_request while
+        processing the posted form, so the questionnaire_request is
+        saved at most once per post.
+        """
+        if getattr(self, 'questionnaire_request_changed', False):
+            self.questionnaire_request.save()
+            self.questionnaire_request_changed = False
 
     def get(self, request, *args, **kwargs):
         """
@@ -373,9 +410,9 @@ class QuestionnaireWizard(WizardView):
             The form step data for the given form
         """
         model_name = form.Meta.model._meta.object_name
-        current_questionnaire_step =\
-            self.questionnaire_request.requeststep_set.get(model=model_name)
-        questionnaire_step = current_questionnaire_step.step_nr
+        for current_questionnaire_step in self.questionnaire_all_steps:
+            if current_questionnaire_step.model == model_name:
+                questionnaire_step = current_questionnaire_step.step_nr
 
         # save last filled_in_step and form_step
         if self.questionnaire_request.last_filled_in_step:
@@ -399,13 +436,197 @@ class QuestionnaireWizard(WizardView):
         if not self.questionnaire_request.saved_finish_later:
             self.questionnaire_request.saved_finish_later = True
 
-        self.questionnaire_request.save()
+        # saved after the post has been processed, or together with the
+        # questionnaires when this is the last form.
+        self.questionnaire_request_changed = True
 
         # make sure the unclean_data is removed for this step
         self.storage.set_unclean_data(self.steps.current, None)
 
+        # store the cleaned data so the form does not need to be
+        # validated again when the last form is posted.
+        self.set_validated_step(self.steps.current, form)
+
         return self.get_form_step_data(form)
 
+    def get_step_fingerprint(self, step, data):
+        """
+        Creates a fingerprint of everything the validation of a step
+        depends on: the form class, the step data, the patient settings
+        used by the forms and the current date (used by date validation).
+
+        Args:
+            - step: the step key
+            - data: the step data as stored in the storage instance
+
+        Returns:
+            The fingerprint in hexadecimal format
+        """
+        if isinstance(data, MultiValueDict):
+            data = dict(data.lists())
+
+        form_class = self.form_list[step]
+        fingerprint_data = {
+            'step': step,
+            'form_class': '{0}.{1}'.format(
+                form_class.__module__, form_class.__name__),
+            'data': data,
+            'patient': [self.patient.pk,
+                        self.patient.always_appointment,
+                        self.patient.include_blood_taken_questions],
+            'date': date.today(),
+        }
+        return hashlib.sha1(json.dumps(
+            fingerprint_data, cls=DjangoJSONEncoder,
+            sort_keys=True)).hexdigest()
+
+    def serialize_cleaned_data(self, cleaned_data):
+        """
+        Helper function for converting cleaned_data into a format
+        that can be stored in the storage instance, model instances
+        are replaced by their primary keys.
+
+        Args:
+            - cleaned_data: the cleaned_data of a valid form
+
+        Returns:
+            The serialized cleaned_data
+        """
+        serialized = {}
+        for name, value in six.iteritems(cleaned_data):
+            if isinstance(value, models.Model):
+                value = value.pk
+            elif isinstance(value, (list, tuple, models.QuerySet)):
+                value = [obj.pk if isinstance(obj, models.Model) else obj
+                         for obj in value]
+            serialized[name] = value
+        return serialized
+
+    def deserialize_cleaned_data(self, form_class, cleaned_data):
+        """
+        Helper function for converting serialized cleaned_data back
+        to the values the form would return, by using the fields of
+        the model coupled to the form_class. Values for many to many
+        fields are kept as a list of primary keys, which can be stored
+        without retrieving the related objects.
+
+        Args:
+            - form_class: the form_class the cleaned_data belongs to
+            - cleaned_data: the serialized cleaned_data
+
+        Returns:
+            The cleaned_data
+        """
+        model_meta = form_class.Meta.model._meta
+        fields = dict((field.name, field) for field in model_meta.fields)
+
+        deserialized = {}
+        for name, value in six.iteritems(cleaned_data):
+            if name in fields and value is not None:
+                field = fields[name]
+                if field.is_relation:
+                    value = field.related_model.objects.get(pk=value)
+                else:
+                    value = field.to_python(value)
+            deserialized[name] = value
+        return deserialized
+
+    def set_validated_step(self, step, form):
+        """
+        Stores the cleaned_data of a valid form together with the
+        fingerprint of the data the form was validated with.
+
+        Args:
+            - step: the step key
+            - form: the validated form for the step
+        """
+        self.storage.set_validated_data(
+            step,
+            self.get_step_fingerprint(step, form.data),
+            self.serialize_cleaned_data(form.cleaned_data))
+
+    def get_validated_cleaned_data(self, step):
+        """
+        Get the stored cleaned_data for a step if the step data did
+        not change since it was validated.
+
+        Args:
+            - step: the step key
+
+        Returns:
+            The cleaned_data or None if the step needs to be validated
+        """
+        validated_data = self.storage.get_validated_data(step)
+        if validated_data is not None:
+            fingerprint, cleaned_data = validated_data
+            if fingerprint == self.get_step_fingerprint(
+                    step, self.storage.get_step_data(step)):
+                return self.deserialize_cleaned_data(
+                    self.form_list[step], cleaned_data)
+        return None
+
+    def get_cleaned_data_for_step(self, step):
+        """
+        Override of the baseclass method which only validates the
+        stored data again if it changed since the last validation.
+
+        Args:
+            - step: the step key
+
+        Returns:
+            The cleaned data for the step or None
+        """
+        if step in self.form_list:
+            cleaned_data = self.get_validated_cleaned_data(step)
+            if cleaned_data is not None:
+                return cleaned_data
+
+            form_obj = self.get_form(
+                step=step,
+                data=self.storage.get_step_data(step),
+                files=self.storage.get_step_files(step))
+            if form_obj.is_valid():
+                self.set_validated_step(step, form_obj)
+                return form_obj.cleaned_data
+        return None
+
+    def render_done(self, form, **kwargs):
+        """
+        Override of the baseclass method which re-validates all steps
+        before calling done. Steps of which the stored data did not change
+        since the last validation are not validated again.
+
+        Args:
+            - form: the last posted form
+
+        Returns:
+            The response of the done method or the
+            render_revalidation_failure method
+        """
+        final_forms = SortedDict()
+        for form_key in self.get_form_list():
+            cleaned_data = self.get_validated_cleaned_data(form_key)
+            if cleaned_data is not None:
+                final_forms[form_key] = ValidatedStep(
+                    self.form_list[form_key], cleaned_data)
+                continue
+
+            form_obj = self.get_form(
+                step=form_key,
+                data=self.storage.get_step_data(form_key),
+                files=self.storage.get_step_files(form_key))
+            if not form_obj.is_valid():
+                return self.render_revalidation_failure(
+                    form_key, form_obj, **kwargs)
+            final_forms[form_key] = form_obj
+
+        # Note: reset the storage so done can not be rendered
+        # twice with the same data.
+        done_response = self.done(
+            list(final_forms.values()), form_dict=final_forms, **kwargs)
+        self.storage.reset()
+        return done_response
+
     def get_template_names(self):
         """
         Returns:
@@ -514,45 +735,24 @@ class QuestionnaireWizard(WizardView):
         Returns:
             Redirect to 'finished url'
         """
-        questionnaire_all_steps =\
-            self.questionnaire_request.requeststep_set.all().order_by(
-                'step_nr')
-
-        for questionnaire_step in questionnaire_all_steps:
-            questionnaire_model_class = questionnaire_step.model_class
-            kwargs = {'request_step': questionnaire_step}
-
-            # Collect clean_data excluding many_to_many fields
-            for form in form_list:
-                if ((form.Meta.model._meta.object_name ==
-                     questionnaire_step.model)):
-                    kwargs.update(form.cleaned_data)
-                    # Remove m2m, will be picked up below
-                    for field in questionnaire_model_class._meta.many_to_many:
-                        if field.name in kwargs:
-                            del kwargs[field.name]
-
-            # Initialize the instance with kwargs and save
-            questionnaire_instance = questionnaire_model_class(**kwargs)
-            # added line for auditing
-            questionnaire_instance.changed_by_user = self.request.user
-            questionnaire_instance.save()
-
-            # Save m2m data
-            for form in form_list:
-                if ((form.Meta.model._meta.object_name ==
-                     questionnaire_step.model)):
-                    cleaned_data = form.cleaned_data
-                    for field in questionnaire_model_class._meta.many_to_many:
-                        if field.name in cleaned_data:
-                            object_manager = getattr(
-                                questionnaire_instance, field.name)
-                            for obj in cleaned_data[field.name]:
-                                object_manager.add(obj)
+        # Collect the cleaned_data per questionnaire model, every form
+        # of a model includes the many to many fields so combine those.
+        questionnaire_data = {}
+        for form in form_list:
+            model_meta = form.Meta.model._meta
+            m2m_names = [field.name for field in model_meta.many_to_many]
+            data = questionnaire_data.setdefault(model_meta.object_name, {})
+            for name, value in form.cleaned_data.items():
+                if name in m2m_names:
+                    data.setdefault(name, []).extend(value)
+                else:
+                    data[name] = value
 
         # Note: storage is made empty automatically
-        self.questionnaire_request.finished_on = date.today()
-        self.questionnaire_request.save()
+        self.questionnaire_request.finish(
+            questionnaire_data, self.request.user,
+            request_steps=self.questionnaire_all_steps)
+        self.questionnaire_request_changed = False
 
         patient_session_id = self.kwargs.get('patient_session_id')
         url = reverse(
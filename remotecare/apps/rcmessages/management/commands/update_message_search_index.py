@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Management command for (re)building the search tokens of the messages
+(see :mod:`apps.utils.search`), for example for the messages which
+were added before the search index existed.
+
+The messages are decrypted and indexed per chunk, every chunk in its
+own transaction.
+
+:subtitle:`Class definitions:`
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.rcmessages.models import RCMessage
+from apps.utils.search import update_search_tokens
+
+
+class Command(BaseCommand):
+    """
+    Store the search tokens of all messages
+    """
+    help = 'Store the search tokens of all messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of messages to process per chunk')
+
+    def handle(self, *args, **options):
+        rc_messages = RCMessage.objects.only(
+            'patient', *RCMessage.SEARCH_FIELDS).order_by('pk')
+
+        indexed = 0
+        last_pk = 0
+        while True:
+            chunk = list(rc_messages.filter(
+                pk__gt=last_pk)[:options['chunk_size']])
+            if not chunk:
+                break
+            last_pk = chunk[-1].pk
+
+            with transaction.atomic():
+                update_search_tokens('RCMessage', [
+                    (rc_message.id, rc_message.patient_id,
+                     rc_message.get_search_text())
+                    for rc_message in chunk])
+            indexed += len(chunk)
+
+        self.stdout.write('Stored the search tokens of %s messages' % indexed)
@@ -12,6 +12,40 @@ from apps.healthperson.healthprofessional.models import HealthProfessional
 from apps.healthperson.secretariat.models import Secretary
 from django.utils.functional import cached_property
 from apps.questionnaire.models import QuestionnaireRequest
+from apps.utils.counters import update_counters
+from apps.utils.search import update_search_tokens, remove_search_tokens
+
+
+class RCMessageQuerySet(models.QuerySet):
+    '''
+    Queryset with the projection for message lists
+    '''
+    def list_fields(self):
+        """
+        Defers the message body, so only the subject is fetched and
+        decrypted. The body is loaded when it's accessed, which should
+        only happen on a details page.
+
+        Returns:
+            The queryset without the message body
+        """
+        return self.defer('internal_message')
+
+    def with_senders(self):
+        """
+        Retrieves the senders, the patient and the related control
+        which are shown in the message lists with the messages, so
+        a list needs the same number of queries for any number of
+        messages.
+
+        Returns:
+            The queryset with the related objects of the list
+        """
+        return self.select_related(
+            'secretary__user',
+            'healthprofessional__user',
+            'patient__user',
+            'related_to')
 
 
 class RCMessage(AuditBaseModel):
@@ -51,6 +85,44 @@ class RCMessage(AuditBaseModel):
     added_on = models.DateField(auto_now_add=True)
     read_on = models.DateField(blank=True, null=True,)
 
+    objects = RCMessageQuerySet.as_manager()
+
+    # The fields of which the words are in the search index
+    SEARCH_FIELDS = ('subject', 'internal_message')
+
+    def save(self, **kwargs):
+        """
+        Saves the message and updates the unread message counter
+        of the patient and, if the text is saved, the search tokens
+        of the message (see :mod:`apps.utils.search`)
+        """
+        super(RCMessage, self).save(**kwargs)
+        update_fields = kwargs.get('update_fields')
+        if ((update_fields is None or
+             set(update_fields) & set(self.SEARCH_FIELDS))):
+            update_search_tokens('RCMessage', [
+                (self.id, self.patient_id, self.get_search_text())])
+        update_counters([self.patient_id])
+
+    def delete(self, **kwargs):
+        """
+        Removes the message and its search tokens and updates the
+        unread message counter of the patient
+        """
+        message_id = self.id
+        result = super(RCMessage, self).delete(**kwargs)
+        remove_search_tokens('RCMessage', [message_id])
+        update_counters([self.patient_id])
+        return result
+
+    def get_search_text(self):
+        """
+        Returns:
+            The text of which the words are in the search index
+        """
+        return u' '.join([getattr(self, name) or u''
+                          for name in self.SEARCH_FIELDS])
+
     def message(self):
         """
         Shortcut to the internal_message field
@@ -83,9 +155,9 @@ class RCMessage(AuditBaseModel):
             The id of the EncryptionKey that is used to encrypt the
             model instance.
         """
-        patient = Patient.objects.select_related(
-            'user').get(id=self.patient_id)
-        return patient.user.personal_encryption_key_id
+        from apps.account.models import EncryptionKey
+
+        return EncryptionKey.get_id_with_healthperson_id(self.patient_id)
 
     @cached_property
     def encryption_key(self):
@@ -4,9 +4,18 @@ Module containing message tests.
 
 :subtitle:`Class definitions:`
 """
+from datetime import date, timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from core.unittest.baseunittest import BaseUnitTest
 from apps.rcmessages.models import RCMessage
+from apps.rcmessages.views import MESSAGES_PER_PAGE
+from apps.healthperson.healthprofessional.models import HealthProfessional
 from apps.healthperson.secretariat.models import Secretary
+from apps.questionnaire.views import\
+    insert_new_questionnaire_request_for_patient
+from apps.service.utils import run_daily_stage
+from apps.utils.counters import get_counters
 
 
 class RCMessageTest(BaseUnitTest):
@@ -66,3 +75,172 @@ class RCMessageTest(BaseUnitTest):
         # Check if the same
         self.assertEqual(message.internal_message, internal_message)
         self.assertEqual(message.subject, subject)
+
+    def login_patient(self):
+        """
+        Log in as the patient frank
+
+        Returns:
+            The patient and the url of the message overview
+        """
+        self.login('frank@example.com')
+        res = self.get('/')
+        patient = res.context_data['patient']
+        session_key = self.get_session_key(patient.health_person_id)
+        return patient, '/messages/patient/' + session_key + '/'
+
+    def add_messages(self, patient, count, secretary=None,
+                     related_to=None):
+        """
+        Add messages for a patient from the first healthprofessional
+
+        Args:
+            - patient: the patient to add the messages for
+            - count: the number of messages to add
+            - secretary: if given every second message is sent by\
+              this secretary
+            - related_to: if given every third message (starting with\
+              the first) is related to this questionnaire request
+
+        Returns:
+            The list of added messages
+        """
+        healthprofessional = HealthProfessional.objects.all()[0]
+        messages = []
+        for i in range(count):
+            message = RCMessage(
+                patient=patient, subject='Bericht {0}'.format(i),
+                internal_message='Inhoud {0}'.format(i))
+            if secretary is not None and i % 2:
+                message.secretary = secretary
+            else:
+                message.healthprofessional = healthprofessional
+            if related_to is not None and i % 3 == 0:
+                message.related_to = related_to
+            message.changed_by_user = healthprofessional.user
+            message.save()
+            messages.append(message)
+        return messages
+
+    def test_message_pages(self):
+        """
+        Test the keyset pagination of the message overview and that the
+        message lists only load the subjects
+        """
+        patient, url = self.login_patient()
+        message = self.add_messages(patient, MESSAGES_PER_PAGE * 2 + 3)[-1]
+        # messages of the same day are ordered by id
+        RCMessage.objects.filter(id__lte=message.id - 10).update(
+            added_on=date.today() - timedelta(days=1))
+        expected = list(RCMessage.objects.filter(
+            patient=patient).order_by('-added_on', '-id').values_list(
+            'id', flat=True))
+
+        ids = []
+        cursor = None
+        pages = 0
+        while True:
+            res = self.get(url + ('?before=' + cursor if cursor else ''))
+            rc_messages = res.context['rc_messages']
+            self.assertTrue(len(rc_messages) <= MESSAGES_PER_PAGE)
+            for rc_message in rc_messages:
+                # only the subject is loaded
+                self.assertIn('internal_message',
+                              rc_message.get_deferred_fields())
+            ids += [rc_message.id for rc_message in rc_messages]
+            pages += 1
+            cursor = res.context['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 3)
+
+        # The body is decrypted on access and on the details page
+        rc_message = res.context['rc_messages'][0]
+        self.assertEqual(rc_message.internal_message,
+                         RCMessage.objects.get(
+                             id=rc_message.id).internal_message)
+        res = self.get(url + str(expected[-1]) + '/details/')
+        self.assertEqual(res.context['message'].internal_message,
+                         'Inhoud 0')
+
+        # An invalid cursor shows the first page
+        res = self.get(url + '?before=invalid')
+        self.assertEqual([rc_message.id for rc_message in
+                          res.context['rc_messages']],
+                         expected[:MESSAGES_PER_PAGE])
+
+    def test_counters(self):
+        """
+        Test that the unread message counter of the patient is updated
+        when a message is added, read, handled or removed and that the
+        daily run corrects it
+        """
+        patient, url = self.login_patient()
+        user = patient.user
+        healthprofessional = HealthProfessional.objects.all()[0]
+        unread = RCMessage.objects.filter(
+            patient=patient, read_on__isnull=True).count()
+        self.assertEqual(get_counters(patient.id).unread_messages, unread)
+
+        message = self.add_messages(patient, 1)[0]
+        # the badge is read with one query
+        with self.assertNumQueries(1):
+            self.assertEqual(user.new_message_count, unread + 1)
+
+        # a message of a not handled control is not visible yet
+        questionnaire_request = insert_new_questionnaire_request_for_patient(
+            patient)
+        self.assertTrue(user.new_questionnaire_request)
+        related_message = self.add_messages(
+            patient, 1, related_to=questionnaire_request)[0]
+        self.assertEqual(user.new_message_count, unread + 1)
+        questionnaire_request.handled_on = date.today()
+        questionnaire_request.changed_by_user = healthprofessional.user
+        questionnaire_request.save()
+        self.assertEqual(user.new_message_count, unread + 2)
+
+        # reading and removing messages
+        self.get(url + str(message.id) + '/details/')
+        self.assertEqual(user.new_message_count, unread + 1)
+        related_message.delete()
+        self.assertEqual(user.new_message_count, unread or 'no')
+
+        # changes which bypass the models are corrected by the daily run
+        RCMessage.objects.filter(id=message.id).update(read_on=None)
+        self.assertEqual(user.new_message_count, unread or 'no')
+        run_daily_stage('reconcile_counters', workers=1)
+        self.assertEqual(user.new_message_count, unread + 1)
+
+    def test_overview_queries(self):
+        """
+        Test that the message overview needs the same number of queries
+        for any number of messages and that the audit encryption key is
+        retrieved from the cache
+        """
+        patient, url = self.login_patient()
+        secretary = Secretary.objects.all()[0]
+
+        def add_messages(count):
+            questionnaire_request =\
+                insert_new_questionnaire_request_for_patient(patient)
+            questionnaire_request.urgent = True
+            questionnaire_request.save()
+            return self.add_messages(patient, count, secretary=secretary,
+                                     related_to=questionnaire_request)
+
+        message = add_messages(2)[-1]
+        with self.assertNumQueries(0):
+            self.assertEqual(message.audit_encryption_key_id,
+                             patient.user.personal_encryption_key_id)
+
+        # get_session_key and the login pages are not part of the page
+        self.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.get(url)
+        self.assertTrue(len(queries) > 0)
+
+        add_messages(50)
+        with self.assertNumQueries(len(queries)):
+            res = self.get(url)
+        self.assertEqual(len(res.context['rc_messages']), MESSAGES_PER_PAGE)
@@ -3,15 +3,23 @@
 This module contains the class based views and functions
 for messages.
 
+The message lists are paginated with a keyset on (added_on, id): a page
+holds the messages before the cursor of the previous page, so a page
+costs the same for the newest and the oldest messages. The lists only
+fetch and decrypt the subjects, the message body is decrypted on the
+details page. Searches in the messages use the search index, see
+:func:`search_messages`.
+
 :subtitle:`Class and function definitions:`
 """
-from datetime import date
+from datetime import date, datetime
 from django.core.urlresolvers import reverse
 from apps.rcmessages.models import RCMessage
 from apps.rcmessages.forms import MessageAddForm, MessageSearchForm
 from apps.healthperson.healthprofessional.models import HealthProfessional
 from apps.healthperson.secretariat.models import Secretary
 from apps.utils.utils import send_notification_of_new_message
+from apps.utils.search import search_object_ids, text_matches
 from django.views.generic.base import TemplateView
 from django.utils.decorators import method_decorator
 from core.views import FormView
@@ -22,6 +30,9 @@ from django.contrib.auth.decorators import user_passes_test
 from django.db.models import Q
 from django.http import Http404
 
+# The number of messages per page of a message list
+MESSAGES_PER_PAGE = 25
+
 
 def remove_not_handled_messages(rc_messages):
     """
@@ -57,6 +68,45 @@ def remove_not_handled_messages(rc_messages):
     # return new_rc_messages
 
 
+def get_message_page(rc_messages, cursor=None, page_size=MESSAGES_PER_PAGE):
+    """
+    Get a page of a message list, newest first, with only the subjects
+    (see :meth:`apps.rcmessages.models.RCMessageQuerySet.list_fields`)
+
+    Args:
+        - rc_messages: the queryset with the messages
+        - cursor: the cursor of the page (added_on and id of the last\
+          message of the previous page as 'YYYY-MM-DD_id'), the first\
+          page if None or invalid
+        - page_size: the number of messages per page
+
+    Returns:
+        A list with the messages of the page and the cursor of the next\
+        page or None if this is the last page
+    """
+    rc_messages = rc_messages.list_fields().order_by('-added_on', '-id')
+    if cursor:
+        try:
+            added_on, message_id = cursor.split('_')
+            added_on = datetime.strptime(added_on, '%Y-%m-%d').date()
+            message_id = int(message_id)
+        except ValueError:
+            pass
+        else:
+            rc_messages = rc_messages.filter(
+                Q(added_on__lt=added_on) |
+                Q(added_on=added_on, id__lt=message_id))
+
+    # get one more to check if there is a next page
+    page = list(rc_messages[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = '{0}_{1}'.format(
+            page[-1].added_on.isoformat(), page[-1].id)
+    return page, next_cursor
+
+
 def get_all_messages_for_secretary(secretary):
     """
     Args:
@@ -109,6 +159,32 @@ def get_all_messages_for_patient(patient):
     return rc_messages
 
 
+def search_messages(rc_messages, patient_id, searchterm, field_names=None):
+    """
+    Search the messages of a patient with the search index (see
+    :mod:`apps.utils.search`), only the messages which contain all
+    words of the search term are retrieved and decrypted.
+
+    Args:
+        - rc_messages: queryset with messages of the patient
+        - patient_id: the primary key of the patient
+        - searchterm: the search term
+        - field_names: the fields to search in, all indexed fields\
+          (RCMessage.SEARCH_FIELDS) if None
+
+    Returns:
+        list of RCMessage instances of which one of the fields contains\
+        the words of the search term as a phrase
+    """
+    message_ids = search_object_ids('RCMessage', patient_id, searchterm)
+    if not message_ids:
+        return []
+    return [rc_message for rc_message in rc_messages.filter(
+            pk__in=message_ids)
+            if any([text_matches(getattr(rc_message, name), searchterm)
+                    for name in field_names or RCMessage.SEARCH_FIELDS])]
+
+
 class MessageAdd(PatientBaseView, FormView):
     '''
     Class based view for adding a new message by a
@@ -174,9 +250,13 @@ class SentMessageSearch(FormView):
     def get_context_data(self, **kwargs):
         """Return the found patients in a context"""
         context = super(SentMessageSearch, self).get_context_data(**kwargs)
+        cursor = self.request.GET.get('before')
+        rc_messages, next_cursor = get_message_page(
+            self.messages.with_senders(), cursor)
         context.update({'healthperson': self.healthperson,
                         'search_results': self.search_results,
-                        'rc_messages': self.messages, 'search': True,
+                        'rc_messages': rc_messages, 'search': True,
+                        'cursor': cursor, 'next_cursor': next_cursor,
                         'searched': self.searched,
                         'sent_view': True})
         return context
@@ -186,14 +266,17 @@ class SentMessageSearch(FormView):
         self.searched = True
         self.search_results = []
 
-        # TODO:Move to DB query, to speed up
-        for message in self.messages:
-            if ((form.cleaned_data['last_name'].lower() ==
-                 message.patient.user.last_name.lower())):
-                self.search_results.append(message)
-            elif ((form.cleaned_data['BSN'].lower() ==
-                   message.patient.user.BSN.lower())):
-                self.search_results.append(message)
+        # HMAC lookups, the messages aren't decrypted for the search
+        patient_filter = Q()
+        if form.cleaned_data['last_name'] not in ('', None):
+            patient_filter |= Q(
+                patient__user__hmac_last_name=form.cleaned_data['last_name'])
+        if form.cleaned_data['BSN'] not in ('', None):
+            patient_filter |= Q(
+                patient__user__hmac_BSN=form.cleaned_data['BSN'])
+        if patient_filter:
+            self.search_results = list(self.messages.filter(
+                patient_filter).with_senders().list_fields())
 
         return super(SentMessageSearch, self).get(
             self.request, *self.args, **self.kwargs)
@@ -250,17 +333,17 @@ class SentMessageDetails(TemplateView):
     def get_context_data(self, **kwargs):
         context = super(SentMessageDetails, self).get_context_data(**kwargs)
 
-        self.messages = self.messages.select_related(
-            'secretary__user',
-            'healthprofessional__user',
-            'patient__user')
+        self.messages = self.messages.with_senders()
 
         try:
             message = self.messages.get(pk=self.kwargs.get('message_id'))
         except:
             raise Http404
 
-        context.update({'message': message, 'rc_messages': self.messages,
+        cursor = self.request.GET.get('before')
+        rc_messages, next_cursor = get_message_page(self.messages, cursor)
+        context.update({'message': message, 'rc_messages': rc_messages,
+                        'cursor': cursor, 'next_cursor': next_cursor,
                         'healthperson': self.healthperson, 'sent_view': True})
         return context
 
@@ -280,11 +363,11 @@ class MessageOverview(PatientBaseView, TemplateView):
         context = super(MessageOverview, self).get_context_data(**kwargs)
         messages = get_all_messages_for_patient(self.patient)
 
-        messages = messages.select_related(
-            'secretary__user',
-            'healthprofessional__user',
-            'patient__user')
-        context.update({'rc_messages': messages, 'overview': True})
+        messages = messages.with_senders()
+        cursor = self.request.GET.get('before')
+        rc_messages, next_cursor = get_message_page(messages, cursor)
+        context.update({'rc_messages': rc_messages, 'cursor': cursor,
+                        'next_cursor': next_cursor, 'overview': True})
         return context
 
 
@@ -311,12 +394,12 @@ class MessageDetails(PatientBaseView, TemplateView):
         if not message.read_on:
             message.read_on = date.today()
             message.changed_by_user = self.request.user
-            message.save()
+            message.save(update_fields=['read_on'])
 
-        messages = messages.select_related(
-            'secretary__user',
-            'healthprofessional__user',
-            'patient__user')
+        messages = messages.with_senders()
 
-        context.update({'rc_messages': messages, 'message': message})
+        cursor = self.request.GET.get('before')
+        rc_messages, next_cursor = get_message_page(messages, cursor)
+        context.update({'rc_messages': rc_messages, 'cursor': cursor,
+                        'next_cursor': next_cursor, 'message': message})
         return context
@@ -8,11 +8,12 @@ views for adding/editing and exporting reports.
 from datetime import date
 from django.contrib.auth.decorators import login_required
 from django.template import loader
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, Http404
 from django.core.urlresolvers import reverse
 from django.shortcuts import get_object_or_404
 from apps.utils.utils import send_notification_of_new_report
-from apps.questionnaire.models import QuestionnaireRequest
+from apps.questionnaire.models import QuestionnaireRequest,\
+    prefetch_questionnaires
 from apps.questionnaire.qohc.models import QOHCQuestionnaire
 from apps.report.models import Report
 from apps.report.forms import ReportAddEditForm,\
@@ -61,15 +62,13 @@ class ReportTemplateGenerator:
         Returns:
             A list of questionnaires for the given questionnaire_request
         """
-        questionnaire_all_steps =\
-            questionnaire_request.requeststep_set.all().order_by('step_nr')
+        prefetch_questionnaires([questionnaire_request])
 
         questionnaires = []
-        for questionnaire_step in questionnaire_all_steps:
-            questionnaire_model_class = questionnaire_step.model_class
-            questionnaire = get_object_or_404(
-                questionnaire_model_class, request_step=questionnaire_step)
-            questionnaires.append(questionnaire)
+        for questionnaire_step in questionnaire_request.request_steps:
+            if questionnaire_step.questionnaire is None:
+                raise Http404
+            questionnaires.append(questionnaire_step.questionnaire)
 
         return questionnaires
 
@@ -181,17 +180,13 @@ class QuestionnaireView(ReportBaseView, TemplateView):
     def get_context_data(self, **kwargs):
         context = super(QuestionnaireView, self).get_context_data(**kwargs)
 
-        questionnaire_all_steps =\
-            self.questionnaire_request.requeststep_set.all().order_by(
-                'step_nr')
+        prefetch_questionnaires([self.questionnaire_request])
 
         questionnaires = []
 
-        for questionnaire_step in questionnaire_all_steps:
+        for questionnaire_step in self.questionnaire_request.request_steps:
 
-            questionnaire_model_class = questionnaire_step.model_class
-            questionnaire = questionnaire_model_class.objects.get(
-                request_step=questionnaire_step)
+            questionnaire = questionnaire_step.questionnaire
 
             # Don't add the quality of health
             # care questionnaire: QOHCQuestionnaire
@@ -394,16 +389,13 @@ class MessageEdit(ReportBaseView, FormView):
         return super(MessageEdit, self).dispatch(*args, **kwargs)
 
     def get_questionnaires(self):
-        questionnaire_all_steps =\
-            self.questionnaire_request.requeststep_set.all().order_by(
-                'step_nr')
+        prefetch_questionnaires([self.questionnaire_request])
 
         questionnaires = []
-        for questionnaire_step in questionnaire_all_steps:
-            questionnaire_model_class = questionnaire_step.model_class
-            questionnaire = get_object_or_404(
-                questionnaire_model_class, request_step=questionnaire_step)
-            questionnaires.append(questionnaire)
+        for questionnaire_step in self.questionnaire_request.request_steps:
+            if questionnaire_step.questionnaire is None:
+                raise Http404
+            questionnaires.append(questionnaire_step.questionnaire)
 
         return questionnaires
 
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Management command for running the daily service stages
+(see :data:`apps.service.utils.DAILY_STAGES`) with
+:mod:`apps.service.runner`. Should be run daily around 09:00.
+
+:subtitle:`Class definitions:`
+"""
+from django.core.management.base import BaseCommand, CommandError
+from apps.service.utils import DAILY_STAGES, main_run_daily
+
+
+class Command(BaseCommand):
+    """
+    Run (a selection of) the daily stages and report the results
+    """
+    help = 'Run the daily checks, reminders and new controls'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stage',
+            action='append',
+            dest='stages',
+            choices=[stage.name for stage in DAILY_STAGES],
+            help='Only run this stage, can be given multiple times')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Roll back all changes and do not send messages')
+        parser.add_argument(
+            '--full-scan',
+            action='store_true',
+            help='Check all objects instead of only the due objects and '
+                 'rebuild the due dates (reconciliation)')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of objects to process per transaction')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of threads for sending messages')
+
+    def handle(self, *args, **options):
+        results = main_run_daily(
+            names=options['stages'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+            full_scan=options['full_scan'])
+
+        failed = []
+        for result in results:
+            self.stdout.write(str(result))
+            for failure in result.failures:
+                self.stderr.write('  {0}'.format(failure))
+            if result.failures:
+                failed.append(result.name)
+
+        if failed:
+            raise CommandError(
+                'Failures in stages: {0}'.format(', '.join(failed)))
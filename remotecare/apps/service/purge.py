@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing the purge of deleted patients.
+
+Deleting a patient with ``delete()`` lets the Django collector load
+every related object (questionnaires, request steps, messages,
+reports, appointments and so on) as model instance, including the
+decryption of their fields, and deletes per instance. The purge only
+collects the primary keys of the whole dependency graph of a batch
+of users and deletes the rows level by level (the dependent rows
+first) with ``DELETE ... WHERE id IN (...)`` per chunk.
+
+.. note:: The delete() methods and delete signals of the models are
+          not called. RCMessage.delete and QuestionnaireRequest.delete
+          maintain the unread counters and the search tokens, these
+          are still purged because :class:`apps.utils.models.Counters`
+          and :class:`apps.utils.models.SearchToken` have a foreign key
+          (cascade) to the healthperson. A side table which is
+          maintained in a delete() method should also have such a
+          foreign key, otherwise its rows are left behind.
+
+Usage:
+
+.. code-block:: python
+
+    with transaction.atomic():
+        rows = purge_users(users)
+    # e.g. {'account_user': 2, 'healthperson_healthperson': 2, ...}
+
+:subtitle:`Function definitions:`
+"""
+from collections import OrderedDict
+from django.db import router
+from django.db.models import CASCADE, SET_NULL, DO_NOTHING, sql
+from django.db.models.deletion import ProtectedError,\
+    get_candidate_relations_to_delete
+from apps.account.models import User
+from apps.healthperson.models import HealthPerson
+
+# The number of primary keys per query
+PURGE_CHUNK_SIZE = 500
+
+
+def get_chunks(pks, chunk_size=PURGE_CHUNK_SIZE):
+    """
+    Args:
+        - pks: list of primary keys
+        - chunk_size: the number of primary keys per chunk
+
+    Returns:
+        A generator with lists of at most chunk_size primary keys
+    """
+    for start in range(0, len(pks), chunk_size):
+        yield pks[start:start + chunk_size]
+
+
+def collect(model, pks, data, dependencies, updates):
+    """
+    Collect the primary keys of the rows to delete and of the rows
+    which depend on them, recursively.
+
+    Args:
+        - model: the model of the rows
+        - pks: the primary keys of the rows
+        - data: OrderedDict with the set of collected primary keys\
+          per (concrete) model
+        - dependencies: dict with per model the models of which the\
+          rows should be deleted first
+        - updates: list of (model, field name, primary keys) of the rows\
+          of which the foreign key should be set to NULL
+    """
+    model = model._meta.concrete_model
+    collected = data.setdefault(model, set())
+    pks = [pk for pk in pks if pk not in collected]
+    if not pks:
+        return
+    collected.update(pks)
+
+    # Collect the parent rows of multi table inheritance, these are
+    # deleted after the child rows
+    for (parent, ptr) in model._meta.parents.items():
+        if ptr:
+            parent_pks = []
+            for chunk in get_chunks(pks):
+                parent_pks += model._base_manager.filter(
+                    pk__in=chunk).values_list(ptr.attname, flat=True)
+            dependencies.setdefault(
+                parent._meta.concrete_model, set()).add(model)
+            collect(parent, parent_pks, data, dependencies, updates)
+
+    for related in get_candidate_relations_to_delete(model._meta):
+        field = related.field
+        on_delete = field.remote_field.on_delete
+        if on_delete == DO_NOTHING:
+            continue
+        related_model = related.related_model
+        related_pks = []
+        for chunk in get_chunks(pks):
+            related_pks += related_model._base_manager.filter(**{
+                field.name + '__in': chunk}).values_list('pk', flat=True)
+        if not related_pks:
+            continue
+
+        if on_delete == CASCADE:
+            related_model = related_model._meta.concrete_model
+            if related_model is not model:
+                dependencies.setdefault(model, set()).add(related_model)
+            collect(related_model, related_pks, data, dependencies, updates)
+        elif on_delete == SET_NULL:
+            updates.append((related_model, field.name, related_pks))
+        else:
+            raise ProtectedError(
+                'Cannot purge {0} because of {1}.{2}'.format(
+                    model.__name__, related_model.__name__, field.name),
+                related_pks)
+
+
+def sort_models(data, dependencies):
+    """
+    Returns:
+        The models of data, every model after the models of which
+        the rows should be deleted first
+    """
+    models = []
+    remaining = list(data.keys())
+    while remaining:
+        ready = [model for model in remaining
+                 if not dependencies.get(model, set()) - set(models)]
+        if not ready:
+            # a cycle, delete the remaining models in collected order
+            ready = remaining
+        models += ready
+        remaining = [model for model in remaining if model not in ready]
+    return models
+
+
+def purge(roots):
+    """
+    Delete the rows and all rows that depend on them.
+
+    Args:
+        - roots: list of (model, primary keys) of the rows to delete
+
+    Returns:
+        OrderedDict with the number of deleted rows per table, in the\
+        order of deletion
+    """
+    data = OrderedDict()
+    dependencies = {}
+    updates = []
+    for (model, pks) in roots:
+        collect(model, list(pks), data, dependencies, updates)
+
+    for (related_model, field_name, related_pks) in updates:
+        for chunk in get_chunks(related_pks):
+            related_model._base_manager.filter(pk__in=chunk).update(**{
+                field_name: None})
+
+    rows = OrderedDict()
+    for model in sort_models(data, dependencies):
+        using = router.db_for_write(model)
+        count = 0
+        for chunk in get_chunks(sorted(data[model])):
+            count += sql.DeleteQuery(model).delete_batch(chunk, using)
+        if count:
+            rows[model._meta.db_table] = count
+    return rows
+
+
+def purge_users(users):
+    """
+    Delete the users, their healthpersons (for example patients) and
+    all rows that depend on them. Should be called in a transaction.
+
+    Args:
+        - users: list or queryset of users
+
+    Returns:
+        OrderedDict with the number of deleted rows per table
+    """
+    user_pks = [user.pk for user in users]
+    healthperson_pks = [user.healthperson_id for user in users
+                        if user.healthperson_id]
+
+    return purge([(HealthPerson, healthperson_pks), (User, user_pks)])
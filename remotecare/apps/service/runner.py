@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing the job runner for the daily service stages
+(see :data:`apps.service.utils.DAILY_STAGES`).
+
+Every stage processes its queryset in primary key chunks. Each chunk
+is processed in its own transaction and returns a :class:`StageOutput`
+with the messages (SMS and e-mail) to send, which are sent afterwards
+in bulk by a bounded pool of threads, so a slow SMS gateway doesn't
+stall the database work.
+The runner records the duration, the number of processed objects and
+messages and the failures per stage, the results of every run are
+stored as :class:`apps.utils.models.JobRun` with a
+:class:`apps.utils.models.StageRun` per stage. Stages with due dates only
+process the objects which are due (see :mod:`apps.service.schedule`),
+unless a full scan is requested.
+
+Usage:
+
+.. code-block:: python
+
+    results = run_stages(DAILY_STAGES, names=['check_unhandled'])
+    for result in results:
+        print(result)
+
+:subtitle:`Class and function definitions:`
+"""
+import logging
+import time
+import traceback
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+from django.db import transaction
+from django.utils import timezone
+from apps.service.schedule import calculate_due_ids, get_due_ids,\
+    update_due_dates, update_due_index, rebuild_due_dates
+from apps.utils.models import JobRun, StageRun
+from apps.utils.utils import send_email_to, send_emails_to,\
+    send_sms_to, send_sms_messages
+
+logger = logging.getLogger(__name__)
+
+# The functions sending many messages at once per send function
+BULK_SEND_FUNCTIONS = {
+    send_email_to: send_emails_to,
+    send_sms_to: send_sms_messages,
+}
+
+
+class Stage(object):
+    """
+    A stage of the daily run
+
+    Args:
+        - name: the name of the stage, used for selecting stages
+        - get_queryset: function returning the queryset of objects\
+          to process
+        - process: function which processes a list of objects and\
+          returns a :class:`StageOutput`
+        - get_due_dates: optional function which returns the\
+          (primary key, due date) tuples of the objects with the given\
+          primary keys (all objects if None), the stage then only\
+          processes the objects which are due, see\
+          :mod:`apps.service.schedule`
+        - get_changed_ids: function which returns the primary keys of\
+          the objects of which the due date could be changed by the\
+          changes in the audit log, a dict with the set of changed\
+          primary keys per model name
+    """
+    def __init__(self, name, get_queryset, process, get_due_dates=None,
+                 get_changed_ids=None):
+        self.name = name
+        self.get_queryset = get_queryset
+        self.process = process
+        self.get_due_dates = get_due_dates
+        self.get_changed_ids = get_changed_ids
+
+
+class StageOutput(object):
+    """
+    The output of processing a chunk of a stage
+
+    Args:
+        - messages: the messages to send, see :func:`send_message`
+        - rows: dict with the number of deleted rows per table
+        - acted: the number of objects acted on, all processed objects\
+          if None
+    """
+    def __init__(self, messages=None, rows=None, acted=None):
+        self.messages = messages or []
+        self.rows = rows or {}
+        self.acted = acted
+
+
+class StageResult(object):
+    """
+    The timing, counts and failures of a stage run
+    """
+    def __init__(self, name, dry_run=False):
+        self.name = name
+        self.dry_run = dry_run
+        self.count = 0
+        self.acted = 0
+        self.messages = 0
+        self.failures = []
+        self.rows = {}
+        self.seconds = 0.0
+
+    def __str__(self):
+        result = ('{0}: {1} objects, {2} messages{3}, {4} failures'
+                  ' in {5:.2f}s').format(
+            self.name, self.count, self.messages,
+            ' (dry run, not sent)' if self.dry_run else '',
+            len(self.failures), self.seconds)
+        if self.rows:
+            result += ', deleted rows: ' + ', '.join([
+                '{0}: {1}'.format(table, count)
+                for (table, count) in sorted(self.rows.items())])
+        return result
+
+
+def send_message(message):
+    """
+    Send a message
+
+    Args:
+        - message: tuple of (send function, recipient, content),\
+          for example (send_sms_to, mobile_number, content)
+
+    Returns:
+        None if sent, the error description otherwise
+    """
+    send_function, recipient, content = message
+    try:
+        send_function(recipient, content)
+    except Exception as e:
+        logger.exception('Sending a message failed')
+        return '{0}: {1}'.format(send_function.__name__, e)
+    return None
+
+
+def send_bulk(task):
+    """
+    Send a list of messages of one send function with its bulk function
+    (see :data:`BULK_SEND_FUNCTIONS`)
+
+    Args:
+        - task: tuple of (send function, list of (recipient, content))
+
+    Returns:
+        A list with the errors of the failed messages
+    """
+    send_function, messages = task
+    errors = BULK_SEND_FUNCTIONS[send_function](messages)
+    return ['{0}: {1}'.format(send_function.__name__, error)
+            for error in errors if error is not None]
+
+
+def send_messages(messages, pool=None, bulk_size=100):
+    """
+    Send the messages, in parallel if a thread pool is given. The
+    messages of the send functions in :data:`BULK_SEND_FUNCTIONS`
+    are sent per bulk_size messages with their bulk function, so
+    e-mails are sent over one connection and SMS messages with the
+    same content are sent with one request.
+
+    Args:
+        - messages: list of messages, see :func:`send_message`
+        - pool: an optional (multiprocessing.pool) ThreadPool
+        - bulk_size: the number of messages per bulk function call
+
+    Returns:
+        A list with the errors of the failed messages
+    """
+    tasks = []
+    for send_function in BULK_SEND_FUNCTIONS:
+        # sort on content so equal messages are in the same task
+        bulk = sorted([(recipient, content)
+                       for (function, recipient, content) in messages
+                       if function is send_function],
+                      key=lambda message: message[1])
+        tasks += [(send_function, bulk[start:start + bulk_size])
+                  for start in range(0, len(bulk), bulk_size)]
+    messages = [message for message in messages
+                if message[0] not in BULK_SEND_FUNCTIONS]
+
+    if pool is not None:
+        results = [pool.apply_async(send_bulk, (task,)) for task in tasks]
+    else:
+        results = []
+    if pool is not None and len(messages) > 1:
+        errors = pool.map(send_message, messages)
+    else:
+        errors = [send_message(message) for message in messages]
+
+    if pool is not None:
+        for result in results:
+            errors += result.get()
+    else:
+        for task in tasks:
+            errors += send_bulk(task)
+    return [error for error in errors if error is not None]
+
+
+def get_chunks(queryset, chunk_size):
+    """
+    Generator which retrieves the objects of the queryset in primary
+    key order with one query per chunk. Objects which are changed by
+    processing a chunk are not retrieved twice.
+
+    Args:
+        - queryset: the queryset to retrieve
+        - chunk_size: the number of objects per chunk
+
+    Returns:
+        A generator with lists of objects
+    """
+    queryset = queryset.order_by('pk')
+    last_pk = 0
+    while True:
+        objects = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not objects:
+            break
+        last_pk = objects[-1].pk
+        yield objects
+
+
+def run_stage(stage, chunk_size=500, workers=4, dry_run=False,
+              full_scan=False):
+    """
+    Run a stage over primary key chunks of its queryset. A failing chunk
+    is rolled back and recorded, the other chunks are still processed.
+
+    Args:
+        - stage: the :class:`Stage` to run
+        - chunk_size: the number of objects to process per transaction
+        - workers: the number of threads for sending messages
+        - dry_run: process the chunks but roll back all changes\
+          and don't send the messages, the due objects are calculated\
+          without changing the due date index
+        - full_scan: process the whole queryset instead of only the\
+          due objects and rebuild the due dates afterwards
+
+    Returns:
+        The :class:`StageResult`
+    """
+    result = StageResult(stage.name, dry_run=dry_run)
+    start = time.time()
+    queryset = stage.get_queryset()
+    use_due_dates = stage.get_due_dates is not None
+    if use_due_dates and not full_scan and dry_run:
+        # the index and the watermark are not changed by a dry run, the
+        # due objects are selected per chunk of calculated primary keys
+        chunks = chain.from_iterable(
+            get_chunks(queryset.filter(pk__in=due_ids), chunk_size)
+            for due_ids in calculate_due_ids(stage))
+    else:
+        if use_due_dates and not full_scan:
+            update_due_index(stage)
+            queryset = queryset.filter(pk__in=get_due_ids(stage))
+        chunks = get_chunks(queryset, chunk_size)
+
+    pool = ThreadPool(workers) if workers > 1 and not dry_run else None
+    try:
+        for objects in chunks:
+            try:
+                with transaction.atomic():
+                    output = stage.process(objects)
+                    if use_due_dates:
+                        update_due_dates(
+                            stage, [obj.pk for obj in objects])
+                    if dry_run:
+                        transaction.set_rollback(True)
+            except Exception as e:
+                logger.exception('Daily stage %s failed', stage.name)
+                result.failures.append('chunk starting at pk {0}: {1}'.format(
+                    objects[0].pk, e))
+                continue
+
+            result.count += len(objects)
+            result.acted += len(objects) if output.acted is None\
+                else output.acted
+            result.messages += len(output.messages)
+            for (table, count) in output.rows.items():
+                result.rows[table] = result.rows.get(table, 0) + count
+            if not dry_run:
+                result.failures += send_messages(output.messages, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if use_due_dates and full_scan and not dry_run:
+        rebuild_due_dates(stage)
+    result.seconds = time.time() - start
+    return result
+
+
+def save_stage_run(job_run, result, started_on, error=None):
+    """
+    Store the result of a stage in the run history
+
+    Args:
+        - job_run: the :class:`apps.utils.models.JobRun`
+        - result: the :class:`StageResult`
+        - started_on: the start time of the stage
+        - error: the description of the exception which stopped\
+          the stage
+    """
+    errors = list(result.failures)
+    if error is not None:
+        errors.append(error)
+    StageRun.objects.create(
+        job_run=job_run, name=result.name, started_on=started_on,
+        seconds=result.seconds, scanned=result.count, acted=result.acted,
+        messages=result.messages, failures=len(errors),
+        errors='\n'.join(errors))
+    if errors:
+        job_run.failed = True
+
+
+def run_stages(stages, names=None, **kwargs):
+    """
+    Run the stages in order and store the results in the run history
+    (see :class:`apps.utils.models.JobRun`). An exception stops the run,
+    it is stored for the stage and raised again.
+
+    Args:
+        - stages: list of :class:`Stage` instances
+        - names: optional list of stage names to run, all stages\
+          if not given
+        - kwargs: the options for :func:`run_stage`
+
+    Returns:
+        A list with the :class:`StageResult` per stage
+    """
+    job_run = JobRun.objects.create(
+        dry_run=kwargs.get('dry_run', False),
+        full_scan=kwargs.get('full_scan', False))
+    results = []
+    try:
+        for stage in stages:
+            if names and stage.name not in names:
+                continue
+            started_on = timezone.now()
+            start = time.time()
+            try:
+                result = run_stage(stage, **kwargs)
+            except Exception:
+                result = StageResult(
+                    stage.name, dry_run=kwargs.get('dry_run', False))
+                result.seconds = time.time() - start
+                save_stage_run(
+                    job_run, result, started_on, traceback.format_exc())
+                raise
+            save_stage_run(job_run, result, started_on)
+            results.append(result)
+    finally:
+        job_run.finished_on = timezone.now()
+        job_run.save()
+    return results
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Module providing the due date index of the daily stages.
+
+Instead of rescanning all patients and controls every day, a stage
+with due dates (see :class:`apps.service.runner.Stage`) only selects the
+objects of which the due date (:class:`apps.utils.models.DueDate`)
+has passed.
+
+The due dates are maintained without extra queries in the requests:
+
+- every stage keeps a watermark, the last audit log entry of which the\
+  changes are processed. Before a run the models changed since the\
+  watermark are read from the audit log and the due dates of the\
+  affected objects are calculated again
+- the due dates of the processed objects are calculated again after\
+  processing them
+- a full scan (reconciliation) rebuilds the due dates of a stage, this\
+  is also done on the first run. Changes which are not in the audit log\
+  (for example saves without changed_by_user) are only picked up by a\
+  full scan, so it should be run regularly (for example weekly).
+
+A dry run does not change the index or the watermark, the due objects
+are calculated in memory instead (:func:`calculate_due_ids`).
+
+Usage:
+
+.. code-block:: python
+
+    update_due_index(stage)
+    queryset = stage.get_queryset().filter(
+        pk__in=get_due_ids(stage))
+
+:subtitle:`Function definitions:`
+"""
+import json
+from datetime import date
+from django.db.models import Max
+from apps.audit.models import LogEntry
+from apps.utils.models import DueDate, Watermark
+
+# The number of objects per query
+SCHEDULE_CHUNK_SIZE = 500
+
+
+def get_due_ids(stage):
+    """
+    Args:
+        - stage: the stage with due dates
+
+    Returns:
+        A queryset with the primary keys of the objects of which the\
+        due date has passed
+    """
+    return DueDate.objects.filter(
+        stage=stage.name, due_on__lte=date.today()).values('object_id')
+
+
+def update_due_dates(stage, object_ids):
+    """
+    Calculate the due dates of objects again, objects without due
+    date (for example removed objects) are removed from the index.
+
+    Args:
+        - stage: the stage with due dates
+        - object_ids: the primary keys of the objects
+    """
+    object_ids = list(object_ids)
+    for start in range(0, len(object_ids), SCHEDULE_CHUNK_SIZE):
+        chunk = object_ids[start:start + SCHEDULE_CHUNK_SIZE]
+        DueDate.objects.filter(
+            stage=stage.name, object_id__in=chunk).delete()
+        DueDate.objects.bulk_create([
+            DueDate(stage=stage.name, object_id=object_id, due_on=due_on)
+            for (object_id, due_on) in stage.get_due_dates(chunk)])
+
+
+def rebuild_due_dates(stage):
+    """
+    Rebuild the due dates of a stage from scratch and move the watermark
+    to the last audit log entry.
+
+    Args:
+        - stage: the stage with due dates
+    """
+    # the changes during the rebuild are processed by the next update
+    log_entry_id = LogEntry.objects.aggregate(
+        Max('id'))['id__max'] or 0
+
+    DueDate.objects.filter(stage=stage.name).delete()
+    DueDate.objects.bulk_create([
+        DueDate(stage=stage.name, object_id=object_id, due_on=due_on)
+        for (object_id, due_on) in stage.get_due_dates(None)],
+        batch_size=SCHEDULE_CHUNK_SIZE)
+    Watermark.objects.update_or_create(
+        stage=stage.name, defaults={'log_entry_id': log_entry_id})
+
+
+def get_changes(log_entry_id):
+    """
+    Args:
+        - log_entry_id: the watermark
+
+    Returns:
+        The last audit log entry id and a dict with the set of changed
+        primary keys per model name (for example 'Patient') in the
+        audit log entries after the watermark
+    """
+    changes = {}
+    for (entry_id, log_json) in LogEntry.objects.filter(
+            id__gt=log_entry_id).order_by('id').values_list(
+            'id', 'json').iterator():
+        log_entry_id = entry_id
+        # only the changes of the audit entry are encrypted
+        audit_values = json.loads(log_json)
+        if audit_values.get('id') is not None:
+            changes.setdefault(audit_values['name'], set()).add(
+                audit_values['id'])
+    return log_entry_id, changes
+
+
+def update_due_index(stage):
+    """
+    Update the due dates of the objects changed since the watermark of
+    the stage and move the watermark, the due dates are rebuilt if
+    the stage has no watermark yet.
+
+    Args:
+        - stage: the stage with due dates
+    """
+    try:
+        watermark = Watermark.objects.get(stage=stage.name)
+    except Watermark.DoesNotExist:
+        rebuild_due_dates(stage)
+        return
+
+    log_entry_id, changes = get_changes(watermark.log_entry_id)
+    if changes:
+        update_due_dates(stage, stage.get_changed_ids(changes))
+    if log_entry_id != watermark.log_entry_id:
+        watermark.log_entry_id = log_entry_id
+        watermark.save(update_fields=['log_entry_id'])
+
+
+def calculate_due_ids(stage, chunk_size=SCHEDULE_CHUNK_SIZE):
+    """
+    Calculate the objects of which the due date has passed like
+    :func:`update_due_index` followed by :func:`get_due_ids`, but
+    without changing the due dates or the watermark (for dry runs).
+
+    Args:
+        - stage: the stage with due dates
+        - chunk_size: the number of primary keys per chunk
+
+    Returns:
+        A generator with sorted lists of at most chunk_size primary\
+        keys of the objects of which the due date has passed
+    """
+    today = date.today()
+    try:
+        watermark = Watermark.objects.get(stage=stage.name)
+    except Watermark.DoesNotExist:
+        due_ids = set([object_id for (object_id, due_on)
+                       in stage.get_due_dates(None) if due_on <= today])
+    else:
+        due_ids = set([values['object_id']
+                       for values in get_due_ids(stage)])
+        changes = get_changes(watermark.log_entry_id)[1]
+        if changes:
+            changed_ids = list(stage.get_changed_ids(changes))
+            due_ids.difference_update(changed_ids)
+            for start in range(0, len(changed_ids), SCHEDULE_CHUNK_SIZE):
+                due_ids.update([
+                    object_id for (object_id, due_on)
+                    in stage.get_due_dates(
+                        changed_ids[start:start + SCHEDULE_CHUNK_SIZE])
+                    if due_on <= today])
+
+    due_ids = sorted(due_ids)
+    for start in range(0, len(due_ids), chunk_size):
+        yield due_ids[start:start + chunk_size]
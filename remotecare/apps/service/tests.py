@@ -7,17 +7,31 @@ Unittests for the service functions
 from datetime import datetime, date
 from dateutil.relativedelta import relativedelta
 from django.core import mail
-from django.conf import settings
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models.deletion import Collector
 from core.unittest.baseunittest import BaseUnitTest
 from apps.service.utils import send_questionnaire_reminder_sms,\
     send_questionnaire_fillin_sms, send_urgent_report_reminder,\
     send_report_reminder, remove_deleted_patients,\
     check_questionnaire_fillin_deadlines, insert_new_questionnaire_requests,\
-    check_unhandled_questionnaires, check_unhandled_urgent_questionnaires
+    check_unhandled_questionnaires, check_unhandled_urgent_questionnaires,\
+    get_passed_fillin_deadlines, extend_fillin_deadlines,\
+    get_questionnaire_reminder_messages, get_fillin_deadline_due_dates,\
+    get_changed_questionnaire_requests
 from apps.account.models import User
+from apps.healthperson.models import HealthPerson
 from apps.healthperson.patient.models import Patient
 from apps.healthperson.secretariat.models import Secretary
 from apps.questionnaire.models import QuestionnaireRequest
+from apps.questionnaire.views import\
+    insert_new_questionnaire_requests_for_patients
+from apps.audit.models import LogEntry
+from apps.service.schedule import calculate_due_ids
+from apps.service.runner import Stage, StageOutput, run_stage,\
+    run_stages
+from apps.utils.models import DueDate, Watermark, JobRun
+from StringIO import StringIO
 
 
 class ServiceTest(BaseUnitTest):
@@ -49,13 +63,13 @@ class ServiceTest(BaseUnitTest):
             self.assertEqual(len(mail.outbox), 0)
 
         if check_sms:
-            self.assertEqual(len(settings.SMS_STORE), 1)
-            sms = settings.SMS_STORE[0]
+            self.assertEqual(len(self.SMS_STORE), 1)
+            sms = self.SMS_STORE[0]
             self.assertEqual(
                 healthperson.user.mobile_number, sms['recipients'])
             self.assertEqual(sms['message'], body_test)
         else:
-            self.assertEqual(len(settings.SMS_STORE), 0)
+            self.assertEqual(len(self.SMS_STORE), 0)
 
     def do_reminder_check(self, body_test, function, attr_name,
                           function_instance, attr_instance, check_instance):
@@ -209,8 +223,27 @@ class ServiceTest(BaseUnitTest):
 
         patient.user.deleted_on = date.today() - relativedelta(weeks=+2)
         patient.user.save()
-        remove_deleted_patients()
+
+        # The purge removes the same rows as the Django collector
+        collector = Collector(using='default')
+        collector.collect([HealthPerson.objects.get(id=patient.id)])
+        expected_rows = {}
+        for (model, instances) in collector.data.items():
+            expected_rows[model._meta.db_table] = len(instances)
+        for queryset in collector.fast_deletes:
+            table = queryset.model._meta.db_table
+            expected_rows[table] = expected_rows.get(table, 0) +\
+                queryset.count()
+        expected_rows = dict([(table, count) for (table, count)
+                              in expected_rows.items() if count])
+
+        result = remove_deleted_patients()
+        self.assertEqual(result.rows, expected_rows)
+        self.assertEqual(result.rows['account_user'], 1)
+        self.assertIn('deleted rows: ', str(result))
         self.assertEqual(Patient.objects.count(), patient_count - 1)
+        self.assertEqual(QuestionnaireRequest.objects.filter(
+            patient_id=patient.id).count(), 0)
 
         with self.assertRaises(Patient.DoesNotExist):
             Patient.objects.get(id=patient.id)
@@ -237,7 +270,7 @@ class ServiceTest(BaseUnitTest):
 
         check_questionnaire_fillin_deadlines()
 
-        self.assertEqual(len(settings.SMS_STORE), 1)
+        self.assertEqual(len(self.SMS_STORE), 1)
         self.assertEqual(len(mail.outbox), 1)
 
         new_questionnaire =\
@@ -248,6 +281,239 @@ class ServiceTest(BaseUnitTest):
         self.assertEqual(new_questionnaire.deadline_nr,
                          questionnaire.deadline_nr + 1)
 
+    def do_test_extend_fillin_deadlines_equivalence(self):
+        """
+        Check that extending the deadlines with one update query gives
+        the same questionnaire requests, audit entries and messages as
+        saving every questionnaire request
+        """
+        def extend_per_row(questionnaire_requests):
+            for questionnaire_request in questionnaire_requests:
+                questionnaire_request.deadline =\
+                    date.today() + relativedelta(weeks=+1)
+                questionnaire_request.deadline_nr =\
+                    questionnaire_request.deadline_nr + 1
+                questionnaire_request.changed_by_user =\
+                    questionnaire_request.patient.user
+                questionnaire_request.save()
+            return StageOutput(get_questionnaire_reminder_messages(
+                [questionnaire_request.patient
+                 for questionnaire_request in questionnaire_requests]))
+
+        def get_state(extend, num_queries):
+            last_log_entry_id = LogEntry.objects.latest('id').id
+            questionnaire_requests = list(get_passed_fillin_deadlines())
+            pks = [questionnaire_request.pk
+                   for questionnaire_request in questionnaire_requests]
+            self.assertEqual(len(pks), 3)
+
+            with self.assertNumQueries(num_queries):
+                messages = extend(questionnaire_requests).messages
+            messages = [(function.__name__, recipient, content)
+                        for (function, recipient, content) in messages]
+            values = list(QuestionnaireRequest.objects.filter(
+                pk__in=pks).order_by('pk').values())
+            log_entries = [
+                (log_entry.added_by_id, log_entry.get_changes())
+                for log_entry in LogEntry.objects.filter(
+                    id__gt=last_log_entry_id).order_by('id')]
+            return values, log_entries, messages
+
+        # The changes are rolled back for the other tests
+        with transaction.atomic():
+            insert_new_questionnaire_requests_for_patients(
+                list(Patient.objects.all()[:3]))
+            QuestionnaireRequest.objects.filter(
+                urgent=False, finished_on__isnull=True).update(
+                deadline=date.today() + relativedelta(days=+1))
+            for questionnaire in QuestionnaireRequest.objects.filter(
+                    urgent=False).order_by('-id')[:3]:
+                questionnaire.deadline = date.today() - relativedelta(days=+1)
+                questionnaire.finished_on = None
+                questionnaire.changed_by_user = questionnaire.patient.user
+                questionnaire.save()
+
+            with transaction.atomic():
+                # an update and an audit entry per questionnaire request
+                expected = get_state(extend_per_row, 6)
+                transaction.set_rollback(True)
+
+            # one update and one insert of the audit entries
+            state = get_state(extend_fillin_deadlines, 2)
+            self.assertEqual(state, expected)
+            self.assertEqual(len(state[1]), 3)
+            transaction.set_rollback(True)
+
+    def do_test_run_daily(self):
+        """
+        Check the dry run, stage selection and failure handling of the
+        daily job runner
+        """
+        self.reset_stores()
+        questionnaire = QuestionnaireRequest.objects.filter(urgent=False)[0]
+        patient = questionnaire.patient
+        questionnaire.deadline = date.today() - relativedelta(days=+1)
+        questionnaire.finished_on = None
+        questionnaire.changed_by_user = patient.user
+        questionnaire.save()
+
+        # A dry run processes the stage but changes and sends nothing
+        out = StringIO()
+        call_command('run_daily', '--stage',
+                     'check_questionnaire_fillin_deadlines',
+                     '--dry-run', stdout=out)
+        self.assertTrue(out.getvalue().startswith(
+            'check_questionnaire_fillin_deadlines: 1 objects, 2 messages'
+            ' (dry run, not sent), 0 failures in '))
+        self.assertEqual(len(self.SMS_STORE), 0)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(
+            QuestionnaireRequest.objects.get(id=questionnaire.id).deadline,
+            questionnaire.deadline)
+
+        # The run is stored in the run history
+        job_run = JobRun.objects.latest('id')
+        self.assertTrue(job_run.dry_run)
+        self.assertFalse(job_run.failed)
+        self.assertIsNotNone(job_run.finished_on)
+        stage_run = job_run.stages.get()
+        self.assertEqual(
+            (stage_run.name, stage_run.scanned, stage_run.acted,
+             stage_run.messages, stage_run.failures),
+            ('check_questionnaire_fillin_deadlines', 1, 1, 2, 0))
+
+        call_command('run_daily', '--stage',
+                     'check_questionnaire_fillin_deadlines',
+                     '--chunk-size', '1', '--workers', '2', stdout=StringIO())
+        self.assertEqual(len(self.SMS_STORE), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(
+            QuestionnaireRequest.objects.get(id=questionnaire.id).deadline,
+            date.today() + relativedelta(weeks=+1))
+
+        # A failing chunk is rolled back, the other chunks are processed
+        questionnaire_requests = QuestionnaireRequest.objects.all()
+        first_pk = questionnaire_requests.order_by('pk')[0].pk
+
+        def handle_questionnaires(questionnaire_requests):
+            questionnaire_requests[0].handled_on = date.today()
+            questionnaire_requests[0].changed_by_user = patient.user
+            questionnaire_requests[0].save()
+            if questionnaire_requests[0].pk == first_pk:
+                raise ValueError('failed')
+            return StageOutput()
+
+        result = run_stage(Stage(
+            'handle_questionnaires', lambda: questionnaire_requests,
+            handle_questionnaires), chunk_size=1)
+        self.assertEqual(result.count, questionnaire_requests.count() - 1)
+        self.assertEqual(
+            result.failures,
+            ['chunk starting at pk {0}: failed'.format(first_pk)])
+        self.assertEqual(
+            questionnaire_requests.filter(handled_on__isnull=True).count(), 1)
+
+        # An exception stops the run and is stored in the run history
+        def get_queryset():
+            raise ValueError('no queryset')
+
+        with self.assertRaises(ValueError):
+            run_stages([Stage('no_queryset', get_queryset, None)])
+        job_run = JobRun.objects.latest('id')
+        self.assertTrue(job_run.failed)
+        self.assertIsNotNone(job_run.finished_on)
+        self.assertIn('ValueError: no queryset', job_run.stages.get().errors)
+
+    def do_test_due_index(self):
+        """
+        Check that a stage with due dates only processes the due objects
+        and picks up the audited changes and the full scan
+        """
+        processed = []
+
+        def process(questionnaire_requests):
+            processed.extend([q.pk for q in questionnaire_requests])
+            return StageOutput()
+
+        stage = Stage(
+            'test_due_index', get_passed_fillin_deadlines, process,
+            get_fillin_deadline_due_dates,
+            get_changed_questionnaire_requests)
+        questionnaire_requests = QuestionnaireRequest.objects.filter(
+            urgent=False, finished_on__isnull=True)
+        with transaction.atomic():
+            insert_new_questionnaire_requests_for_patients(
+                list(Patient.objects.all()[:2]))
+            self.assertTrue(questionnaire_requests.count() >= 2)
+            questionnaire_requests.update(
+                deadline=date.today() + relativedelta(days=+1))
+
+            # A dry run neither builds the index nor stores the watermark
+            result = run_stage(stage, workers=1, dry_run=True)
+            self.assertEqual(result.count, 0)
+            self.assertFalse(
+                DueDate.objects.filter(stage=stage.name).exists())
+            self.assertFalse(
+                Watermark.objects.filter(stage=stage.name).exists())
+
+            # The first run builds the index, nothing is due yet
+            result = run_stage(stage, workers=1)
+            self.assertEqual(result.count, 0)
+            self.assertEqual(
+                DueDate.objects.filter(stage=stage.name).count(),
+                questionnaire_requests.count())
+            self.assertEqual(
+                Watermark.objects.get(stage=stage.name).log_entry_id,
+                LogEntry.objects.latest('id').id)
+
+            # An audited change is picked up from the audit log
+            questionnaire = questionnaire_requests.order_by('pk')[0]
+            questionnaire.deadline = date.today() - relativedelta(days=+1)
+            questionnaire.changed_by_user = questionnaire.patient.user
+            questionnaire.save()
+            watermark = Watermark.objects.get(stage=stage.name).log_entry_id
+            run_stage(stage, workers=1, dry_run=True)
+            self.assertEqual(processed, [questionnaire.pk])
+            self.assertEqual(
+                Watermark.objects.get(stage=stage.name).log_entry_id,
+                watermark)
+            self.assertEqual(DueDate.objects.get(
+                stage=stage.name, object_id=questionnaire.pk).due_on,
+                date.today() + relativedelta(days=+1))
+
+            del processed[:]
+            result = run_stage(stage, workers=1)
+            self.assertEqual(processed, [questionnaire.pk])
+            self.assertEqual(
+                Watermark.objects.get(stage=stage.name).log_entry_id,
+                LogEntry.objects.latest('id').id)
+
+            # A change without audit entry is only picked up by a full scan
+            other = questionnaire_requests.order_by('-pk')[0]
+            questionnaire_requests.filter(pk=other.pk).update(
+                deadline=date.today())
+            del processed[:]
+            run_stage(stage, workers=1)
+            self.assertEqual(processed, [questionnaire.pk])
+
+            del processed[:]
+            run_stage(stage, workers=1, full_scan=True)
+            self.assertEqual(processed, [questionnaire.pk, other.pk])
+            self.assertEqual(DueDate.objects.get(
+                stage=stage.name, object_id=other.pk).due_on, date.today())
+
+            del processed[:]
+            run_stage(stage, workers=1)
+            self.assertEqual(processed, [questionnaire.pk, other.pk])
+
+            # A dry run selects the due objects per chunk of primary keys
+            self.assertEqual(list(calculate_due_ids(stage, chunk_size=1)),
+                             [[questionnaire.pk], [other.pk]])
+            del processed[:]
+            run_stage(stage, workers=1, dry_run=True)
+            self.assertEqual(processed, [questionnaire.pk, other.pk])
+            transaction.set_rollback(True)
+
     def create_questionnaire_request(self, patient, date_time, is_handled):
         """
         Creates a questionnaire request
@@ -371,7 +637,7 @@ class ServiceTest(BaseUnitTest):
                 patient__id=13).count(),
             2)
 
-        self.assertEqual(len(settings.SMS_STORE), 3)
+        self.assertEqual(len(self.SMS_STORE), 3)
         self.assertEqual(len(mail.outbox), 3)
 
     def unhandeld_questionnaires_helper(self, urgent):
@@ -398,7 +664,7 @@ class ServiceTest(BaseUnitTest):
         else:
             check_unhandled_questionnaires()
 
-        self.assertEqual(len(settings.SMS_STORE), 0)
+        self.assertEqual(len(self.SMS_STORE), 0)
         self.assertEqual(len(mail.outbox), 0)
 
         questionnaire.finished_on = datetime.now() - relativedelta(weeks=+3)
@@ -410,7 +676,7 @@ class ServiceTest(BaseUnitTest):
         else:
             check_unhandled_questionnaires()
 
-        self.assertEqual(len(settings.SMS_STORE), 1)
+        self.assertEqual(len(self.SMS_STORE), 1)
         self.assertEqual(len(mail.outbox), 1)
 
     def do_test_unhandeld_questionnaires(self):
@@ -432,6 +698,9 @@ class ServiceTest(BaseUnitTest):
         self.do_test_urgent_report_reminder()
         self.do_test_report_reminder()
         self.do_test_check_questionnaire_fillin_deadlines()
+        self.do_test_extend_fillin_deadlines_equivalence()
+        self.do_test_run_daily()
+        self.do_test_due_index()
         self.do_test_insert_new_questionnaire_requests()
         self.do_test_unhandeld_questionnaires()
 
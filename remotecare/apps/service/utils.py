@@ -5,95 +5,141 @@ Module providing reminder functions.
 .. note:: The main function on the bottom should be run daily via a deamon
           or other solution around 9:00.
 
+The daily checks are defined as stages (see :data:`DAILY_STAGES`) which
+are run by :mod:`apps.service.runner`. The message functions return the
+messages to send as (send function, recipient, content) tuples, so the
+runner can send them with a pool of threads. The messages of a chunk are
+rendered at once with :mod:`apps.utils.notifications`.
+
 :subtitle:`Function definitions:`
 """
 import sys
 import os
 import django
-from django.db.models import Q
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
 from datetime import date
 from apps.questionnaire.models import QuestionnaireRequest
 from dateutil.relativedelta import relativedelta
-from django.template import loader
 from apps.healthperson.patient.models import Patient
 from apps.account.models import User
+from core.models import save_audit_entries
 from apps.utils.utils import send_sms_to, send_email_to
+from apps.utils.notifications import get_patient_context,\
+    render_notifications
 from apps.questionnaire.views import\
     insert_new_questionnaire_request_for_patient as\
-    insert_new_questionnaire_request_for_patient_func
+    insert_new_questionnaire_request_for_patient_func,\
+    insert_new_questionnaire_requests_for_patients
+from apps.service.runner import Stage, StageOutput, run_stages,\
+    send_messages
+from apps.service.purge import purge_users
+from apps.utils.counters import update_counters
 
 sys.path.append('/srv/remotecare/default/')
 os.environ['DJANGO_SETTINGS_MODULE'] = 'remotecare.settings'
 django.setup()
 
 
-# ### Send questionnaire reminder sms
-def send_questionnaire_reminder_sms(patient):
+def get_messages(sms_template, email_template, recipients):
     '''
-    Send a sms reminder to a patient who has not filled
-    in a questionnaire
+    Render the sms and e-mail templates for a batch of recipients (see
+    :func:`apps.utils.notifications.render_notifications`) and return
+    the messages to send according to the notification settings.
+
+    Args:
+        - sms_template: the template name of the sms
+        - email_template: the template name of the e-mail
+        - recipients: list of (notification setting, mobile number,\
+          e-mail address, context) tuples, the notification setting\
+          is 'sms_only', 'email_only' or both
+
+    Returns:
+        A list of (send function, recipient, content) tuples
     '''
-    current_date = date.today()
-    healthprofessional = patient.current_practitioner
+    sms_recipients = [recipient for recipient in recipients
+                      if recipient[0] != 'email_only']
+    email_recipients = [recipient for recipient in recipients
+                        if recipient[0] != 'sms_only']
 
-    context = {
-        'patient': patient,
-        'healthprofessional': healthprofessional,
-        'current_date': current_date,
-        'is_male': patient.user.gender == 'male'}
+    sms_contents = render_notifications(
+        sms_template, [context for (notification, mobile_number, email,
+                                    context) in sms_recipients])
+    email_contents = render_notifications(
+        email_template, [context for (notification, mobile_number, email,
+                                      context) in email_recipients])
 
-    sms_template = 'service/sms/questionnaire_reminder_sms.html'
-    sms_template = loader.get_template(sms_template)
-    sms_content = sms_template.render(context)
+    messages = [(send_sms_to, recipient[1], content)
+                for (recipient, content) in zip(sms_recipients, sms_contents)]
+    messages += [(send_email_to, recipient[2], content) for
+                 (recipient, content) in zip(email_recipients, email_contents)]
+    return messages
 
-    email_template = 'service/email/questionnaire_reminder_email.html'
-    email_template = loader.get_template(email_template)
-    email_content = email_template.render(context)
 
-    do_sms = (patient.regular_control_reminder_notification != 'email_only')
-    do_email = (patient.regular_control_reminder_notification != 'sms_only')
+# ### Send questionnaire reminder sms
+def get_questionnaire_reminder_messages(patients):
+    '''
+    Messages for reminding patients who have not filled
+    in a questionnaire
+    '''
+    return get_messages(
+        'service/sms/questionnaire_reminder_sms.html',
+        'service/email/questionnaire_reminder_email.html',
+        [(patient.regular_control_reminder_notification,
+          patient.user.mobile_number, patient.user.email,
+          get_patient_context(patient)) for patient in patients])
 
-    if do_sms:
-        # send sms to patient
-        send_sms_to(patient.user.mobile_number, sms_content)
 
-    if do_email:
-        send_email_to(patient.user.email, email_content)
+def send_questionnaire_reminder_sms(patient):
+    '''
+    Send a sms reminder to a patient who has not filled
+    in a questionnaire
+    '''
+    send_messages(get_questionnaire_reminder_messages([patient]))
 
 
 # ### Send questionnaire fillin sms
+def get_questionnaire_fillin_messages(patients):
+    '''
+    Messages for patients that a new series of questionnaires
+    should be filled in
+    '''
+    return get_messages(
+        'service/sms/questionnaire_fillin_sms.html',
+        'service/email/questionnaire_fillin_email.html',
+        [(patient.regular_control_start_notification,
+          patient.user.mobile_number, patient.user.email,
+          get_patient_context(patient)) for patient in patients])
+
+
 def send_questionnaire_fillin_sms(patient):
     '''
     Send a sms and/or email
     message to a patient that a new series of questionnaires that
     should be filled in
     '''
-    current_date = date.today()
-    healthprofessional = patient.current_practitioner
-
-    context = {
-        'patient': patient,
-        'healthprofessional': healthprofessional,
-        'current_date': current_date,
-        'is_male': patient.user.gender == 'male'}
-
-    sms_template = 'service/sms/questionnaire_fillin_sms.html'
-    sms_template = loader.get_template(sms_template)
-    sms_content = sms_template.render(context)
+    send_messages(get_questionnaire_fillin_messages([patient]))
 
-    email_template = 'service/email/questionnaire_fillin_email.html'
-    email_template = loader.get_template(email_template)
-    email_content = email_template.render(context)
 
-    do_sms = (patient.regular_control_start_notification != 'email_only')
-    do_email = (patient.regular_control_start_notification != 'sms_only')
+def get_report_reminder_messages(questionnaire_requests, sms_template,
+                                 email_template):
+    '''
+    Messages for the healthprofessionals (or the secretaries for urgent
+    controls) about controls which he/she has not created a report for.
+    '''
+    recipients = []
+    for questionnaire_request in questionnaire_requests:
+        healthprofessional =\
+            questionnaire_request.patient.current_practitioner
+        user = healthprofessional.user
+        if healthprofessional.urgent_control_secretary:
+            user = healthprofessional.urgent_control_secretary.user
 
-    if do_sms:
-        # send sms to patient
-        send_sms_to(patient.user.mobile_number, sms_content)
+        recipients.append((
+            healthprofessional.urgent_control_notification,
+            user.mobile_number, user.email, {}))
 
-    if do_email:
-        send_email_to(patient.user.email, email_content)
+    return get_messages(sms_template, email_template, recipients)
 
 
 # ### Send urgent report reminder sms
@@ -102,41 +148,8 @@ def send_urgent_report_reminder(urgent_questionnaire_request):
     Send a message to healthprofessional about an urgent control
     which he/she has not created a report for.
     '''
-    healthprofessional =\
-        urgent_questionnaire_request.patient.current_practitioner
-
-    context = {'healthprofessional': healthprofessional}
-
-    sms_template = 'service/sms/urgent_report_reminder_sms.html'
-    sms_template = loader.get_template(sms_template)
-    sms_content = sms_template.render(context)
-
-    email_template = 'service/email/urgent_report_reminder_email.html'
-    email_template = loader.get_template(email_template)
-    email_content = email_template.render(context)
-
-    # check if to send sms or e-mail or both, or both to secretary.
-
-    do_sms = True
-    do_email = True
-
-    mobile_number = healthprofessional.user.mobile_number
-    email = healthprofessional.user.email
-
-    if healthprofessional.urgent_control_secretary:
-        mobile_number =\
-            healthprofessional.urgent_control_secretary.user.mobile_number
-        email = healthprofessional.urgent_control_secretary.user.email
-
-    do_sms = (healthprofessional.urgent_control_notification != 'email_only')
-    do_email = (healthprofessional.urgent_control_notification != 'sms_only')
-
-    if do_sms:
-        # send sms to healthprofessional
-        send_sms_to(mobile_number, sms_content)
-
-    if do_email:
-        send_email_to(email, email_content)
+    send_messages(get_urgent_report_reminders(
+        [urgent_questionnaire_request]).messages)
 
 
 # ### Send report reminder sms
@@ -145,35 +158,32 @@ def send_report_reminder(questionnaire_request):
     Send a message to healthprofessional about an controle
     which he/she has not created a report for.
     '''
-    healthprofessional = questionnaire_request.patient.current_practitioner
-
-    context = {'healthprofessional': healthprofessional}
+    send_messages(get_report_reminders([questionnaire_request]).messages)
 
-    sms_template = 'service/sms/report_reminder_sms.html'
-    sms_template = loader.get_template(sms_template)
-    sms_content = sms_template.render(context)
 
-    email_template = 'service/email/report_reminder_email.html'
-    email_template = loader.get_template(email_template)
-    email_content = email_template.render(context)
-
-    mobile_number = healthprofessional.user.mobile_number
-    email = healthprofessional.user.email
-
-    if healthprofessional.urgent_control_secretary:
-        mobile_number =\
-            healthprofessional.urgent_control_secretary.user.mobile_number
-        email = healthprofessional.urgent_control_secretary.user.email
+def get_deleted_patient_users():
+    '''
+    Returns:
+        The users of patients that are set for deletion more than\
+        2 weeks ago
+    '''
+    deadline = date.today() - relativedelta(weeks=+2)
+    return User.objects.filter(
+        groups__name='patients',
+        deleted_on__isnull=False,
+        deleted_on__lte=deadline)
 
-    do_sms = (healthprofessional.urgent_control_notification != 'email_only')
-    do_email = (healthprofessional.urgent_control_notification != 'sms_only')
 
-    if do_sms:
-        # send sms to healthprofessional
-        send_sms_to(mobile_number, sms_content)
+def delete_patient_users(users):
+    '''
+    Really delete all information of the users and their patients,
+    see :func:`apps.service.purge.purge_users`
 
-    if do_email:
-        send_email_to(email, email_content)
+    Returns:
+        The :class:`apps.service.runner.StageOutput` without messages\
+        and with the number of deleted rows per table
+    '''
+    return StageOutput(rows=purge_users(users))
 
 
 def remove_deleted_patients():
@@ -181,41 +191,88 @@ def remove_deleted_patients():
     Automatically remove patients that are set for deletion
     after 2 weeks
     """
-    deadline = date.today() - relativedelta(weeks=+2)
-    users = User.objects.filter(
-        groups__name='patients',
-        deleted_on__isnull=False,
-        deleted_on__lte=deadline)
-
-    # really delete all information..
-    if users:
-        for user in users:
-            healthperson = user.healthperson
-            healthperson.delete()
-            user.delete()
+    return run_daily_stage('remove_deleted_patients')
 
 
 # ## CHECK DEADLINE QUESTIONNAIRES
-def check_questionnaire_fillin_deadlines():
+def get_passed_fillin_deadlines():
     '''
-    Check if deadlines for filling in questionnaires are passed
+    Returns:
+        The (non urgent) questionnaire requests of which the deadline\
+        has passed
+    '''
+    return QuestionnaireRequest.objects.filter(
+        urgent=False, finished_on__isnull=True,
+        deadline__lte=date.today()).select_related('patient__user')
+
+
+def get_fillin_deadline_due_dates(questionnaire_request_ids=None):
+    '''
+    Args:
+        - questionnaire_request_ids: the primary keys of the\
+          questionnaire requests, all questionnaire requests if None
+
+    Returns:
+        The (primary key, deadline) tuples of the (non urgent)\
+        questionnaire requests which are not finished yet
     '''
-    # Get all (non urgent) questionnaire requests
     questionnaire_requests = QuestionnaireRequest.objects.filter(
-        urgent=False, finished_on__isnull=True, deadline__lte=date.today())
+        urgent=False, finished_on__isnull=True, deadline__isnull=False)
+    if questionnaire_request_ids is not None:
+        questionnaire_requests = questionnaire_requests.filter(
+            pk__in=questionnaire_request_ids)
+    return questionnaire_requests.values_list('pk', 'deadline')
+
+
+def get_changed_questionnaire_requests(changes):
+    '''
+    Returns:
+        The primary keys of the changed questionnaire requests
+    '''
+    return changes.get('QuestionnaireRequest', set())
 
+
+def extend_fillin_deadlines(questionnaire_requests):
+    '''
+    Extend the deadlines with a week with one update query and save
+    the audit entries at once
+
+    Returns:
+        The :class:`apps.service.runner.StageOutput` with the reminder\
+        messages for the patients
+    '''
+    deadline = date.today() + relativedelta(weeks=+1)
+    QuestionnaireRequest.objects.filter(
+        pk__in=[questionnaire_request.pk
+                for questionnaire_request in questionnaire_requests]
+    ).update(deadline=deadline,
+             deadline_nr=Coalesce(F('deadline_nr'), 0) + 1)
+
+    log_entries = []
     for questionnaire_request in questionnaire_requests:
         # update questionnaire request deadline
-        questionnaire_request.deadline = date.today() + relativedelta(weeks=+1)
+        questionnaire_request.deadline = deadline
         questionnaire_request.deadline_nr =\
-            questionnaire_request.deadline_nr + 1
+            (questionnaire_request.deadline_nr or 0) + 1
         # Auditing, there is no service user so put the patient itselves
         questionnaire_request.changed_by_user =\
             questionnaire_request.patient.user
-        questionnaire_request.save()
+        log_entry = questionnaire_request.get_update_audit_entry()
+        if log_entry:
+            log_entries.append(log_entry)
+    save_audit_entries(log_entries)
 
-        # send reminder sms
-        send_questionnaire_reminder_sms(questionnaire_request.patient)
+    # send reminder sms
+    return StageOutput(get_questionnaire_reminder_messages(
+        [questionnaire_request.patient
+         for questionnaire_request in questionnaire_requests]))
+
+
+def check_questionnaire_fillin_deadlines():
+    '''
+    Check if deadlines for filling in questionnaires are passed
+    '''
+    return run_daily_stage('check_questionnaire_fillin_deadlines')
 
 
 # ## ADD QUESTIONNAIRE REQUEST ####
@@ -230,11 +287,11 @@ def insert_new_questionnaire_request_for_patient(patient):
     send_questionnaire_fillin_sms(patient)
 
 
-def insert_new_questionnaire_requests():
+def get_control_patients():
     '''
-    Helper function for adding a new questionnaire request
+    Returns:
+        The patients which could need a new questionnaire request
     '''
-    # checks for which patients a new questionnaire request need to be added
     # check if has no open questionnaire request,
     # if so these should be finished first!
     patient_filter = Q(regular_control_frequency='never') |\
@@ -242,26 +299,144 @@ def insert_new_questionnaire_requests():
          Q(questionnairerequest__urgent=False) &
          Q(questionnairerequest__handled_on__isnull=True))
 
-    for patient in Patient.objects.exclude(patient_filter):
+    return Patient.objects.exclude(
+        patient_filter).with_control_schedule().select_related('user')
+
+
+def get_control_patient_due_dates(patient_ids=None):
+    '''
+    Args:
+        - patient_ids: the primary keys of the patients, all patients\
+          if None
+
+    Returns:
+        The (primary key, next questionnaire date) tuples of the\
+        patients with regular controls, today if the patient has no\
+        next questionnaire date
+    '''
+    patients = Patient.objects.exclude(regular_control_frequency='never')
+    if patient_ids is not None:
+        patients = patients.filter(pk__in=patient_ids)
+    return [(patient.pk, patient.next_questionnaire_date or date.today())
+            for patient in patients.with_control_schedule()]
+
+
+def get_changed_control_patients(changes):
+    '''
+    Returns:
+        The primary keys of the changed patients and of the patients
+        of the changed questionnaire requests
+    '''
+    patient_ids = set(changes.get('Patient', set()))
+    questionnaire_request_ids = list(
+        changes.get('QuestionnaireRequest', set()))
+    for start in range(0, len(questionnaire_request_ids), 500):
+        patient_ids.update(QuestionnaireRequest.objects.filter(
+            pk__in=questionnaire_request_ids[start:start + 500]
+        ).values_list('patient_id', flat=True))
+    return patient_ids
+
+
+def insert_due_questionnaire_requests(patients):
+    '''
+    Add a new questionnaire request for the patients of which the next
+    questionnaire date has passed
+
+    Returns:
+        The :class:`apps.service.runner.StageOutput` with the fill in\
+        messages for the patients, acted on the patients with a new\
+        questionnaire request
+    '''
+    due_patients = []
+    for patient in patients:
         # check if need to sent new one.
         next_questionnaire_date = patient.next_questionnaire_date
         if ((not next_questionnaire_date or
              next_questionnaire_date <= date.today())):
-            insert_new_questionnaire_request_for_patient(patient)
+            due_patients.append(patient)
 
+    # add the questionnaire requests in bulk
+    insert_new_questionnaire_requests_for_patients(due_patients)
 
-def check_unhandled_questionnaires():
+    # Send a sms to the patients, that they need to fillin the
+    # questionnaire
+    messages = get_questionnaire_fillin_messages(due_patients)
+    return StageOutput(messages, acted=len(due_patients))
+
+
+def insert_new_questionnaire_requests():
     '''
-    Check if there are unhandeld controls by healthprofessionals
+    Helper function for adding a new questionnaire request
     '''
-    # check if the deadline (weeks +3) is passed, if so sent a reminder..
+    return run_daily_stage('insert_new_questionnaire_requests')
 
+
+def get_unhandled_questionnaires(urgent):
+    '''
+    Returns:
+        The controls (urgent or not) which are not handled\
+        3 weeks after finishing
+    '''
     deadline = date.today() - relativedelta(weeks=+3)
-    urgent_questionnaire_requests = QuestionnaireRequest.objects.filter(
-        urgent=False, finished_on__lte=deadline, handled_on__isnull=True)
+    return QuestionnaireRequest.objects.filter(
+        urgent=urgent, finished_on__lte=deadline,
+        handled_on__isnull=True).select_related(
+        'patient__current_practitioner__user')
+
+
+def get_unhandled_questionnaire_due_dates(
+        urgent, questionnaire_request_ids=None):
+    '''
+    Args:
+        - urgent: True for the urgent controls
+        - questionnaire_request_ids: the primary keys of the\
+          questionnaire requests, all questionnaire requests if None
+
+    Returns:
+        The (primary key, due date) tuples of the controls (urgent or\
+        not) which are finished but not handled, a reminder is sent\
+        from 3 weeks after finishing
+    '''
+    questionnaire_requests = QuestionnaireRequest.objects.filter(
+        urgent=urgent, finished_on__isnull=False, handled_on__isnull=True)
+    if questionnaire_request_ids is not None:
+        questionnaire_requests = questionnaire_requests.filter(
+            pk__in=questionnaire_request_ids)
+    return [(pk, finished_on + relativedelta(weeks=+3))
+            for (pk, finished_on) in questionnaire_requests.values_list(
+                'pk', 'finished_on')]
+
+
+def get_report_reminders(questionnaire_requests):
+    '''
+    Returns:
+        The :class:`apps.service.runner.StageOutput` with the report\
+        reminder messages for the healthprofessionals
+    '''
+    return StageOutput(get_report_reminder_messages(
+        questionnaire_requests,
+        'service/sms/report_reminder_sms.html',
+        'service/email/report_reminder_email.html'))
+
 
-    for urgent_questionnaire_request in urgent_questionnaire_requests:
-        send_report_reminder(urgent_questionnaire_request)
+def get_urgent_report_reminders(urgent_questionnaire_requests):
+    '''
+    Returns:
+        The :class:`apps.service.runner.StageOutput` with the urgent\
+        report reminder messages for the healthprofessionals
+    '''
+    return StageOutput(get_report_reminder_messages(
+        urgent_questionnaire_requests,
+        'service/sms/urgent_report_reminder_sms.html',
+        'service/email/urgent_report_reminder_email.html'))
+
+
+def check_unhandled_questionnaires():
+    '''
+    Check if there are unhandeld controls by healthprofessionals
+    '''
+    # check if the deadline (weeks +3) is passed, if so sent a reminder..
+    return run_daily_stage('check_unhandled_questionnaires')
 
 
 def check_unhandled_urgent_questionnaires():
@@ -269,39 +444,92 @@ def check_unhandled_urgent_questionnaires():
     Check if there are unhandeld urgent controls by healthprofessionals
     '''
     # check if the deadline (days +3) is passed, if so sent a reminder..
-    deadline = date.today() - relativedelta(weeks=+3)
-    urgent_questionnaire_requests = QuestionnaireRequest.objects.filter(
-        urgent=True, finished_on__lte=deadline, handled_on__isnull=True)
+    return run_daily_stage('check_unhandled_urgent_questionnaires')
 
-    for urgent_questionnaire_request in urgent_questionnaire_requests:
-        send_urgent_report_reminder(urgent_questionnaire_request)
 
+def get_counter_patients():
+    '''
+    Returns:
+        All patients, without their (encrypted) fields
+    '''
+    return Patient.objects.only('pk')
 
-# Run all daily checks and other services
-def main_run_daily():  # pragma: no cover
+
+def reconcile_counters(patients):
     '''
-    Function which can be called daily to perform all necessary checks.
+    Calculate the counters of the patients again, see
+    :func:`apps.utils.counters.update_counters`
 
-    .. note:: Should be run around 09:00. !!NOT AT MIDNIGHT!!
-              since people are going to get SMS notifications.
+    Returns:
+        The :class:`apps.service.runner.StageOutput` without messages
     '''
-    # step 1: remove patients that are set to be deleted
-    remove_deleted_patients()
+    update_counters([patient.pk for patient in patients])
+    return StageOutput()
 
-    # step 2: insert new questionnaires
-    insert_new_questionnaire_requests()
 
+# The stages of the daily run in order, the stages with due dates only
+# process the objects which are due (see apps.service.schedule)
+DAILY_STAGES = [
+    # step 1: remove patients that are set to be deleted
+    Stage('remove_deleted_patients',
+          get_deleted_patient_users, delete_patient_users),
+    # step 2: insert new questionnaires
+    Stage('insert_new_questionnaire_requests',
+          get_control_patients, insert_due_questionnaire_requests,
+          get_control_patient_due_dates, get_changed_control_patients),
     # step 3: check and sms accordingly to the questionnaire deadlines
-    check_questionnaire_fillin_deadlines()
+    Stage('check_questionnaire_fillin_deadlines',
+          get_passed_fillin_deadlines, extend_fillin_deadlines,
+          get_fillin_deadline_due_dates,
+          get_changed_questionnaire_requests),
+    # step 4: check and sms accordingly to unhandled urgent questionnaires
+    Stage('check_unhandled_urgent_questionnaires',
+          lambda: get_unhandled_questionnaires(True),
+          get_urgent_report_reminders,
+          lambda ids: get_unhandled_questionnaire_due_dates(True, ids),
+          get_changed_questionnaire_requests),
+    # step 5: check and sms accordingly to unhandled questionnaires
+    Stage('check_unhandled_questionnaires',
+          lambda: get_unhandled_questionnaires(False),
+          get_report_reminders,
+          lambda ids: get_unhandled_questionnaire_due_dates(False, ids),
+          get_changed_questionnaire_requests),
+    # step 6: correct the counters of the patients
+    Stage('reconcile_counters', get_counter_patients, reconcile_counters),
+]
+
+
+def run_daily_stage(name, **kwargs):
+    '''
+    Run one stage of the daily run, see
+    :func:`apps.service.runner.run_stage` for the options.
 
-    # step 3: check and sms accordingly to unhandled urgent questionnaires
-    check_unhandled_urgent_questionnaires()
+    Args:
+        - name: the name of the stage in DAILY_STAGES
+
+    Returns:
+        The result of the stage
+    '''
+    return run_stages(DAILY_STAGES, names=[name], **kwargs)[0]
 
-    # step 4: check and sms accordingly to unhandled questionnaires
-    check_unhandled_questionnaires()
+
+# Run all daily checks and other services
+def main_run_daily(**kwargs):  # pragma: no cover
+    '''
+    Function which can be called daily to perform all necessary checks,
+    see :func:`apps.service.runner.run_stages` for the options.
+
+    .. note:: Should be run around 09:00. !!NOT AT MIDNIGHT!!
+              since people are going to get SMS notifications.
+
+    Returns:
+        A list with the results per stage
+    '''
+    return run_stages(DAILY_STAGES, **kwargs)
 
 if __name__ == '__main__':  # pragma: no cover
     '''
     Note: Run this command around 09:00 daily
     '''
-    main_run_daily()
+    for result in main_run_daily():
+        print(result)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+This module maintains the counters of the patients (see
+:class:`apps.utils.models.Counters`), so the unread message badge and
+:attr:`apps.account.models.User.new_questionnaire_request` don't need
+a count query on every page.
+
+The counters of a patient are calculated again, in the transaction of
+the change, when a message is added, read or removed and when a
+questionnaire request is added, handled or removed. The daily run
+calculates all counters again (the reconcile_counters stage in
+:data:`apps.service.utils.DAILY_STAGES`), which corrects the counters
+after changes that bypass the models, for example queryset updates.
+
+Usage:
+
+.. code-block:: python
+
+    counters = get_counters(patient.id)
+    counters.unread_messages
+
+:subtitle:`Function definitions:`
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from apps.utils.models import Counters
+
+# The number of patients per query
+COUNTERS_CHUNK_SIZE = 500
+
+
+def count_per_patient(queryset):
+    """
+    Args:
+        - queryset: a queryset of a model with a patient field
+
+    Returns:
+        A dict with the number of objects per patient id
+    """
+    return dict(queryset.order_by().values_list('patient_id').annotate(
+        count=Count('id')))
+
+
+def update_counters(patient_ids):
+    """
+    Calculate the counters of the patients again, with a fixed number
+    of queries per chunk of patients.
+
+    Args:
+        - patient_ids: the primary keys of the patients
+    """
+    from apps.questionnaire.models import QuestionnaireRequest
+    from apps.rcmessages.models import RCMessage
+    from apps.rcmessages.views import remove_not_handled_messages
+
+    patient_ids = list(set(patient_ids))
+    for start in range(0, len(patient_ids), COUNTERS_CHUNK_SIZE):
+        chunk = patient_ids[start:start + COUNTERS_CHUNK_SIZE]
+        unread_messages = count_per_patient(remove_not_handled_messages(
+            RCMessage.objects.filter(
+                patient_id__in=chunk, read_on__isnull=True)))
+        questionnaire_requests = count_per_patient(
+            QuestionnaireRequest.objects.filter(patient_id__in=chunk))
+        try:
+            # a savepoint, so a concurrent insert doesn't break the
+            # surrounding transaction
+            with transaction.atomic():
+                Counters.objects.filter(healthperson_id__in=chunk).delete()
+                Counters.objects.bulk_create([
+                    Counters(
+                        healthperson_id=patient_id,
+                        unread_messages=unread_messages.get(patient_id, 0),
+                        questionnaire_requests=questionnaire_requests.get(
+                            patient_id, 0))
+                    for patient_id in chunk])
+        except IntegrityError:
+            # the counters are written by another transaction
+            pass
+
+
+def get_counters(patient_id):
+    """
+    Args:
+        - patient_id: the primary key of the patient
+
+    Returns:
+        The :class:`apps.utils.models.Counters` of the patient, these\
+        are calculated if the patient has no counters yet
+    """
+    try:
+        return Counters.objects.get(healthperson_id=patient_id)
+    except Counters.DoesNotExist:
+        update_counters([patient_id])
+        return Counters.objects.get(healthperson_id=patient_id)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Management command for sending the messages in the notification
+outbox, see :mod:`apps.utils.outbox`. Multiple workers can run at the
+same time, every worker claims its own batches.
+
+:subtitle:`Class definitions:`
+"""
+import time
+from django.core.management.base import BaseCommand
+from apps.utils.outbox import process_outbox, get_outbox_stats
+
+
+class Command(BaseCommand):
+    """
+    Send the queued SMS and e-mail messages
+    """
+    help = 'Send the queued SMS and e-mail messages of the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Number of messages to claim per batch')
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when the outbox is empty')
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Stop when the outbox is empty')
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Only report the queue depth and send latency')
+
+    def write_stats(self):
+        stats = get_outbox_stats()
+        self.stdout.write(
+            'queue depth: {queue_depth}, failed: {failed}, oldest queued: '
+            '{oldest_queued_seconds:.1f}s, sent last hour: {sent}, '
+            'latency avg: {average_latency_seconds:.1f}s max: '
+            '{max_latency_seconds:.1f}s'.format(**stats))
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.write_stats()
+            return
+
+        while True:
+            sent, failed = process_outbox(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(
+                    'Sent {0} messages, {1} failed'.format(sent, failed))
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['sleep'])
+
+        self.write_stats()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-19 14:49
+from __future__ import unicode_literals
+
+import core.models
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id',
+                 models.AutoField(auto_created=True,
+                                  primary_key=True,
+                                  serialize=False,
+                                  verbose_name='ID')),
+                ('kind',
+                 models.CharField(choices=[(b'sms', b'SMS'),
+                                           (b'email', b'E-mail')],
+                                  max_length=8)),
+                ('recipient',
+                 core.models.EncryptedCharField(max_length=512)),
+                ('subject',
+                 models.CharField(blank=True, max_length=256)),
+                ('content',
+                 core.models.EncryptedTextField(blank=True)),
+                ('status',
+                 models.CharField(choices=[(b'queued', b'Queued'),
+                                           (b'sending', b'Sending'),
+                                           (b'sent', b'Sent'),
+                                           (b'failed', b'Failed')],
+                                  default=b'queued',
+                                  max_length=8)),
+                ('attempts',
+                 models.PositiveIntegerField(default=0)),
+                ('last_error',
+                 models.TextField(blank=True)),
+                ('created_on',
+                 models.DateTimeField(default=django.utils.timezone.now)),
+                ('next_attempt_on',
+                 models.DateTimeField(default=django.utils.timezone.now)),
+                ('claimed_on',
+                 models.DateTimeField(blank=True, null=True)),
+                ('sent_on',
+                 models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='outboxmessage',
+            index_together=set([('status', 'next_attempt_on')]),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-19 15:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DueDate',
+            fields=[
+                ('id',
+                 models.AutoField(auto_created=True,
+                                  primary_key=True,
+                                  serialize=False,
+                                  verbose_name='ID')),
+                ('stage', models.CharField(max_length=64)),
+                ('object_id', models.PositiveIntegerField()),
+                ('due_on', models.DateField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('id',
+                 models.AutoField(auto_created=True,
+                                  primary_key=True,
+                                  serialize=False,
+                                  verbose_name='ID')),
+                ('stage', models.CharField(max_length=64, unique=True)),
+                ('log_entry_id', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='duedate',
+            unique_together=set([('stage', 'object_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='duedate',
+            index_together=set([('stage', 'due_on')]),
+        ),
+    ]
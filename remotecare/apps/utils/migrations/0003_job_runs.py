@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-19 15:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('utils', '0002_due_dates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobRun',
+            fields=[
+                ('id',
+                 models.AutoField(auto_created=True,
+                                  primary_key=True,
+                                  serialize=False,
+                                  verbose_name='ID')),
+                ('started_on',
+                 models.DateTimeField(
+                     default=django.utils.timezone.now)),
+                ('finished_on', models.DateTimeField(blank=True, null=True)),
+                ('dry_run', models.BooleanField(default=False)),
+                ('full_scan', models.BooleanField(default=False)),
+                ('failed', models.BooleanField(default=False)),
+            ],
+            options={
+                'ordering': ('-started_on', '-id'),
+            },
+        ),
+        migrations.CreateModel(
+            name='StageRun',
+            fields=[
+                ('id',
+                 models.AutoField(auto_created=True,
+                                  primary_key=True,
+                                  serialize=False,
+                                  verbose_name='ID')),
+                ('name', models.CharField(max_length=64)),
+                ('started_on',
+                 models.DateTimeField(
+                     default=django.utils.timezone.now)),
+                ('seconds', models.FloatField(default=0.0)),
+                ('scanned', models.PositiveIntegerField(default=0)),
+                ('acted', models.PositiveIntegerField(default=0)),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('errors', models.TextField(blank=True)),
+                ('job_run',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     related_name='stages',
+                     to='utils.JobRun')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='stagerun',
+            index_together=set([('name', 'started_on')]),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-19 15:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('healthperson', '0001_initial'),
+        ('utils', '0003_job_runs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counters',
+            fields=[
+                ('healthperson',
+                 models.OneToOneField(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     primary_key=True,
+                     related_name='counters',
+                     serialize=False,
+                     to='healthperson.HealthPerson')),
+                ('unread_messages', models.PositiveIntegerField(default=0)),
+                ('questionnaire_requests',
+                 models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
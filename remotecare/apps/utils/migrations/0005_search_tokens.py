@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-19 15:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('healthperson', '0001_initial'),
+        ('utils', '0004_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id',
+                 models.AutoField(auto_created=True,
+                                  primary_key=True,
+                                  serialize=False,
+                                  verbose_name='ID')),
+                ('model', models.CharField(max_length=64)),
+                ('object_id', models.PositiveIntegerField()),
+                ('token', models.CharField(max_length=32)),
+                ('healthperson',
+                 models.ForeignKey(
+                     on_delete=django.db.models.deletion.CASCADE,
+                     to='healthperson.HealthPerson')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='searchtoken',
+            index_together=set([('model', 'object_id'),
+                                ('healthperson', 'model', 'token')]),
+        ),
+    ]
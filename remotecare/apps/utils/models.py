@@ -1 +1,171 @@
 # -*- coding: utf-8 -*-
+"""
+This module contains the models of the background services:
+
+- the outbox for SMS and e-mail messages which are sent by the outbox\
+  worker, see :mod:`apps.utils.outbox`
+- the due date index and the run history of the daily service stages,\
+  see :mod:`apps.service.schedule` and :mod:`apps.service.runner`
+- the counters of the patients, see :mod:`apps.utils.counters`
+- the search tokens of encrypted texts, see :mod:`apps.utils.search`
+
+:subtitle:`Class definitions:`
+"""
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+from core.models import EncryptedCharField, EncryptedTextField
+
+OUTBOX_KIND_CHOICES = (
+    ('sms', 'SMS'),
+    ('email', 'E-mail'),
+)
+
+OUTBOX_STATUS_CHOICES = (
+    ('queued', 'Queued'),
+    ('sending', 'Sending'),
+    ('sent', 'Sent'),
+    ('failed', 'Failed'),
+)
+
+
+class OutboxMessage(models.Model):
+    """
+    A rendered SMS or e-mail message waiting to be sent (or sent)
+    by the outbox worker. The recipient and content are encrypted with
+    settings.OUTBOX_KEY, the content is removed after sending.
+    """
+    kind = models.CharField(
+        choices=OUTBOX_KIND_CHOICES,
+        max_length=8)
+
+    recipient = EncryptedCharField(
+        max_length=128,
+        encryption_key=lambda: settings.OUTBOX_KEY)
+
+    subject = models.CharField(
+        max_length=256,
+        blank=True)
+
+    content = EncryptedTextField(
+        blank=True,
+        encryption_key=lambda: settings.OUTBOX_KEY)
+
+    status = models.CharField(
+        choices=OUTBOX_STATUS_CHOICES,
+        default='queued',
+        max_length=8)
+
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    created_on = models.DateTimeField(default=timezone.now)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    claimed_on = models.DateTimeField(null=True, blank=True)
+    sent_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        index_together = (('status', 'next_attempt_on'),)
+
+
+class DueDate(models.Model):
+    """
+    The date on which an object (for example a patient or a
+    questionnaire request) should be processed by a daily stage.
+    """
+    stage = models.CharField(max_length=64)
+    object_id = models.PositiveIntegerField()
+    due_on = models.DateField()
+
+    class Meta:
+        unique_together = (('stage', 'object_id'),)
+        index_together = (('stage', 'due_on'),)
+
+
+class Watermark(models.Model):
+    """
+    The last audit log entry of which the changes are processed in the
+    due dates of a daily stage.
+    """
+    stage = models.CharField(max_length=64, unique=True)
+    log_entry_id = models.PositiveIntegerField(default=0)
+
+
+class JobRun(models.Model):
+    """
+    A run of (a selection of) the daily service stages, the results
+    per stage are stored as :class:`StageRun`.
+    """
+    started_on = models.DateTimeField(default=timezone.now)
+    finished_on = models.DateTimeField(null=True, blank=True)
+    dry_run = models.BooleanField(default=False)
+    full_scan = models.BooleanField(default=False)
+    # True if a stage had failures or raised an exception
+    failed = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ('-started_on', '-id')
+
+    @property
+    def seconds(self):
+        """
+        Returns:
+            The duration of the run in seconds or None if not finished
+        """
+        if self.finished_on is None:
+            return None
+        return (self.finished_on - self.started_on).total_seconds()
+
+
+class StageRun(models.Model):
+    """
+    The duration, counts and failures of a stage in a :class:`JobRun`
+    """
+    job_run = models.ForeignKey(
+        JobRun, related_name='stages', on_delete=models.CASCADE)
+    name = models.CharField(max_length=64)
+    started_on = models.DateTimeField(default=timezone.now)
+    seconds = models.FloatField(default=0.0)
+    # the number of objects processed by the stage
+    scanned = models.PositiveIntegerField(default=0)
+    # the number of objects the stage acted on
+    acted = models.PositiveIntegerField(default=0)
+    messages = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    # the failure descriptions and the exception of a failed stage
+    errors = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('id',)
+        index_together = (('name', 'started_on'),)
+
+
+class Counters(models.Model):
+    """
+    The counters of a patient which are shown on every page, maintained
+    by :mod:`apps.utils.counters`.
+    """
+    healthperson = models.OneToOneField(
+        'healthperson.HealthPerson', primary_key=True,
+        related_name='counters', on_delete=models.CASCADE)
+    # the number of unread messages the patient can see
+    unread_messages = models.PositiveIntegerField(default=0)
+    questionnaire_requests = models.PositiveIntegerField(default=0)
+
+
+class SearchToken(models.Model):
+    """
+    A keyed hash (HMAC) of a normalised word of an encrypted text of a
+    patient, see :mod:`apps.utils.search`. The words themselves are
+    not stored.
+    """
+    healthperson = models.ForeignKey(
+        'healthperson.HealthPerson', on_delete=models.CASCADE)
+    # the name of the model of the object, for example 'RCMessage'
+    model = models.CharField(max_length=64)
+    object_id = models.PositiveIntegerField()
+    token = models.CharField(max_length=32)
+
+    class Meta:
+        index_together = (('healthperson', 'model', 'token'),
+                          ('model', 'object_id'))
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+This module renders the SMS and e-mail notification templates. Every
+template is loaded and compiled once per process and rendered with a
+compact context of plain values (see :func:`get_patient_context`), so
+no model instances are needed for rendering.
+
+A batch of recipients is rendered with :func:`render_notifications`,
+which renders every distinct context only once, the contexts of
+reminders only differ per diagnose.
+
+Usage:
+
+.. code-block:: python
+
+    contents = render_notifications(
+        'service/sms/questionnaire_fillin_sms.html',
+        [get_patient_context(patient) for patient in patients])
+
+:subtitle:`Function definitions:`
+"""
+from datetime import date
+from django.template import loader
+from django.utils.encoding import force_text
+
+# The compiled templates per template name
+_templates = {}
+
+
+def get_notification_template(template_name):
+    """
+    Args:
+        - template_name: the name of the notification template
+
+    Returns:
+        The compiled template, loaded once per process
+    """
+    template = _templates.get(template_name)
+    if template is None:
+        template = _templates[template_name] =\
+            loader.get_template(template_name)
+    return template
+
+
+def get_patient_context(patient):
+    """
+    Args:
+        - patient: the patient to notify
+
+    Returns:
+        The context for the notification templates of a patient,\
+        with diagnose_display, is_male and current_date
+    """
+    return {
+        'diagnose_display': force_text(patient.get_diagnose_display()),
+        'is_male': patient.user.gender == 'male',
+        'current_date': date.today()}
+
+
+def render_notification(template_name, context):
+    """
+    Args:
+        - template_name: the name of the notification template
+        - context: dict with the (plain) context values
+
+    Returns:
+        The rendered content
+    """
+    return get_notification_template(template_name).render(context)
+
+
+def render_notifications(template_name, contexts):
+    """
+    Render a notification for a batch of recipients, every distinct
+    context is rendered once.
+
+    Args:
+        - template_name: the name of the notification template
+        - contexts: list of dicts with (hashable) context values
+
+    Returns:
+        A list with the rendered content per context
+    """
+    rendered = {}
+    contents = []
+    for context in contexts:
+        key = tuple(sorted(context.items()))
+        if key not in rendered:
+            rendered[key] = render_notification(template_name, context)
+        contents.append(rendered[key])
+    return contents
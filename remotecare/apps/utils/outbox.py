@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the notification outbox. User facing requests
+queue their rendered SMS and e-mail messages with
+:func:`queue_message` and return immediately, the messages are sent by
+the process_outbox management command.
+
+Workers claim batches of messages with row locking (skipping rows
+locked by other workers where the database supports it), send them,
+and retry failed messages with an exponential backoff until
+OUTBOX_MAX_ATTEMPTS is reached. Messages of a worker which stopped
+while sending are claimed again after OUTBOX_CLAIM_TIMEOUT.
+
+Usage:
+
+.. code-block:: python
+
+    queue_message('sms', user.mobile_number, content)
+    # in the worker
+    process_outbox(batch_size=50)
+
+:subtitle:`Function definitions:`
+"""
+import logging
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from apps.utils.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# The number of attempts before a message is marked as failed
+OUTBOX_MAX_ATTEMPTS = 5
+# The delay before the first retry, doubled for every next attempt
+OUTBOX_RETRY_DELAY = timedelta(minutes=1)
+# Messages claimed longer ago are claimed again
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def queue_message(kind, recipient, content, subject=''):
+    """
+    Add a message to the outbox
+
+    Args:
+        - kind: 'sms' or 'email'
+        - recipient: the mobile number or e-mail address
+        - content: the rendered content of the message
+        - subject: the subject of an e-mail
+
+    Returns:
+        The queued OutboxMessage
+    """
+    message = OutboxMessage(
+        kind=kind, recipient=recipient, content=content, subject=subject)
+    message.save()
+    return message
+
+
+def claim_messages(batch_size=50):
+    """
+    Claim a batch of messages which are ready to send
+
+    Args:
+        - batch_size: the maximum number of messages to claim
+
+    Returns:
+        A list with the claimed OutboxMessages
+    """
+    now = timezone.now()
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    with transaction.atomic():
+        pks = list(OutboxMessage.objects.select_for_update(
+            skip_locked=skip_locked).filter(
+            Q(status='queued', next_attempt_on__lte=now) |
+            Q(status='sending', claimed_on__lte=now - OUTBOX_CLAIM_TIMEOUT)
+        ).order_by('next_attempt_on', 'pk').values_list(
+            'pk', flat=True)[:batch_size])
+        OutboxMessage.objects.filter(pk__in=pks).update(
+            status='sending', claimed_on=now)
+    return list(OutboxMessage.objects.filter(pk__in=pks).order_by('pk'))
+
+
+def store_result(message, error=None):
+    """
+    Store the result of sending a claimed message, a failed message is
+    queued again with a backoff or marked as failed after
+    OUTBOX_MAX_ATTEMPTS attempts.
+
+    Args:
+        - message: the claimed OutboxMessage
+        - error: the exception if sending failed
+
+    Returns:
+        True if the message is sent, False otherwise
+    """
+    message.attempts += 1
+    if error is not None:
+        message.last_error = '{0}: {1}'.format(
+            error.__class__.__name__, error)
+        if message.attempts >= OUTBOX_MAX_ATTEMPTS:
+            message.status = 'failed'
+        else:
+            message.status = 'queued'
+            message.next_attempt_on = timezone.now() +\
+                OUTBOX_RETRY_DELAY * 2 ** (message.attempts - 1)
+    else:
+        message.status = 'sent'
+        message.sent_on = timezone.now()
+        # Don't keep the content (e.g. login codes) after sending
+        message.content = ''
+
+    message.save(update_fields=[
+        'status', 'attempts', 'last_error', 'next_attempt_on', 'sent_on',
+        'content'])
+    return message.status == 'sent'
+
+
+def deliver_message(message):
+    """
+    Send a claimed message and store the result
+
+    Args:
+        - message: the claimed OutboxMessage
+
+    Returns:
+        True if the message is sent, False otherwise
+    """
+    from apps.utils.utils import send_sms_to, send_email_to
+
+    error = None
+    try:
+        if message.kind == 'sms':
+            send_sms_to(message.recipient, message.content)
+        else:
+            send_email_to(message.recipient, message.content,
+                          subject=message.subject)
+    except Exception as e:
+        logger.exception('Sending outbox message %s failed', message.pk)
+        error = e
+    return store_result(message, error)
+
+
+def process_outbox(batch_size=50):
+    """
+    Claim and send one batch of messages, the e-mails of the batch are
+    sent over one connection with :func:`apps.utils.utils.send_emails_to`
+
+    Args:
+        - batch_size: the maximum number of messages to send
+
+    Returns:
+        A tuple with the number of sent and failed messages
+    """
+    from apps.utils.utils import send_emails_to
+
+    messages = claim_messages(batch_size)
+    emails = [message for message in messages if message.kind == 'email']
+    results = [deliver_message(message) for message in messages
+               if message.kind != 'email']
+
+    if emails:
+        errors = send_emails_to([
+            (message.recipient, message.content, message.subject)
+            for message in emails])
+        for message, error in zip(emails, errors):
+            if error is not None:
+                logger.error('Sending outbox message %s failed: %s',
+                             message.pk, error)
+            results.append(store_result(message, error))
+
+    sent = len([result for result in results if result])
+    return sent, len(results) - sent
+
+
+def get_outbox_stats(since=None):
+    """
+    Args:
+        - since: the start of the period for the send latency,\
+          the last hour if not given
+
+    Returns:
+        A dict with the queue depth (queued and sending messages),
+        the number of failed messages, the age of the oldest queued
+        message and the average and maximum send latency (from
+        queueing till sending) in seconds.
+    """
+    now = timezone.now()
+    if since is None:
+        since = now - timedelta(hours=1)
+
+    queue = OutboxMessage.objects.filter(status__in=['queued', 'sending'])
+    oldest = queue.order_by('created_on').values_list(
+        'created_on', flat=True).first()
+
+    latencies = [
+        (sent_on - created_on).total_seconds()
+        for (created_on, sent_on) in OutboxMessage.objects.filter(
+            status='sent', sent_on__gte=since).values_list(
+            'created_on', 'sent_on')]
+
+    return {
+        'queue_depth': queue.count(),
+        'failed': OutboxMessage.objects.filter(status='failed').count(),
+        'oldest_queued_seconds': (
+            (now - oldest).total_seconds() if oldest else 0),
+        'sent': len(latencies),
+        'average_latency_seconds': (
+            sum(latencies) / len(latencies) if latencies else 0),
+        'max_latency_seconds': max(latencies) if latencies else 0,
+    }
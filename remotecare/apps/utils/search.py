@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the blind index for keyword searches over the
+encrypted texts of a patient (message bodies and questionnaire
+answers), see :class:`apps.utils.models.SearchToken`.
+
+When a text is saved its words are normalised (tags and accents are
+removed and the words are lowercased) and every distinct word is
+stored as a keyed hash (HMAC with settings.SEARCH_INDEX_KEY and the
+patient id), so the same word has a different token for every patient
+and no plaintext is stored. A search looks up the tokens of the words
+of the search term with one indexed ``IN`` query and only the found
+objects are decrypted to check that the words occur as a phrase
+(:func:`text_matches`).
+
+.. note:: Words are matched as whole words, a search for 'pijn' does
+          not find 'buikpijn'. Words of one character are not indexed.
+
+Usage:
+
+.. code-block:: python
+
+    update_search_tokens('RCMessage', [
+        (message.id, message.patient_id, message.get_search_text())])
+    message_ids = search_object_ids('RCMessage', patient.id, 'buikpijn')
+
+:subtitle:`Function definitions:`
+"""
+import re
+import unicodedata
+from collections import Counter
+from Crypto.Hash import HMAC, SHA256
+from django.conf import settings
+from django.utils.encoding import force_text
+from django.utils.six.moves.html_parser import HTMLParser
+from apps.utils.models import SearchToken
+
+# The number of objects per query
+SEARCH_CHUNK_SIZE = 500
+
+# The minimum length of an indexed word
+MIN_WORD_LENGTH = 2
+
+# The number of hexadecimal characters stored per token
+TOKEN_LENGTH = 32
+
+TAG_RE = re.compile(r'<[^>]*>')
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def get_words(text):
+    """
+    Args:
+        - text: the (html) text
+
+    Returns:
+        The normalised words of the text in order: without tags and\
+        accents and lowercased
+    """
+    # the tags are replaced by spaces, so they don't join words
+    text = HTMLParser().unescape(TAG_RE.sub(u' ', force_text(text or '')))
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = u''.join([char for char in text
+                     if not unicodedata.combining(char)])
+    return WORD_RE.findall(text)
+
+
+def get_token(patient_id, word):
+    """
+    Args:
+        - patient_id: the primary key of the patient
+        - word: a normalised word
+
+    Returns:
+        The search token of the word for the patient
+    """
+    value = u'{0}:{1}'.format(patient_id, word).encode('utf8')
+    return HMAC.new(settings.SEARCH_INDEX_KEY, value,
+                    SHA256).hexdigest()[:TOKEN_LENGTH]
+
+
+def get_tokens(patient_id, text):
+    """
+    Args:
+        - patient_id: the primary key of the patient
+        - text: the (html) text
+
+    Returns:
+        The set of search tokens of the indexed words of the text
+    """
+    return set([get_token(patient_id, word)
+                for word in set(get_words(text))
+                if len(word) >= MIN_WORD_LENGTH])
+
+
+def text_matches(text, searchterm):
+    """
+    Args:
+        - text: the (html) text
+        - searchterm: the search term
+
+    Returns:
+        True if the normalised words of the search term occur in\
+        the text as a phrase
+    """
+    words = get_words(searchterm)
+    if not words:
+        return False
+    return u' {0} '.format(u' '.join(words)) in\
+        u' {0} '.format(u' '.join(get_words(text)))
+
+
+def get_search_tokens(model, objects):
+    """
+    Args:
+        - model: the name of the model of the objects
+        - objects: list of (object id, patient id, text) tuples
+
+    Returns:
+        The unsaved search tokens of the objects, which can be saved\
+        at once with bulk_create
+    """
+    return [SearchToken(healthperson_id=patient_id, model=model,
+                        object_id=object_id, token=token)
+            for (object_id, patient_id, text) in objects
+            for token in get_tokens(patient_id, text)]
+
+
+def update_search_tokens(model, objects):
+    """
+    Replace the search tokens of objects, with a fixed number of
+    queries per chunk of objects.
+
+    Args:
+        - model: the name of the model of the objects
+        - objects: list of (object id, patient id, text) tuples
+    """
+    for start in range(0, len(objects), SEARCH_CHUNK_SIZE):
+        chunk = objects[start:start + SEARCH_CHUNK_SIZE]
+        remove_search_tokens(model, [values[0] for values in chunk])
+        SearchToken.objects.bulk_create(
+            get_search_tokens(model, chunk), batch_size=SEARCH_CHUNK_SIZE)
+
+
+def remove_search_tokens(model, object_ids):
+    """
+    Args:
+        - model: the name of the model of the objects
+        - object_ids: the primary keys of the objects
+    """
+    SearchToken.objects.filter(
+        model=model, object_id__in=object_ids).delete()
+
+
+def search_objects(models, patient_id, searchterm):
+    """
+    Search the objects of several models with one query.
+
+    Args:
+        - models: the names of the models of the objects
+        - patient_id: the primary key of the patient
+        - searchterm: the search term
+
+    Returns:
+        A dict with the sorted primary keys per model name of the\
+        objects of the patient which contain all indexed words of the\
+        search term, the objects should still be checked with\
+        :func:`text_matches`
+    """
+    tokens = get_tokens(patient_id, searchterm)
+    if not tokens:
+        return {}
+    # counted here, with a GROUP BY the database could choose the
+    # (model, object_id) index and scan all tokens of the model
+    matches = Counter(SearchToken.objects.filter(
+        healthperson_id=patient_id, model__in=models,
+        token__in=tokens).values_list('model', 'object_id'))
+    object_ids = {}
+    for ((model, object_id), count) in sorted(matches.items()):
+        if count == len(tokens):
+            object_ids.setdefault(model, []).append(object_id)
+    return object_ids
+
+
+def search_object_ids(model, patient_id, searchterm):
+    """
+    Args:
+        - model: the name of the model of the objects
+        - patient_id: the primary key of the patient
+        - searchterm: the search term
+
+    Returns:
+        A list with the primary keys of the objects of the patient\
+        which contain all indexed words of the search term, see\
+        :func:`search_objects`
+    """
+    return search_objects([model], patient_id, searchterm).get(model, [])
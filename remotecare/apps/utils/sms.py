@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+This module contains the SMS backends, comparable to the e-mail
+backends of Django. The backend is selected with settings.SMS_BACKEND:
+
+- :class:`MessageBirdBackend` sends the messages with MessageBird and\
+  keeps one HTTP session per thread
+- :class:`LocmemBackend` stores the messages in :data:`outbox`,\
+  used by the tests
+- :class:`ConsoleBackend` prints the messages, used in DEBUG mode
+
+Messages with the same content are sent with one request to multiple
+recipients (at most max_recipients of the backend) and the requests
+of all threads are limited to settings.SMS_RATE_LIMIT per second.
+
+Usage:
+
+.. code-block:: python
+
+    errors = get_sms_backend().send_messages([
+        (mobile_number, content), ...])
+
+:subtitle:`Class and function definitions:`
+"""
+import json
+import logging
+import threading
+import time
+import messagebird
+import requests
+from collections import OrderedDict
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# The messages sent with the LocmemBackend, a dict with the
+# 'recipients' (the mobile number) and 'message' per message
+outbox = []
+
+# The backend instances per thread
+_local = threading.local()
+
+
+class RateLimiter(object):
+    """
+    Limits the number of requests per second over all threads
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_request = 0.0
+
+    def wait(self, rate):
+        """
+        Wait until the next request is allowed
+
+        Args:
+            - rate: the maximum number of requests per second,\
+              no limit if None
+        """
+        if not rate:
+            return
+        with self.lock:
+            now = time.time()
+            request_time = max(self.next_request, now)
+            self.next_request = request_time + 1.0 / rate
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+rate_limiter = RateLimiter()
+
+
+class BaseSMSBackend(object):
+    """
+    Base class for the SMS backends, subclasses implement :meth:`send`
+    """
+    # The maximum number of recipients per request
+    max_recipients = 1
+
+    def send(self, recipients, content):
+        """
+        Send one message to the recipients with one request
+
+        Args:
+            - recipients: list of mobile numbers
+            - content: the content of the message
+        """
+        raise NotImplementedError
+
+    def send_messages(self, messages):
+        """
+        Send the messages, messages with the same content are sent
+        with one request per max_recipients recipients.
+
+        Args:
+            - messages: list of (mobile_number, content) tuples
+
+        Returns:
+            A list with None for every sent message and the exception\
+            for every failed message
+        """
+        groups = OrderedDict()
+        for (index, (mobile_number, content)) in enumerate(messages):
+            groups.setdefault(content, []).append((index, mobile_number))
+
+        errors = [None] * len(messages)
+        for (content, recipients) in groups.items():
+            for start in range(0, len(recipients), self.max_recipients):
+                batch = recipients[start:start + self.max_recipients]
+                rate_limiter.wait(settings.SMS_RATE_LIMIT)
+                try:
+                    self.send([mobile_number
+                               for (index, mobile_number) in batch], content)
+                except Exception as e:
+                    logger.exception('Sending a SMS failed')
+                    for (index, mobile_number) in batch:
+                        errors[index] = e
+        return errors
+
+
+class SessionClient(messagebird.Client):
+    """
+    MessageBird client which reuses one HTTP session (and its
+    connections) for all requests
+    """
+    def __init__(self, access_key):
+        super(SessionClient, self).__init__(access_key)
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Authorization': 'AccessKey ' + access_key,
+            'User-Agent': 'MessageBird/ApiClient/{0} Python/{1}'.format(
+                messagebird.client.CLIENT_VERSION,
+                messagebird.client.PYTHON_VERSION),
+            'Content-Type': 'application/json'})
+
+    def request(self, path, method='GET', params={}):
+        url = messagebird.client.urljoin(messagebird.client.ENDPOINT, path)
+        if method == 'GET':
+            response = self.session.get(url, verify=True, params=params)
+        else:
+            response = self.session.post(
+                url, verify=True, data=json.dumps(params))
+
+        if response.status_code not in self._supported_status_codes:
+            response.raise_for_status()
+        json_response = response.json()
+
+        if 'errors' in json_response:
+            raise messagebird.client.ErrorException([
+                messagebird.client.Error().load(e)
+                for e in json_response['errors']])
+        return json_response
+
+
+class MessageBirdBackend(BaseSMSBackend):
+    """
+    Sends the messages with MessageBird
+    """
+    max_recipients = 50
+
+    def __init__(self):
+        self.client = SessionClient(settings.MESSAGE_BIRD_ACCESS_KEY)
+
+    def send(self, recipients, content):
+        self.client.message_create(
+            'RemoteCare', recipients, content, {'reference': 'RemoteCare'})
+
+
+class LocmemBackend(BaseSMSBackend):
+    """
+    Stores the messages in :data:`outbox`, one entry per recipient
+    """
+    max_recipients = 50
+
+    def send(self, recipients, content):
+        for mobile_number in recipients:
+            outbox.append({'recipients': mobile_number, 'message': content})
+
+
+class ConsoleBackend(BaseSMSBackend):
+    """
+    Prints the messages
+    """
+    max_recipients = 50
+
+    def send(self, recipients, content):
+        for mobile_number in recipients:
+            print(('sms_to: {0}, message: {1}'.format(
+                mobile_number, content)))
+
+
+def get_sms_backend():
+    """
+    Returns:
+        The instance of settings.SMS_BACKEND of the current thread
+    """
+    backends = getattr(_local, 'backends', None)
+    if backends is None:
+        backends = _local.backends = {}
+
+    backend = backends.get(settings.SMS_BACKEND)
+    if backend is None:
+        backend = backends[settings.SMS_BACKEND] =\
+            import_string(settings.SMS_BACKEND)()
+    return backend
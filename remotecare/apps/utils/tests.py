@@ -8,7 +8,14 @@ in Remote Care.
 """
 import cStringIO
 import pyPdf
-from django.test import TestCase
+import smtplib
+import time
+from StringIO import StringIO
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from django.test import RequestFactory
 from apps.utils.docxhelper import render_to_DocX
 from apps.utils.pdf import render_to_PDF
@@ -16,6 +23,17 @@ from apps.account.models import User, EncryptionKey
 from datetime import datetime
 from docx import opendocx, getdocumenttext
 from core.encryption.random import randomid
+from core.encryption.symmetric import is_encrypted
+from apps.utils import sms
+from apps.utils.sms import BaseSMSBackend, RateLimiter
+from apps.utils.notifications import get_notification_template,\
+    render_notifications
+from apps.utils.models import OutboxMessage
+from apps.utils.outbox import queue_message, claim_messages,\
+    process_outbox, get_outbox_stats, OUTBOX_MAX_ATTEMPTS,\
+    OUTBOX_CLAIM_TIMEOUT
+from apps.utils.utils import queue_sms_to, queue_email_to,\
+    send_emails_to, send_sms_messages, send_authorisation_sms_to
 
 
 class Exports(TestCase):
@@ -127,3 +145,230 @@ class Exports(TestCase):
 
         text[0] = text[0][0:index1] + text[0][index2:]
         self.assertEquals(to_test, text)
+
+
+class CountingEmailBackend(EmailBackend):
+    '''
+    Email backend counting the opened connections, sending to
+    lost@example.com loses the connection once and sending to
+    bad@example.com fails.
+    '''
+    opened = 0
+    lost = False
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to == ['bad@example.com']:
+                raise ValueError('refused')
+            if message.to == ['lost@example.com'] and\
+                    not CountingEmailBackend.lost:
+                CountingEmailBackend.lost = True
+                raise smtplib.SMTPServerDisconnected('lost')
+        return super(CountingEmailBackend, self).send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='apps.utils.tests.CountingEmailBackend')
+class BulkEmailTest(TestCase):
+    '''
+    Test class for sending emails over one connection
+    '''
+    def test_send_emails_to(self):
+        """
+        Test that the emails are sent over as few connections as
+        possible and that failures don't stop the other emails
+        """
+        emails = [('john{0}@example.com'.format(i), u'<p>Bericht</p>')
+                  for i in range(5)]
+        self.assertEqual(send_emails_to(emails), [None] * 5)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].to, ['john0@example.com'])
+        self.assertEqual(mail.outbox[0].subject, 'Remote Care - notificatie')
+
+        # Reconnect after max_per_connection emails
+        CountingEmailBackend.opened = 0
+        self.assertEqual(send_emails_to(emails, max_per_connection=2),
+                         [None] * 5)
+        self.assertEqual(CountingEmailBackend.opened, 3)
+
+        # A lost connection is retried, other errors are returned
+        CountingEmailBackend.opened = 0
+        mail.outbox = []
+        errors = send_emails_to([
+            ('lost@example.com', u'Bericht', 'Onderwerp'),
+            ('bad@example.com', u'Bericht'),
+            ('john@example.com', u'Bericht')])
+        self.assertEqual(errors[0], None)
+        self.assertTrue(isinstance(errors[1], ValueError))
+        self.assertEqual(errors[2], None)
+        self.assertEqual(CountingEmailBackend.opened, 3)
+        self.assertEqual([message.to for message in mail.outbox],
+                         [['lost@example.com'], ['john@example.com']])
+        self.assertEqual(mail.outbox[0].subject, 'Onderwerp')
+
+
+class NotificationTest(TestCase):
+    '''
+    Test class for rendering the notification templates
+    '''
+    def test_render_notifications(self):
+        """
+        Test that the templates are compiled once and every distinct
+        context is rendered once per batch
+        """
+        template_name = 'service/sms/questionnaire_fillin_sms.html'
+        template = get_notification_template(template_name)
+        self.assertIs(get_notification_template(template_name), template)
+
+        rendered = []
+
+        def render(context):
+            rendered.append(context)
+            return template.__class__.render(template, context)
+
+        template.render = render
+        try:
+            contents = render_notifications(template_name, [
+                {'diagnose_display': u'Reuma'},
+                {'diagnose_display': u'Colitis ulcerosa'},
+                {'diagnose_display': u'Reuma'}])
+        finally:
+            del template.render
+        self.assertEqual(len(rendered), 2)
+        self.assertEqual(contents[0], contents[2])
+        self.assertIn(u'controle voor Reuma willen', contents[0])
+        self.assertIn(u'controle voor Colitis ulcerosa', contents[1])
+
+
+class FailingSMSBackend(BaseSMSBackend):
+    '''
+    SMS backend of which the gateway is down
+    '''
+    def send(self, recipients, content):
+        raise ValueError('gateway down')
+
+
+class CountingSMSBackend(sms.LocmemBackend):
+    '''
+    SMS backend counting the requests, sending to 0600000000 fails
+    '''
+    requests = 0
+
+    def send(self, recipients, content):
+        CountingSMSBackend.requests += 1
+        if '0600000000' in recipients:
+            raise ValueError('invalid number')
+        super(CountingSMSBackend, self).send(recipients, content)
+
+
+@override_settings(SMS_BACKEND='apps.utils.tests.CountingSMSBackend')
+class SMSBackendTest(TestCase):
+    '''
+    Test class for the SMS backends
+    '''
+    def test_send_sms_messages(self):
+        """
+        Test that messages with the same content are sent with one
+        request per max_recipients recipients and that the requests
+        are rate limited
+        """
+        sms.outbox = []
+        messages = [('06{0:08d}'.format(i), u'Vul de vragenlijst in')
+                    for i in range(1, 121)]
+        messages.insert(1, ('0612345678', u'Uw code: 1234'))
+        messages.append(('0600000000', u'Uw code: 5678'))
+
+        errors = send_sms_messages(messages)
+        # 3 requests for the 120 equal messages and 1 per other message
+        self.assertEqual(CountingSMSBackend.requests, 5)
+        self.assertEqual(errors[:-1], [None] * 121)
+        self.assertTrue(isinstance(errors[-1], ValueError))
+        self.assertEqual(len(sms.outbox), 121)
+        self.assertEqual(sms.outbox[-1], {
+            'recipients': '0612345678', 'message': u'Uw code: 1234'})
+
+        rate_limiter = RateLimiter()
+        start = time.time()
+        for i in range(6):
+            rate_limiter.wait(100)
+        self.assertTrue(time.time() - start >= 0.05)
+
+
+@override_settings(NOTIFICATION_OUTBOX=True)
+class OutboxTest(TestCase):
+    '''
+    Test class for the notification outbox
+    '''
+    def test_outbox(self):
+        """
+        Test queueing, sending, retrying and the statistics of the
+        outbox messages
+        """
+        sms.outbox = []
+        queue_sms_to('0612345678', u'Uw code: 1234')
+        queue_email_to('john@example.com', u'<p>Bericht</p>', 'Onderwerp')
+
+        # Nothing is sent yet, the messages are stored encrypted
+        self.assertEqual(len(sms.outbox), 0)
+        self.assertEqual(len(mail.outbox), 0)
+        for (recipient, content) in OutboxMessage.objects.values_list(
+                'recipient', 'content'):
+            self.assertTrue(is_encrypted(recipient))
+            self.assertTrue(is_encrypted(content))
+        self.assertEqual(get_outbox_stats()['queue_depth'], 2)
+
+        out = StringIO()
+        call_command('process_outbox', '--once', stdout=out)
+        self.assertIn('Sent 2 messages, 0 failed', out.getvalue())
+        self.assertEqual(sms.outbox, [
+            {'recipients': '0612345678', 'message': u'Uw code: 1234'}])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['john@example.com'])
+        self.assertEqual(mail.outbox[0].subject, 'Onderwerp')
+
+        stats = get_outbox_stats()
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['sent'], 2)
+        for message in OutboxMessage.objects.all():
+            self.assertEqual(message.status, 'sent')
+            self.assertEqual(message.content, '')
+
+        # The login codes are not queued, they are sent directly
+        sms.outbox = []
+        send_authorisation_sms_to('0612345678', u'Uw code: 5678')
+        self.assertEqual(sms.outbox, [
+            {'recipients': '0612345678', 'message': u'Uw code: 5678'}])
+        self.assertEqual(get_outbox_stats()['queue_depth'], 0)
+
+        # A failing message is retried with a backoff
+        with override_settings(
+                SMS_BACKEND='apps.utils.tests.FailingSMSBackend'):
+            message = queue_message('sms', '0612345678', u'Test')
+            for attempt in range(1, OUTBOX_MAX_ATTEMPTS + 1):
+                self.assertEqual(process_outbox(), (0, 1))
+                message = OutboxMessage.objects.get(pk=message.pk)
+                self.assertEqual(message.attempts, attempt)
+                self.assertEqual(message.last_error,
+                                 'ValueError: gateway down')
+                if attempt < OUTBOX_MAX_ATTEMPTS:
+                    self.assertEqual(message.status, 'queued')
+                    self.assertTrue(message.next_attempt_on > timezone.now())
+                    # Not claimed again before the next attempt
+                    self.assertEqual(process_outbox(), (0, 0))
+                    OutboxMessage.objects.filter(pk=message.pk).update(
+                        next_attempt_on=timezone.now())
+            self.assertEqual(message.status, 'failed')
+        self.assertEqual(get_outbox_stats()['failed'], 1)
+
+        # Messages of a stopped worker are claimed again after a timeout
+        message = queue_message('sms', '0612345678', u'Test')
+        self.assertEqual(len(claim_messages()), 1)
+        self.assertEqual(claim_messages(), [])
+        OutboxMessage.objects.filter(pk=message.pk).update(
+            claimed_on=timezone.now() - OUTBOX_CLAIM_TIMEOUT)
+        self.assertEqual(process_outbox(), (1, 0))
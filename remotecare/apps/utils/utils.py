@@ -5,33 +5,35 @@ to Remote Care users.
 
 :subtitle:`Function definitions:`
 """
-import messagebird
-from datetime import date
+import smtplib
+import socket
 from core.encryption.hash import create_hmac
-from apps.mollie.api import Mollie
-from apps.mollie.exceptions import MollieException
 from apps.account.models import User
 from django.conf import settings
 
-from django.template import loader
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.utils.html import strip_tags
 from core.encryption.random import randomkey
+from apps.utils.sms import get_sms_backend
+from apps.utils.notifications import get_patient_context,\
+    render_notification
 
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 
 
-def send_email_to(email_adres, email_content,
-                  subject='Remote Care - notificatie'):
+def create_email(email_adres, email_content,
+                 subject='Remote Care - notificatie'):
     '''
-    Generic function for sending email to email_adres with email_content
+    Create the email message with a text and HTML version
 
     Args:
         - email_adres: the receiver of the email
         - email_content: the body of the email
-    '''
 
+    Returns:
+        The EmailMultiAlternatives instance
+    '''
     from_email, to = 'remotecare@example.com', email_adres
 
     # this strips the html, so people will have the text as well.
@@ -40,12 +42,112 @@ def send_email_to(email_adres, email_content,
     # create the email, and attach the HTML version as well.
     msg = EmailMultiAlternatives(subject, text_content, from_email, [to])
     msg.attach_alternative(email_content, "text/html")
-    msg.send()
+    return msg
+
+
+def send_email_to(email_adres, email_content,
+                  subject='Remote Care - notificatie'):
+    '''
+    Generic function for sending email to email_adres with email_content
+
+    Args:
+        - email_adres: the receiver of the email
+        - email_content: the body of the email
+    '''
+    create_email(email_adres, email_content, subject).send()
+
+
+def send_emails_to(emails, max_per_connection=100):
+    '''
+    Send many emails over one connection to the mail server instead of
+    a connection per email. A new connection is opened after
+    max_per_connection emails and after an error, an email which failed
+    because the connection was lost is retried once.
+
+    Args:
+        - emails: list of (email_adres, email_content) or\
+          (email_adres, email_content, subject) tuples
+        - max_per_connection: the number of emails to send per connection
+
+    Returns:
+        A list with None for every sent email and the exception for\
+        every failed email
+    '''
+    errors = []
+    connection = None
+    sent_on_connection = 0
+    try:
+        for email in emails:
+            msg = create_email(*email)
+            for attempt in range(2):
+                try:
+                    if connection is None:
+                        connection = get_connection()
+                        connection.open()
+                        sent_on_connection = 0
+                    connection.send_messages([msg])
+                    error = None
+                    sent_on_connection += 1
+                    break
+                except Exception as e:
+                    error = e
+                    if connection is not None:
+                        connection.close()
+                    connection = None
+                    if not isinstance(e, (smtplib.SMTPServerDisconnected,
+                                          socket.error)):
+                        break
+            errors.append(error)
+
+            if connection is not None and\
+                    sent_on_connection >= max_per_connection:
+                connection.close()
+                connection = None
+    finally:
+        if connection is not None:
+            connection.close()
+    return errors
+
+
+def queue_email_to(email_adres, email_content,
+                   subject='Remote Care - notificatie'):
+    '''
+    Queue an email in the outbox (see :mod:`apps.utils.outbox`) so the
+    request doesn't wait for the mail server, or send it directly if
+    settings.NOTIFICATION_OUTBOX is False.
+
+    Args:
+        - email_adres: the receiver of the email
+        - email_content: the body of the email
+    '''
+    if settings.NOTIFICATION_OUTBOX:
+        from apps.utils.outbox import queue_message
+        queue_message('email', email_adres, email_content, subject)
+    else:
+        send_email_to(email_adres, email_content, subject)
+
+
+def queue_sms_to(mobile_number, content):
+    '''
+    Queue a SMS message in the outbox (see :mod:`apps.utils.outbox`) so
+    the request doesn't wait for the SMS gateway, or send it directly if
+    settings.NOTIFICATION_OUTBOX is False.
+
+    Args:
+        - mobile_number: the mobile_number to sent the SMS message to
+        - content: The content of the SMS message
+    '''
+    if settings.NOTIFICATION_OUTBOX:
+        from apps.utils.outbox import queue_message
+        queue_message('sms', mobile_number, content)
+    else:
+        send_sms_to(mobile_number, content)
 
 
 def send_authorisation_sms_to(mobile_number, auth_code):
     '''
-    Wrapper function for later usage
+    Wrapper function for later usage. The code is sent directly and
+    not queued in the outbox, the user is waiting for it to log in.
 
     Args:
         - mobile_number: the mobile number to sent auth_code to
@@ -66,47 +168,41 @@ def send_sms_to_patient(patient, content):
     content = str(content)
     if len(content) > 160:
         content = content[:160]
-    send_sms_to(patient.user.mobile_number, content)
+    queue_sms_to(patient.user.mobile_number, content)
 
 
 def send_sms_to(mobile_number, auth_code):
     '''
-    Generic function which sents the sms using Mollie services.
+    Generic function which sents the sms with the SMS backend
+    (see :mod:`apps.utils.sms`).
 
     Args:
         - mobile_number: the mobile_number to sent the SMS message to
         - auth_code: The content of the SMS message
+
+    Returns:
+        True if the message is sent
     '''
-    succes = False
-    if not settings.MOLLIE_FAKE:
-#        try:
-#            Mollie.sendsms(username=settings.MOLLIE_USERNAME,
-#                           password=settings.MOLLIE_PASSWORD,
-#                           originator='RemoteCare',
-#                           recipients=mobile_number,
-#                           message=auth_code,
-#                           molliegw=Mollie.SECURE_MOLLIEGW,
-#                           gateway=Mollie.DUTCH_GW
-#                           )
-#            succes = True
-#        except MollieException:
-#            raise
-#            succes = False
-        try:
-            client = messagebird.Client(settings.MESSAGE_BIRD_ACCESS_KEY)
-            msg = client.message_create('RemoteCare', mobile_number, auth_code, {'reference': 'RemoteCare'})
-            print(msg.__dict__)
-        except messagebird.client.ErrorException as e:
-            raise
-            success = False
-    else:
-        settings.SMS_STORE.append({'recipients': mobile_number,
-                                   'message': auth_code})
+    error = send_sms_messages([(mobile_number, auth_code)])[0]
+    if error is not None:
+        raise error
+    return True
 
-        if not settings.AUTOMATIC_TESTING and settings.DEBUG:
-            print(('sms_to: {0}, message: {1}'.format(
-                mobile_number, auth_code)))
-    return succes
+
+def send_sms_messages(messages):
+    '''
+    Send many SMS messages with the SMS backend of the current thread,
+    messages with the same content are sent with one request to
+    multiple recipients.
+
+    Args:
+        - messages: list of (mobile_number, content) tuples
+
+    Returns:
+        A list with None for every sent message and the exception for\
+        every failed message
+    '''
+    return get_sms_backend().send_messages(messages)
 
 
 def generic_sent_notification_to_patient(patient, sms_template,
@@ -121,23 +217,17 @@ def generic_sent_notification_to_patient(patient, sms_template,
         - sms_template: the sms message to sent to a patient
         - email_template: the email message to sent to a patient
     '''
-    current_date = date.today()
-    context = {
-        'patient': patient,
-        'current_date': current_date,
-        'is_male': patient.user.gender == 'male'}
+    context = get_patient_context(patient)
 
     do_sms = (notification_setting != 'email_only')
     do_email = (notification_setting != 'sms_only')
 
     if do_sms:
-        sms_template = loader.get_template(sms_template)
-        sms_content = sms_template.render(context)
-        send_sms_to(patient.user.mobile_number, sms_content)
+        sms_content = render_notification(sms_template, context)
+        queue_sms_to(patient.user.mobile_number, sms_content)
     if do_email:
-        email_template = loader.get_template(email_template)
-        email_content = email_template.render(context)
-        send_email_to(patient.user.email, email_content)
+        email_content = render_notification(email_template, context)
+        queue_email_to(patient.user.email, email_content)
 
 
 def send_notification_of_new_report(patient):
@@ -326,8 +416,8 @@ def send_password_change_email(url_prefix, request_id, email_adres, email_key,
     html_content = render_to_string(
         'emails/link_to_change_password_email.html', context=context)
 
-    send_email_to(email_adres, html_content,
-                  'Remote Care - Wachtwoord instellen')
+    queue_email_to(email_adres, html_content,
+                   'Remote Care - Wachtwoord instellen')
 
 
 def sent_password_change_request(user, url_prefix,
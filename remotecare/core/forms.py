@@ -101,6 +101,55 @@ class QuerysetWrapper(object):
         raise Exception('The used filter cannot be found: ' + str(kwargs))
 
 
+# Question numbers per form class, see BaseClassForm.get_question_nrs
+QUESTION_NRS = {}
+
+
+def create_question_nrs(fieldsets, field_nrs=None):
+    """
+    Number the questions (fields) in the fieldsets. The fields in
+    unnamed fieldsets are numbered 1, 2, .. the fields in named
+    fieldsets following an unnamed fieldset are numbered as sub
+    questions of the last question: 2.1, 2.2, ..
+
+    Args:
+        - fieldsets: list of (fieldset name, list of field names)
+        - field_nrs: optional dict with the (sub) number per field name\
+          instead of the position in the fieldset.
+
+    Returns:
+        A dict with the question number (string) per field name
+    """
+    question_nrs = {}
+    fieldset_counter = 0
+    field_counter = 0
+    for name, field_names in fieldsets:
+        if not name:
+            fieldset_counter = fieldset_counter + 1
+            old_field_counter = None
+        else:
+            if fieldset_counter != 0:
+                old_field_counter = field_counter
+                field_counter = 0
+            else:
+                old_field_counter = 0
+
+        for field_name in field_names:
+            field_counter = field_counter + 1
+            if field_nrs is not None:
+                number = str(field_nrs.get(field_name, ''))
+            else:
+                number = str(field_counter)
+            if name and fieldset_counter != 0:
+                number = str(old_field_counter) + '.' + number
+            question_nrs[field_name] = number
+
+        if old_field_counter:
+            field_counter = old_field_counter
+
+    return question_nrs
+
+
 class BaseClassForm(object):
     '''
     Base class form which holds the functions shared among
@@ -154,6 +203,37 @@ class BaseClassForm(object):
                 self.form_fieldsets = [(None, [field for field in self])]
         return self.form_fieldsets
 
+    def get_question_nrs(self):
+        """
+        Returns:
+            A dict with the question number per field name, calculated
+            once per form class if Meta.fieldsets is defined, else once
+            per form.
+        """
+        form_class = self.__class__
+        if form_class in QUESTION_NRS:
+            return QUESTION_NRS[form_class]
+        if hasattr(self, 'form_question_nrs'):
+            return self.form_question_nrs
+
+        if hasattr(self, 'Meta'):
+            fieldsets = getattr(self.Meta, 'fieldsets', None)
+        else:
+            fieldsets = None
+        field_nrs = getattr(self, 'field_nrs', None)
+
+        if fieldsets:
+            question_nrs = create_question_nrs(
+                [(name, fieldset['fields']) for name, fieldset in fieldsets],
+                field_nrs)
+            # The fieldsets are the same for every form of this class
+            QUESTION_NRS[form_class] = question_nrs
+        else:
+            question_nrs = create_question_nrs(
+                [(None, [field.name for field in self])], field_nrs)
+            self.form_question_nrs = question_nrs
+        return question_nrs
+
     def queryset_speed_up(self):
         """
         Dramatically decreases the amount of queries necessary
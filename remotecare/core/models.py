@@ -277,7 +277,9 @@ class ModelAuditMixin(object):
     def auditfields(self):
         if not hasattr(self, 'cached_auditfields'):
             fields = [(field.name, field) for field in self._meta.fields]
-            exclude_list = self.DEFAULT_EXCLUDE_FIELDS
+            # Don't extend the class attribute, which would grow
+            # with every instance
+            exclude_list = list(self.DEFAULT_EXCLUDE_FIELDS)
             if hasattr(self, 'AUDIT_IGNORE_FIELDS'):
                 exclude_list += self.AUDIT_IGNORE_FIELDS
             fields = self.remove_excluded_fields(fields, exclude_list)
@@ -286,7 +288,11 @@ class ModelAuditMixin(object):
 
     @property
     def _dict(self):
-        return model_to_dict(self, self.auditfields.keys())
+        # Deferred fields are not loaded, so they can't be changed
+        deferred_fields = self.get_deferred_fields()
+        return model_to_dict(self, [
+            name for (name, field) in self.auditfields.items()
+            if field.attname not in deferred_fields])
 
     def get_changed_by_user(self):
         user = None
@@ -346,6 +352,29 @@ class ModelAuditMixin(object):
         return log_entry
 
 
+def save_audit_entries(log_entries):
+    """
+    Saves a list of audit entries with one query
+
+    Args:
+        - log_entries: list of unsaved LogEntry instances
+    """
+    from apps.audit.models import LogEntry
+    to_save = []
+    for log_entry in log_entries:
+        if not log_entry.added_by_id:
+            # In debug mode this raises an error,
+            # but in production, save the json to the logger.
+            logger.info(log_entry.json)
+        else:
+            to_save.append(log_entry)
+
+    if len(to_save) == 1:
+        to_save[0].save()
+    elif to_save:
+        LogEntry.objects.bulk_create(to_save)
+
+
 class AuditBaseModel(models.Model, ModelAuditMixin):
     """
     Basemodel which automatically
@@ -366,6 +395,19 @@ class AuditBaseModel(models.Model, ModelAuditMixin):
         Override the save method to include
         the audit functions
         """
+        log_entry = self.save_without_audit_entry(**kwargs)
+        if log_entry:
+            save_audit_entries([log_entry])
+
+    def save_without_audit_entry(self, **kwargs):
+        """
+        Saves the instance without saving the audit entry, which
+        allows saving the audit entries of multiple instances at once
+        with :func:`save_audit_entries`.
+
+        Returns:
+            The unsaved audit entry (LogEntry) or None
+        """
         log_entry = None
         old_id = self.id
         if self.add_audit:
@@ -377,12 +419,23 @@ class AuditBaseModel(models.Model, ModelAuditMixin):
         if self.add_audit and log_entry:
             if old_id is None:
                 log_entry.update_changes({'id': self.id})
-            if not log_entry.added_by_id:
-                # In debug mode this raises an error,
-                # but in production, save the json to the logger.
-                logger.info(log_entry.json)
-            else:
-                log_entry.save()
+            return log_entry
+        return None
+
+    def get_update_audit_entry(self):
+        """
+        Returns the audit entry for the changes of an instance which is
+        saved with a bulk update (e.g. QuerySet.update) instead of save,
+        the entries can be saved at once with :func:`save_audit_entries`.
+
+        Returns:
+            The unsaved audit entry (LogEntry) or None
+        """
+        log_entry = None
+        if self.add_audit and not hasattr(self, 'disable_auditing'):
+            log_entry = self.get_audit_entry()
+            self.set_initial()
+        return log_entry
 
     class Meta:
         abstract = True
@@ -425,6 +478,10 @@ class Creator(object):
         # obj = the model instance
         if obj is None:
             raise AttributeError('Can only be accessed via an instance.')
+        if self.field.attname not in obj.__dict__:
+            # A deferred field (see QuerySet.defer), load and decrypt it
+            # on first access like Django's DeferredAttribute
+            obj.refresh_from_db(fields=[self.field.attname])
         return obj.__dict__[self.field.name]
 
     def __set__(self, obj, value):
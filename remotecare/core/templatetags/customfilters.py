@@ -9,6 +9,7 @@ for Django templates.
 from django import template
 from core.encryption.symmetric import decrypt as symmetric_decrypt
 from core.encryption.random import randomkey
+from core.forms import create_question_nrs
 
 register = template.Library()
 
@@ -118,43 +119,14 @@ def get_field(value, field=None):
 @register.filter(name='get_question_nr')
 def get_question_nr(value, field=None):
     '''
-    Get the question number of a question...
-    #Note it would be a speed improvement to move
-    this as a attribute on the fields in the forms.
-    '''
-    number = ''
-    fieldset_counter = 0
-    field_counter = 0
-    for fieldset in value.fieldsets():
-
-        if not fieldset[0]:
-            fieldset_counter = fieldset_counter + 1
-            old_field_counter = None
-        else:
-            if fieldset_counter != 0:
-                old_field_counter = field_counter
-                field_counter = 0
-            else:
-                old_field_counter = 0
-
-        for field_set_field in fieldset[1]:
-            field_counter = field_counter + 1
-            if field_set_field.name == field.name:
-                if fieldset[0] and fieldset_counter != 0:
-
-                    if hasattr(value, 'field_nrs'):
-                        number = str(old_field_counter) + '.' +\
-                            str(value.field_nrs[field_set_field.name])
-                    else:
-                        number = str(old_field_counter) + '.' +\
-                            str(field_counter)
-                else:
-                    if hasattr(value, 'field_nrs'):
-                        number = str(value.field_nrs[field_set_field.name])
-                    else:
-                        number = str(field_counter)
-
-        if old_field_counter:
-            field_counter = old_field_counter
-
-    return number
+    Get the question number of a question, the numbers are
+    calculated once per form class (see BaseClassForm.get_question_nrs).
+    '''
+    if hasattr(value, 'get_question_nrs'):
+        question_nrs = value.get_question_nrs()
+    else:
+        question_nrs = create_question_nrs(
+            [(name, [fieldset_field.name for fieldset_field in fields])
+             for name, fields in value.fieldsets()],
+            getattr(value, 'field_nrs', None))
+    return question_nrs.get(field.name, '')
@@ -9,10 +9,11 @@ that were not covered by other tests in the apps.
 :subtitle:`Class definitions:`
 """
 import datetime
-from django.forms import TextInput
+from django.forms import TextInput, CharField
 from django.test import TestCase
 from core.forms import DisplayWidget, ChoiceOtherField, YesNoChoiceField,\
-    FormDateField, NONE_YES_NO_CHOICES
+    FormDateField, NONE_YES_NO_CHOICES, BaseForm
+from core.templatetags.customfilters import get_question_nr
 from core.models import YesNoChoiceField as ModelYesNoChoiceField,\
     CheckBoxIntegerField, CheckBoxCharField
 from core.widgets import SelectDateWidget
@@ -64,6 +65,45 @@ class CoreTests(TestCase):
         self.assertEqual(
             yes_no_choicefield.widget.choices, NONE_YES_NO_CHOICES)
 
+    def check_question_nrs(self):
+        """
+        Checks the question numbering of forms with fieldsets
+        """
+        class QuestionForm(BaseForm):
+            first = CharField()
+            second = CharField()
+            sub_first = CharField()
+            sub_second = CharField()
+            third = CharField()
+
+            class Meta:
+                fieldsets = (
+                    (None, {'fields': ('first', 'second')}),
+                    ('sub', {'fields': ('sub_first', 'sub_second')}),
+                    (None, {'fields': ('third',)}),
+                )
+
+        expected = {'first': '1', 'second': '2', 'sub_first': '2.1',
+                    'sub_second': '2.2', 'third': '3'}
+        form = QuestionForm()
+        self.assertEqual(form.get_question_nrs(), expected)
+        # calculated once per form class
+        self.assertIs(QuestionForm().get_question_nrs(),
+                      form.get_question_nrs())
+        for field in form:
+            self.assertEqual(
+                get_question_nr(form, field), expected[field.name])
+
+        # with predefined numbers
+        class NumberedQuestionForm(QuestionForm):
+            field_nrs = {'first': 2, 'second': 1, 'sub_first': 2,
+                         'sub_second': 1, 'third': 3}
+
+        self.assertEqual(
+            NumberedQuestionForm().get_question_nrs(),
+            {'first': '2', 'second': '1', 'sub_first': '2.2',
+             'sub_second': '2.1', 'third': '3'})
+
     def check_models(self):
         """
         Checks parts from the models module
@@ -102,5 +142,6 @@ class CoreTests(TestCase):
         Only checks parts that are not covered by other Remote Care tests
         """
         self.check_forms()
+        self.check_question_nrs()
         self.check_models()
         self.check_widgets()
@@ -3,10 +3,10 @@
 Module providing a baseclass for unittests based on 'TestCase'
 """
 import json
-from django.conf import settings
 from django.core import mail, serializers
 from django.test import TestCase
 from core.forms import FormDateField, ChoiceOtherField
+from apps.utils import sms
 
 
 class BaseUnitTest(TestCase):  # pragma: no cover
@@ -24,7 +24,7 @@ class BaseUnitTest(TestCase):  # pragma: no cover
         Reset/empty the mailbox and SMS store
         """
         mail.outbox = []
-        settings.SMS_STORE = []
+        sms.outbox = []
 
     @property
     def SMS_STORE(self):
@@ -33,7 +33,7 @@ class BaseUnitTest(TestCase):  # pragma: no cover
             The sms_store which is an array containing
             all catched SMS messages
         """
-        return settings.SMS_STORE
+        return sms.outbox
 
     @property
     def mail_outbox(self):
@@ -84,11 +84,18 @@ MOLLIE_USERNAME = 'ExampleIncRemoteCare'
 MOLLIE_PASSWORD = 'aez8eiGh'
 MESSAGE_BIRD_ACCESS_KEY = 'PleaseChangeMe'
 
+# The backend for sending SMS messages (see apps.utils.sms) and the
+# maximum number of requests per second to the SMS provider
+SMS_BACKEND = 'apps.utils.sms.MessageBirdBackend'
+SMS_RATE_LIMIT = 10
+
 # Keys for encryption for sms authentication and password change request
 MASTER_KEY = 'EiF9aizooxaquae2iV4ceing9Eir2gea3Ol6Aech1to3ke5ohl2Pheid8aeng0ei'
 SMS_KEY = 'Ol6Aech1to3k'
 EMAIL_KEY = 'F9aizooxaqu'
 USER_KEY = 'ke5ohl2Pheid8aen'
+# Key for encrypting the messages in the notification outbox
+OUTBOX_KEY = 'iuR4quoh9Fah7ooquei0Saeb'
 
 # HMAC SEARCH keys for fields on User model
 FIRSTNAME_SEARCH_KEY = 'Vohv3ugheef1'
@@ -102,6 +109,12 @@ EMAIL_SEARCH_KEY = 'Vohv3ugheef1'
 API_ENCRYPTION_KEY = 'Vohv3ugheef1'
 API_HASH_KEY = 'Vohv3ugheef1'
 
+# HMAC key for the patient pseudonyms in research exports
+RESEARCH_EXPORT_KEY = 'oe3Daiv4ahFa'
+
+# HMAC key for the search tokens of messages and answers
+SEARCH_INDEX_KEY = 'Ahng0ohquah3Eiph'
+
 # Email host
 EMAIL_HOST = 'localhost'
 DEFAULT_FROM_EMAIL = SERVER_EMAIL = 'Remote Care <noreply.remotecare@example.com>'
@@ -426,26 +439,32 @@ if 'test' in sys.argv or 'jenkins' in sys.argv:
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': 'mydatabase'
     }
-    MOLLIE_FAKE = True
-    # Store sent SMS in settings instead
+    # Store sent SMS in apps.utils.sms.outbox instead
     # so can be checked by tests
-    SMS_STORE = []
+    SMS_BACKEND = 'apps.utils.sms.LocmemBackend'
+    SMS_RATE_LIMIT = None
     AUTOMATIC_TESTING = True
 
+    # Send SMS and e-mail directly instead of via the outbox
+    NOTIFICATION_OUTBOX = False
+
     # Set this to True to disable auditing during testing
     # saves approx 5 seconds.
     DISABLE_AUDITING_DURING_TEST = False
     MIGRATION_MODULES = DisableMigrations()
 else:
-    MOLLIE_FAKE = False  # pragma: no cover
-    AUTOMATIC_TESTING = False
+    AUTOMATIC_TESTING = False  # pragma: no cover
+    # Queue user facing SMS and e-mail messages in the outbox, these are
+    # sent by the process_outbox management command which is started by
+    # uwsgi (see uwsgi.ini). The login codes are always sent directly.
+    NOTIFICATION_OUTBOX = True
     DISABLE_AUDITING_DURING_TEST = False
 
 if DEBUG:
     # Don't sent SMS or EMAIL when in DEBUG mode
     # E-mail & SMS will be printed to stdout instead
-    MOLLIE_FAKE = True
-    SMS_STORE = []
+    if not AUTOMATIC_TESTING:
+        SMS_BACKEND = 'apps.utils.sms.ConsoleBackend'
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
     # Cannot use XSendFile directive in DEBUG setting